@@ -0,0 +1,598 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+aligners.py - Aligner backends used by generate_alignments.py to align
+a consensus sequence against the batches of a genome bin.
+
+Every backend writes the alignments it finds to a file object in the
+RMBlast .sc format, one header line per hit:
+
+  239 13.93 0.00 1.61 chr1:10001-70000 10469 10592 (59408) DF0000002 1 124 (187)
+
+optionally followed by the alignment text, so the rest of the
+pipeline (hit_store.py, score_thresholds.py...) does not care which
+backend produced the file. Thresholds only need the header lines, so
+both backends can leave the alignment text out (alignments=False, the
+--score_only option of the drivers); the alignment of any hit can be
+recovered afterwards with generate_alignments.explainHits.
+
+Two backends are available:
+ - rmblast: runs the rbn script around rmblastn. The path of rbn is
+   taken from the --rbn argument, the DFAM_RBN environment variable,
+   or the PATH, in that order.
+ - numpy: an in-process Smith-Waterman aligner vectorized with NumPy,
+   using the GC tuned matrices in ../data/matrices and the gap
+   parameters of the consensus. It needs no external binaries, so
+   small genomes and test fixtures can go through the whole pipeline
+   anywhere; it is far too slow for hg38.
+
+AUTHOR(S):
+    Eric Yeh
+"""
+
+#
+# Module imports
+#
+import os
+import tempfile
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+import numpy as np
+
+from instrument import runChild
+
+RBN_ENV = "DFAM_RBN"
+DEFAULT_RBN = "rbn"
+COMPLEMENT = str.maketrans("ACGTRYKMSWNXacgtrykmswnx",
+                        "TGCAYRMKSWNXtgcayrmkswnx")
+TRANSITIONS = set(["AG", "GA", "CT", "TC"])
+ALIGNMENT_WIDTH = 50
+NEG_INF = -(1 << 30)
+# -masklevel of every backend, 101 keeping every hit however much of
+# it a higher scoring hit covers
+MASKLEVEL = 101
+
+class Aligner(ABC):
+    """
+    Interface of the aligner backends.
+
+    Fields:
+        name - name of the backend, as given to --aligner.
+        alignments - whether the alignment text is written after each
+            header line.
+        timeout - seconds after which the aligner process is killed,
+            None for no limit; aligners running in this process (e.g.
+            numpy) are not limited.
+    """
+    name = None
+    alignments = True
+    timeout = None
+
+    @abstractmethod
+    def align(self, consensus, bin_file, matrix_file, stdout, stderr,
+            st=None):
+        """
+        align(self, consensus, bin_file, matrix_file, stdout, stderr,
+        st) - Aligns the given ConsensusSequence against every batch
+        of bin_file using matrix_file, writing the alignments to the
+        file object stdout and any diagnostics to stderr.
+
+        Args:
+            st - stage (see instrument.py) the alignment runs under,
+                to which child processes and hit counts are added.
+
+        Returns: exit status, 0 on success.
+        """
+
+class RMBlastAligner(Aligner):
+    """
+    Runs the rbn wrapper around rmblastn.
+
+    Fields:
+        rbn - path of the rbn script.
+        minscore - smallest score reported.
+        alignments - whether rmblastn writes the alignment text (-a).
+    """
+    name = "rmblast"
+
+    def __init__(self, rbn=None, minscore=50, alignments=True):
+        if rbn == None:
+            rbn = os.environ.get(RBN_ENV, DEFAULT_RBN)
+        self.rbn = rbn
+        self.minscore = minscore
+        self.alignments = alignments
+
+    def params(self, consensus, bin_file, matrix_file, query_file):
+        """
+        params(self, consensus, bin_file, matrix_file, query_file) -
+        Command line running rbn on the given consensus, read from
+        query_file, and bin.
+        """
+        params = [ self.rbn,
+                bin_file, query_file,
+                "-matrix", matrix_file,
+                "-gi", str(consensus.gi),
+                "-ge", str(consensus.ge),
+                "-minmatch", "7",
+                "-masklevel", str(MASKLEVEL),
+                "-minscore", str(self.minscore) ]
+        if self.alignments:
+            params.append("-a")
+        return params + [ "-r" ]
+
+    def align(self, consensus, bin_file, matrix_file, stdout, stderr,
+            st=None):
+        with queryFile(consensus) as query_file:
+            params = self.params(consensus, bin_file, matrix_file, query_file)
+            print(" ".join(params))
+            return runChild(params, stdout, stderr, st, self.timeout)
+
+@contextmanager
+def queryFile(consensus):
+    """
+    queryFile(consensus) - Path of an fa file holding the given
+    ConsensusSequence, for aligners that read their query from a file.
+    Consensus sequences read from a library (see consensus_store.py)
+    have no file of their own; theirs is written, header line
+    included, to the local temporary directory and removed once the
+    alignment is done.
+    """
+    if consensus.fname != None:
+        yield consensus.fname
+        return
+    fd, path = tempfile.mkstemp(prefix=consensus.name + ".", suffix=".fa")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(consensus.header + "\n")
+            for i in range(0, len(consensus.seq), 60):
+                f.write(consensus.seq[i:i + 60] + "\n")
+        yield path
+    finally:
+        os.remove(path)
+
+def readMatrix(matrix_file):
+    """
+    readMatrix(matrix_file) - Reads a scoring matrix from
+    ../data/matrices: an optional "# FREQS" line, a header row with
+    the genome letters, then one row per consensus letter.
+
+    Returns: (rows, cols, scores) - the consensus letters, the genome
+        letters and the int32 array of scores indexed [row, col].
+    """
+    rows = []
+    scores = []
+    cols = None
+    f = open(matrix_file, "r")
+    for line in f:
+        tokens = line.split()
+        if len(tokens) == 0 or tokens[0] == "#":
+            continue
+        if cols == None:
+            cols = tokens
+        else:
+            rows.append(tokens[0])
+            scores.append([int(x) for x in tokens[1:]])
+    f.close()
+    return rows, cols, np.array(scores, dtype=np.int32)
+
+def encode(seq, letters):
+    """
+    encode(seq, letters) - Indices of the bases of seq in letters.
+    Lower case bases are scored as upper case ones, and any letter
+    missing from the matrix as N.
+    """
+    lookup = np.full(256, letters.index("N"), dtype=np.int32)
+    for i, c in enumerate(letters):
+        lookup[ord(c)] = i
+        lookup[ord(c.lower())] = i
+    return lookup[np.frombuffer(seq.encode(), dtype=np.uint8)]
+
+def readBatches(bin_file):
+    """
+    readBatches(bin_file) - Yields the (name, sequence) of every batch
+    in the given bin file.
+    """
+    name = None
+    seq = []
+    f = open(bin_file, "r")
+    for line in f:
+        if line[0] == ">":
+            if name != None:
+                yield name, "".join(seq)
+            name = line[1:].split()[0]
+            seq = []
+        else:
+            seq.append(line.strip())
+    f.close()
+    if name != None:
+        yield name, "".join(seq)
+
+def reverseComplement(seq):
+    return seq.translate(COMPLEMENT)[::-1]
+
+def scanHits(profile, subject, gi, ge, min_score):
+    """
+    scanHits(profile, subject, gi, ge, min_score) - Finds the local
+    alignments of a query against a subject scoring at least
+    min_score.
+
+    The dynamic programming matrix is filled one subject position
+    (column) at a time, every operation working on a whole column.
+    Horizontal gaps and matches only depend on the previous column;
+    vertical gaps, which run down the column, are found with a prefix
+    maximum (np.maximum.accumulate) over the column instead of a loop.
+    A gap of length L scores gi + (L - 1) * ge.
+
+    Along with its score, each cell carries the cell where its
+    alignment starts, so each start defines one alignment, ending at
+    the best scoring cell that has that start.
+
+    Args:
+        profile - int32 array where profile[c, i] is the score of
+            query position i against subject letter c.
+        subject - encoded subject (see encode).
+        gi, ge - gap init and gap extension scores (negative).
+        min_score - smallest score reported.
+
+    Returns: dict mapping the (query, subject) start of each alignment
+        (1-based) to (score, query end, subject end).
+    """
+    m = profile.shape[1]
+    rows = np.arange(m + 1, dtype=np.int64)
+    h = np.zeros(m + 1, dtype=np.int64)
+    h_q = np.zeros(m + 1, dtype=np.int64)
+    h_s = np.zeros(m + 1, dtype=np.int64)
+    e = np.full(m + 1, NEG_INF, dtype=np.int64)
+    e_q = np.zeros(m + 1, dtype=np.int64)
+    e_s = np.zeros(m + 1, dtype=np.int64)
+    best = {}
+    for j in range(1, len(subject) + 1):
+        # horizontal gaps, from the previous column
+        extend = e + ge > h + gi
+        e = np.where(extend, e + ge, h + gi)
+        e_q = np.where(extend, e_q, h_q)
+        e_s = np.where(extend, e_s, h_s)
+
+        # matches, starting a new alignment where the diagonal is 0
+        h0 = np.zeros(m + 1, dtype=np.int64)
+        h0[1:] = h[:-1] + profile[subject[j - 1]]
+        fresh = np.ones(m + 1, dtype=bool)
+        fresh[1:] = h[:-1] <= 0
+        h0_q = np.where(fresh, rows, np.roll(h_q, 1))
+        h0_s = np.where(fresh, j, np.roll(h_s, 1))
+        use_e = e > h0
+        h0 = np.where(use_e, e, h0)
+        h0_q = np.where(use_e, e_q, h0_q)
+        h0_s = np.where(use_e, e_s, h0_s)
+        h0 = np.maximum(h0, 0)
+        h0[0] = 0
+
+        # vertical gaps: f[i] = max over k < i of
+        #   h0[k] + gi + (i - 1 - k) * ge
+        t = h0 - rows * ge
+        top = np.maximum.accumulate(t)
+        top_k = np.maximum.accumulate(np.where(t >= top, rows, 0))
+        f = np.full(m + 1, NEG_INF, dtype=np.int64)
+        f[1:] = top[:-1] + gi + rows[:-1] * ge
+        k = np.zeros(m + 1, dtype=np.int64)
+        k[1:] = top_k[:-1]
+        use_f = f > h0
+        h = np.where(use_f, f, h0)
+        h_q = np.where(use_f, h0_q[k], h0_q)
+        h_s = np.where(use_f, h0_s[k], h0_s)
+
+        cells = np.nonzero(h >= min_score)[0]
+        if len(cells) == 0:
+            continue
+        # best cell of each alignment in this column
+        order = cells[np.argsort(-h[cells], kind="stable")]
+        keys = h_q[order] * (len(subject) + 1) + h_s[order]
+        keys, first = np.unique(keys, return_index=True)
+        for i in order[first]:
+            start = (int(h_q[i]), int(h_s[i]))
+            if start not in best or h[i] > best[start][0]:
+                best[start] = (int(h[i]), int(i), j)
+    return best
+
+def alignPath(profile, subject, gi, ge):
+    """
+    alignPath(profile, subject, gi, ge) - Finds
+    the best local alignment of the given query and subject, and the
+    path it takes. Used on the region of a hit found by scanHits, so
+    the matrices kept for the traceback stay small.
+
+    Returns: (score, query start, subject start, ops) where ops is the
+        list of operations along the alignment: "M" for aligned bases,
+        "D" for query bases missing from the subject and "I" for
+        subject bases missing from the query.
+    """
+    m = profile.shape[1]
+    n = len(subject)
+    rows = np.arange(m + 1, dtype=np.int64)
+    h = np.zeros(m + 1, dtype=np.int64)
+    e = np.full(m + 1, NEG_INF, dtype=np.int64)
+    # per cell: source of h0 (0 start, 1 diagonal, 2 horizontal gap),
+    # whether h came from a vertical gap and where it opened, and
+    # whether the horizontal gap was extended
+    h0_src = np.zeros((n + 1, m + 1), dtype=np.int8)
+    f_src = np.zeros((n + 1, m + 1), dtype=bool)
+    f_k = np.zeros((n + 1, m + 1), dtype=np.int32)
+    e_ext = np.zeros((n + 1, m + 1), dtype=bool)
+    best = (0, 0, 0)
+    for j in range(1, n + 1):
+        extend = e + ge > h + gi
+        e = np.where(extend, e + ge, h + gi)
+        e_ext[j] = extend
+        h0 = np.zeros(m + 1, dtype=np.int64)
+        h0[1:] = h[:-1] + profile[subject[j - 1]]
+        src = np.ones(m + 1, dtype=np.int8)
+        use_e = e > h0
+        h0 = np.where(use_e, e, h0)
+        src[use_e] = 2
+        src[h0 <= 0] = 0
+        h0 = np.maximum(h0, 0)
+        h0[0] = 0
+        src[0] = 0
+        h0_src[j] = src
+        t = h0 - rows * ge
+        top = np.maximum.accumulate(t)
+        top_k = np.maximum.accumulate(np.where(t >= top, rows, 0))
+        f = np.full(m + 1, NEG_INF, dtype=np.int64)
+        f[1:] = top[:-1] + gi + rows[:-1] * ge
+        use_f = f > h0
+        f_src[j] = use_f
+        f_k[j, 1:] = top_k[:-1]
+        h = np.where(use_f, f, h0)
+        i = int(np.argmax(h))
+        if h[i] > best[0]:
+            best = (int(h[i]), i, j)
+
+    score, i, j = best
+    ops = []
+    state = "H"
+    while i > 0 and j > 0:
+        if state == "H":
+            if f_src[j, i]:
+                k = int(f_k[j, i])
+                ops.extend(["D"] * (i - k))
+                i = k
+                state = "H0"
+            else:
+                state = "H0"
+        elif state == "H0":
+            src = h0_src[j, i]
+            if src == 0:
+                break
+            if src == 1:
+                ops.append("M")
+                i -= 1
+                j -= 1
+                state = "H"
+            else:
+                state = "E"
+        else:
+            ops.append("I")
+            extended = e_ext[j, i]
+            j -= 1
+            if not extended:
+                state = "H"
+    ops.reverse()
+    return score, i + 1, j + 1, ops
+
+class NumpyAligner(Aligner):
+    """
+    In-process Smith-Waterman aligner vectorized with NumPy.
+
+    Fields:
+        minscore - smallest score reported.
+        masklevel - a hit is dropped when more than masklevel percent
+            of its genome bases are covered by a single higher scoring
+            hit, as with the -masklevel option of RMBlast; 101 (the
+            MASKLEVEL of every backend) keeps every hit.
+        alignments - whether to write the alignment text after each
+            header line, as with the -a option of RMBlast.
+    """
+    name = "numpy"
+
+    def __init__(self, minscore=50, masklevel=MASKLEVEL, alignments=True):
+        self.minscore = minscore
+        self.masklevel = masklevel
+        self.alignments = alignments
+
+    def align(self, consensus, bin_file, matrix_file, stdout, stderr,
+            st=None):
+        rows, cols, scores = readMatrix(matrix_file)
+        profile = np.ascontiguousarray(scores[encode(consensus.seq, rows)].T)
+        hits = 0
+        for name, batch in readBatches(bin_file):
+            for hit in self.alignBatch(consensus, profile, batch, cols):
+                stdout.write(self.formatHit(consensus, name, len(batch),
+                                        hit))
+                hits += 1
+        if st != None:
+            st.set(hits=hits)
+        return 0
+
+    def alignBatch(self, consensus, profile, batch, cols):
+        """
+        alignBatch(self, consensus, profile, batch, cols) - Aligns the
+        consensus against both strands of the given batch.
+
+        Returns: list of hits, as dicts with the score, the strand, the
+            1-based inclusive consensus and batch coordinates, and the
+            alignment ops (see alignPath), best first.
+        """
+        hits = []
+        for strand, seq in [(1, batch), (-1, reverseComplement(batch))]:
+            subject = encode(seq, cols)
+            found = scanHits(profile, subject, consensus.gi, consensus.ge,
+                            self.minscore)
+            for (q_start, s_start), (score, q_end, s_end) in found.items():
+                # redo the alignment on its own region for the path
+                score, qs, ss, ops = alignPath(profile[:, q_start - 1:q_end],
+                        subject[s_start - 1:s_end], consensus.gi, consensus.ge)
+                q_start += qs - 1
+                s_start += ss - 1
+                hit = {"score": score, "strand": strand, "ops": ops,
+                    "cons_start": q_start, "cons_end": q_end,
+                    "text": (seq[s_start - 1:s_end],
+                            consensus.seq[q_start - 1:q_end])}
+                if strand == 1:
+                    hit["start"], hit["end"] = s_start, s_end
+                else:
+                    hit["start"] = len(batch) - s_end + 1
+                    hit["end"] = len(batch) - s_start + 1
+                hits.append(hit)
+        hits.sort(key=lambda x: (-x["score"], x["start"]))
+        return self.maskHits(hits)
+
+    def maskHits(self, hits):
+        """
+        maskHits(self, hits) - Drops the hits (sorted best first)
+        mostly covered by a higher scoring one, see masklevel.
+        """
+        kept = []
+        for hit in hits:
+            length = hit["end"] - hit["start"] + 1
+            masked = False
+            for other in kept:
+                covered = (min(hit["end"], other["end"]) -
+                        max(hit["start"], other["start"]) + 1)
+                if covered * 100 > self.masklevel * length:
+                    masked = True
+                    break
+            if not masked:
+                kept.append(hit)
+        return kept
+
+    def formatHit(self, consensus, name, batch_len, hit):
+        """
+        formatHit(self, consensus, name, batch_len, hit) - The header
+        line of the given hit, followed by its alignment text if
+        alignments are on.
+
+        Divergence is the percentage of mismatched aligned bases, and
+        deletions/insertions the percentages of consensus/genome bases
+        left unaligned, relative to the length of the hit in the
+        genome.
+        """
+        ops = hit["ops"]
+        s_text, q_text = hit["text"]
+        mismatches = 0
+        s_pos = 0
+        q_pos = 0
+        s_row = []
+        q_row = []
+        for op in ops:
+            if op == "M":
+                s_row.append(s_text[s_pos])
+                q_row.append(q_text[q_pos])
+                if s_text[s_pos].upper() != q_text[q_pos].upper():
+                    mismatches += 1
+                s_pos += 1
+                q_pos += 1
+            elif op == "D":
+                s_row.append("-")
+                q_row.append(q_text[q_pos])
+                q_pos += 1
+            else:
+                s_row.append(s_text[s_pos])
+                q_row.append("-")
+                s_pos += 1
+        aligned = max(ops.count("M"), 1)
+        length = hit["end"] - hit["start"] + 1
+        div = 100.0 * mismatches / aligned
+        dels = 100.0 * ops.count("D") / length
+        ins = 100.0 * ops.count("I") / length
+        m = len(consensus.seq)
+        if hit["strand"] == 1:
+            cons = "%s %d %d (%d)" % (consensus.name, hit["cons_start"],
+                                    hit["cons_end"], m - hit["cons_end"])
+        else:
+            cons = "C %s (%d) %d %d" % (consensus.name, m - hit["cons_end"],
+                                    hit["cons_end"], hit["cons_start"])
+        out = ("%5d %.2f %.2f %.2f %s %d %d (%d) %s\n" % (hit["score"], div,
+                dels, ins, name, hit["start"], hit["end"],
+                batch_len - hit["end"], cons))
+        if not self.alignments:
+            return out
+        if hit["strand"] == -1:
+            # show the genome forward and the consensus complemented
+            s_row = list(reverseComplement("".join(s_row)))
+            q_row = list(reverseComplement("".join(q_row)))
+        out += "\n" + self.formatAlignment(consensus.name, name, hit,
+                                        s_row, q_row) + "\n"
+        return out
+
+    def formatAlignment(self, cons_name, name, hit, s_row, q_row):
+        """
+        formatAlignment(self, cons_name, name, hit, s_row, q_row) -
+        Alignment text of a hit in blocks of ALIGNMENT_WIDTH columns:
+        the genome, a line marking transitions (i), transversions (v)
+        and gaps (-), and the consensus.
+        """
+        marks = []
+        for s, q in zip(s_row, q_row):
+            if s == "-" or q == "-":
+                marks.append("-")
+            elif s.upper() == q.upper():
+                marks.append(" ")
+            elif s.upper() + q.upper() in TRANSITIONS:
+                marks.append("i")
+            else:
+                marks.append("v")
+        label = "C " + cons_name if hit["strand"] == -1 else cons_name
+        width = max(len(name), len(label))
+        s_pos = hit["start"]
+        if hit["strand"] == 1:
+            q_pos = hit["cons_start"]
+            q_step = 1
+        else:
+            q_pos = hit["cons_end"]
+            q_step = -1
+        blocks = []
+        for b in range(0, len(s_row), ALIGNMENT_WIDTH):
+            s_block = "".join(s_row[b:b + ALIGNMENT_WIDTH])
+            q_block = "".join(q_row[b:b + ALIGNMENT_WIDTH])
+            s_bases = len(s_block) - s_block.count("-")
+            q_bases = len(q_block) - q_block.count("-")
+            s_end = s_pos + s_bases - 1
+            q_end = q_pos + q_step * (q_bases - 1)
+            blocks.append(
+                "  %-*s %10d %s %d\n" % (width, name, s_pos, s_block, s_end) +
+                "  %-*s %10s %s\n" % (width, "", "",
+                                "".join(marks[b:b + ALIGNMENT_WIDTH])) +
+                "  %-*s %10d %s %d\n" % (width, label, q_pos, q_block, q_end))
+            s_pos = s_end + 1
+            q_pos = q_end + q_step
+        return "\n".join(blocks)
+
+ALIGNERS = {
+        RMBlastAligner.name: RMBlastAligner,
+        NumpyAligner.name: NumpyAligner
+    }
+
+def getAligner(name, **kwargs):
+    """
+    getAligner(name, **kwargs) - Creates the aligner backend of the
+    given name ("rmblast" or "numpy"), passing kwargs to it.
+    """
+    if name not in ALIGNERS:
+        raise ValueError("unknown aligner " + str(name) + ", expected one of " +
+                ", ".join(sorted(ALIGNERS)))
+    return ALIGNERS[name](**kwargs)
+
+def fromArgs(args):
+    """
+    fromArgs(args) - Creates the aligner backend chosen on the command
+    line of a driver: args.aligner, run through args.rbn for rmblast,
+    leaving the alignment text out with args.score_only (arguments a
+    driver does not have take their defaults).
+    """
+    if args.aligner == RMBlastAligner.name:
+        aligner = getAligner(args.aligner, rbn=getattr(args, "rbn", None))
+    else:
+        aligner = getAligner(args.aligner)
+    aligner.alignments = not getattr(args, "score_only", False)
+    return aligner
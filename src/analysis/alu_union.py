@@ -1,13 +1,19 @@
-import re
+import argparse
 import os
-import subprocess
+import sys
 
 from sequence_util import nearestDivergence
+from interval_union import storesToArrays, countMerged, fdrCurve
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hit_store import loadHits
+from sc_io import findScFile
 
 gc = "p37g.sc"
+GC_BINS = [35, 37, 39, 41, 43, 45, 47, 49, 51, 53]
 
-def getAlus():
-	f = open("alu_list.txt", "r")
+def getAlus(fname="alu_list.txt"):
+	f = open(fname, "r")
 	alus = []
 	for line in f.readlines():
 		alu = line.split()
@@ -16,69 +22,14 @@ def getAlus():
 		alus.append((consensus, str(div)))
 	return alus
 
-def getHits(fname):
-	hits = {}
-
-	f = open(fname, "r")
-	regex = re.compile(r"^\s*(\d+)(\s+\d+\.\d+){3}\s+(\d+):(\d+)\-\d+\s+(\d+)\s+(\d+)")
-
-	line = f.readline()
-	while line != "":
-		mo = regex.search(line)
-		if mo:
-			chrom = mo.group(3)
-			start = int(mo.group(4)) + int(mo.group(5)) - 1
-			end = int(mo.group(4)) + int(mo.group(6))
-			score = int(mo.group(1))
-			if chrom not in hits:
-				hits[chrom] = []
-			hits[chrom].append(((start, end), score))
-		line = f.readline()
-	f.close()
-
-	return hits
-
-def getAllHits(alus, path):
-	hits = {}
+def getAllHits(alus, path, gc=gc):
+	# Returns a dict of chromosome to (starts, ends, scores) arrays,
+	# sorted by start
+	stores = []
 	for alu in alus:
 		fname = alu[0] + "/" + alu[0] + "_" + alu[1] + gc
-		new_hits = getHits(os.path.join(path, fname))
-		for key in new_hits:
-			if key not in hits:
-				hits[key] = []
-			hits[key] = hits[key] + new_hits[key]
-	return hits
-
-def sort1(elem):
-	return elem[0][1]
-
-def sort2(elem):
-	return elem[0][0]
-
-def writeToBed(chrom, hits_list, threshold):
-	# Filter hits
-	hits = list(filter(lambda x : x[1] > threshold, hits_list))
-
-	# Takes in a list of hits on one chromosome
-	# Sorts the list in this function
-	hits.sort(key=sort1)
-	hits.sort(key=sort2)
-	bed = open("temp.bed", "w") # temp.bed
-	for hit in hits:
-		bed.write(chrom + "\t" + str(hit[0][0]) + "\t" + str(hit[0][1]) + "\n")
-	bed.close()
-
-def countMerged(hits, threshold):
-	# hits is a dict, chromosomes are keys and list of hits are vals
-	count = 0
-	for chrom in hits:
-		writeToBed(chrom, hits[chrom], threshold)
-		ps = subprocess.Popen((["bedtools", "merge", "-i", "temp.bed"]), stdout=subprocess.PIPE)
-		output = subprocess.check_output(("wc", "-l"), stdin=ps.stdout)
-		ps.wait()
-
-		count += int(output.strip())
-	return count
+		stores.append(loadHits(findScFile(os.path.join(path, fname))))
+	return storesToArrays(stores)
 
 def getFDR(genomic_hits, benchmark_hits, threshold):
 	gcount = countMerged(genomic_hits, threshold)
@@ -88,13 +39,27 @@ def getFDR(genomic_hits, benchmark_hits, threshold):
 	return fdr
 
 def main():
-	alus = getAlus()
-	genomic_hits = getAllHits(alus, "../../results/genomic_hits/")
-	benchmark_hits = getAllHits(alus, "../../results/benchmark_hits/")
-
-	thresholds =[128.05, 129.05, 130.05, 131.05, 132.05, 133.05, 134.05, 135.05, 136.05, 137.05, 138.05, 139.05, 140.05, 141.05, 142.05, 143.05, 144.05, 145.05, 146.05, 147.05, 163.05, 166.05, 115.05, 117.05, 118.05, 119.05, 120.05, 121.05, 122.05, 123.05, 124.05, 125.05, 126.05, 127.05]
-	for thresh in thresholds:
-		fdr = getFDR(genomic_hits, benchmark_hits, thresh)
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--list", default="alu_list.txt",
+			help="list of the families to union, one per line as in alu_list.txt")
+	parser.add_argument("--gc", type=int, nargs="+", default=GC_BINS,
+			help="GC backgrounds of the matrices to sweep")
+	parser.add_argument("--thresholds", type=float, nargs="+", default=None,
+			help="only report these thresholds (default: every score)")
+	parser.add_argument("--results", default="../../results/",
+			help="directory containing genomic_hits and benchmark_hits")
+	args = parser.parse_args()
+
+	alus = getAlus(args.list)
+	for b in args.gc:
+		matrix_gc = "p" + str(b) + "g.sc"
+		genomic_hits = getAllHits(alus,
+				os.path.join(args.results, "genomic_hits"), matrix_gc)
+		benchmark_hits = getAllHits(alus,
+				os.path.join(args.results, "benchmark_hits"), matrix_gc)
+		rows = fdrCurve(genomic_hits, benchmark_hits, args.thresholds)
+		for row in rows:
+			print(matrix_gc + "\t" + "\t".join([str(x) for x in row]))
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,213 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+interval_union.py - In-memory replacement for piping hits through
+"bedtools merge | wc -l". Hits are kept as per-chromosome NumPy
+arrays of start, end and score, sorted by start once, so counting the
+merged intervals above a threshold is a mask and a vectorized sweep.
+
+Counts follow bedtools merge: overlapping and book-ended intervals
+(start of one == end of the other) are merged into one.
+
+AUTHOR(S):
+	Eric Yeh
+"""
+
+#
+# Module imports
+#
+import bisect
+
+import numpy as np
+
+def hitsToArrays(hits):
+	"""
+	hitsToArrays(hits) - Converts a dict mapping each chromosome to a
+	list of ((start, end), score) hits into a dict mapping each
+	chromosome to a tuple of (starts, ends, scores) arrays sorted by
+	start.
+	"""
+	intervals = {}
+	for chrom in hits:
+		starts = np.array([h[0][0] for h in hits[chrom]], dtype=np.int64)
+		ends = np.array([h[0][1] for h in hits[chrom]], dtype=np.int64)
+		scores = np.array([h[1] for h in hits[chrom]], dtype=np.int64)
+		intervals[chrom] = sortIntervals(starts, ends, scores)
+	return intervals
+
+def storesToArrays(stores):
+	"""
+	storesToArrays(stores) - Combines the hits of the given HitStores
+	(see hit_store.py) into a dict mapping each chromosome to a tuple
+	of (starts, ends, scores) arrays sorted by start. Starts are
+	zero-based and ends exclusive, as in a BED file.
+	"""
+	parts = {}
+	for store in stores:
+		hits = store.hits
+		if len(hits) == 0:
+			continue
+		order = np.argsort(hits["seq"], kind="stable")
+		seq = hits["seq"][order]
+		bounds = np.flatnonzero(np.diff(seq)) + 1
+		for group in np.split(order, bounds):
+			chrom = store.seqs[hits["seq"][group[0]]]
+			if chrom not in parts:
+				parts[chrom] = []
+			parts[chrom].append(hits[group])
+	intervals = {}
+	for chrom in parts:
+		h = np.concatenate(parts[chrom])
+		intervals[chrom] = sortIntervals(h["start"].astype(np.int64) - 1,
+				h["end"].astype(np.int64), h["score"].astype(np.int64))
+	return intervals
+
+def sortIntervals(starts, ends, scores):
+	"""
+	sortIntervals(starts, ends, scores) - Returns the given arrays
+	reordered by increasing start.
+	"""
+	order = np.argsort(starts, kind="stable")
+	return (starts[order], ends[order], scores[order])
+
+def countMergedSorted(starts, ends):
+	"""
+	countMergedSorted(starts, ends) - Number of intervals left after
+	merging overlapping and book-ended intervals. starts must be
+	sorted in increasing order.
+
+	An interval starts a new merged interval exactly when it starts
+	after the furthest end of every interval before it.
+	"""
+	if len(starts) == 0:
+		return 0
+	reach = np.maximum.accumulate(ends)
+	return 1 + int(np.count_nonzero(starts[1:] > reach[:-1]))
+
+def countMerged(intervals, threshold):
+	"""
+	countMerged(intervals, threshold) - Number of merged intervals,
+	over all chromosomes, made of the hits scoring above threshold.
+
+	Args:
+		intervals - dict of chromosome to (starts, ends, scores),
+			sorted by start (see hitsToArrays).
+		threshold - only hits with score > threshold are counted.
+	"""
+	count = 0
+	for chrom in intervals:
+		starts, ends, scores = intervals[chrom]
+		keep = scores > threshold
+		count += countMergedSorted(starts[keep], ends[keep])
+	return count
+
+def insertInterval(starts, ends, start, end):
+	"""
+	insertInterval(starts, ends, start, end) - Adds [start, end] to
+	the merged intervals described by the sorted lists starts and
+	ends, merging it with every interval it overlaps or touches.
+
+	Returns: the change in the number of merged intervals (1 if the
+		interval was new, 1 - k if it joined k merged intervals).
+	"""
+	i = bisect.bisect_left(ends, start)
+	j = bisect.bisect_right(starts, end)
+	if i == j:
+		starts.insert(i, start)
+		ends.insert(i, end)
+		return 1
+	new_start = min(start, starts[i])
+	new_end = max(end, ends[j - 1])
+	starts[i:j] = [new_start]
+	ends[i:j] = [new_end]
+	return 1 - (j - i)
+
+def mergedCountCurve(intervals):
+	"""
+	mergedCountCurve(intervals) - Number of merged intervals for every
+	possible threshold, computed in one pass over the hits in
+	decreasing score order while keeping the merged intervals of each
+	chromosome in sorted lists.
+
+	Args:
+		intervals - dict of chromosome to (starts, ends, scores).
+
+	Returns: tuple (scores, counts) of arrays, where scores holds
+		every distinct hit score in decreasing order and counts[i] is
+		the number of merged intervals made of the hits scoring at
+		least scores[i].
+	"""
+	chroms = list(intervals.keys())
+	if len(chroms) == 0:
+		return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+	chrom_index = np.concatenate([np.full(len(intervals[c][0]), i)
+			for i, c in enumerate(chroms)])
+	starts = np.concatenate([intervals[c][0] for c in chroms])
+	ends = np.concatenate([intervals[c][1] for c in chroms])
+	scores = np.concatenate([intervals[c][2] for c in chroms])
+	order = np.argsort(-scores, kind="stable")
+
+	merged = [([], []) for c in chroms]
+	curve_scores = []
+	curve_counts = []
+	count = 0
+	for k in order:
+		score = scores[k]
+		if len(curve_scores) > 0 and curve_scores[-1] == score:
+			curve_counts.pop()
+		else:
+			curve_scores.append(score)
+		m_starts, m_ends = merged[chrom_index[k]]
+		count += insertInterval(m_starts, m_ends, int(starts[k]), int(ends[k]))
+		curve_counts.append(count)
+	return (np.array(curve_scores, dtype=np.int64),
+			np.array(curve_counts, dtype=np.int64))
+
+def countsAt(curve, thresholds):
+	"""
+	countsAt(curve, thresholds) - Looks up the number of merged
+	intervals made of the hits scoring above each threshold in a curve
+	produced by mergedCountCurve.
+	"""
+	scores, counts = curve
+	thresholds = np.asarray(thresholds, dtype=np.float64)
+	# scores are decreasing, so n[i] curve points score > thresholds[i]
+	n = np.searchsorted(-scores, -thresholds, side="left")
+	result = np.zeros(len(thresholds), dtype=np.int64)
+	above = n > 0
+	result[above] = counts[n[above] - 1]
+	return result
+
+def fdrCurve(genomic, benchmark, thresholds=None):
+	"""
+	fdrCurve(genomic, benchmark) - Union-based false discovery rate for
+	every useful threshold, from one sweep over the genomic hits and
+	one over the benchmark hits.
+
+	Thresholds follow the score_thresholds convention of score + 0.05:
+	by default each distinct score s found in either set gives the
+	threshold s - 0.95, which keeps exactly the hits scoring at least s.
+
+	Args:
+		genomic - dict of chromosome to (starts, ends, scores) of the
+			genomic hits.
+		benchmark - same for the benchmark hits.
+		thresholds - optional list of thresholds to report instead.
+
+	Returns: list of (threshold, genomic merged, benchmark merged, fdr)
+		in decreasing threshold order. fdr is None when no genomic
+		hit is above the threshold.
+	"""
+	gcurve = mergedCountCurve(genomic)
+	bcurve = mergedCountCurve(benchmark)
+	if thresholds == None:
+		scores = np.unique(np.concatenate((gcurve[0], bcurve[0])))
+		thresholds = [round(float(s) - 0.95, 2) for s in scores]
+	thresholds = sorted(thresholds, reverse=True)
+	gcounts = countsAt(gcurve, thresholds)
+	bcounts = countsAt(bcurve, thresholds)
+	rows = []
+	for t, g, b in zip(thresholds, gcounts, bcounts):
+		fdr = 1.0 * b / g if g > 0 else None
+		rows.append((t, int(g), int(b), fdr))
+	return rows
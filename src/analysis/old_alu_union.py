@@ -13,9 +13,14 @@ AUTHOR(S):
 #
 import argparse
 import os
-import re
+import sys
 
 from sequence_util import nearestDivergence
+from interval_union import storesToArrays, countMerged
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hit_store import loadHits
+from sc_io import findScFile
 
 def getAlus():
 	f = open("alu_list.txt", "r")
@@ -27,36 +32,21 @@ def getAlus():
 		alus.append((consensus, str(div)))
 	return alus
 
-def convertToBed(fname, bed, threshold):
-	print("converting")
-	f = open(fname, "r")
-	scoreRegex = re.compile(r"^\s*(\d+)(\s+\d+\.\d+){3}\s+(\d+):(\d+)\-\d+\s+(\d+)\s+(\d+)")
-
-	line = f.readline()
-	while line != "":
-		mo = scoreRegex.search(line)
-		if mo and int(mo.group(1)) > threshold:
-			start = int(mo.group(4)) + int(mo.group(5))
-			end = int(mo.group(4)) + int(mo.group(6))
-			bed.write(mo.group(3) + "\t" + str(start) + "\t" + str(end) + "\n")
-		line = f.readline()
-
-def alusToBed(threshold, alus, bpath, dirpath):
-	bed = open(bpath, "w")
+def alusToIntervals(alus, dirpath):
+	stores = []
 	for alu in alus:
 		fpath = dirpath + alu[0] + "/" + alu[0] + "_" + alu[1] + "p43g.sc"
-		convertToBed(fpath, bed, threshold)
-	bed.close()
-
-def makeBeds(threshold, alus):
-	alusToBed(threshold, alus, "genomic_alus.bed", "../../results/genomic_hits/")
-	alusToBed(threshold, alus, "benchmark_alus.bed", "../../results/benchmark_hits/")
-
-def splitChromosomes(fpath):
-	f = open(fpath)
-	for line in f.readlines():
-		print()
-	f.close()
+		stores.append(loadHits(findScFile(fpath)))
+	return storesToArrays(stores)
+
+def countUnion(threshold, alus):
+	genomic = alusToIntervals(alus, "../../results/genomic_hits/")
+	benchmark = alusToIntervals(alus, "../../results/benchmark_hits/")
+	gcount = countMerged(genomic, threshold)
+	bcount = countMerged(benchmark, threshold)
+	print(str(threshold) + "\t" + str(gcount) + "\t" + str(bcount) + "\t" +
+			str(1.0 * bcount / gcount))
+	return gcount, bcount
 
 def main():
 	parser = argparse.ArgumentParser()
@@ -64,7 +54,7 @@ def main():
 
 	alus = getAlus()
 
-	makeBeds(120.05, alus)
+	countUnion(120.05, alus)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+test_interval_union.py
+
+A quick test suite for interval_union.py, checking the merged counts
+against the rules of "bedtools merge". Can simply be run as:
+
+$ python test_interval_union.py
+
+AUTHOR(S):
+	Eric Yeh
+"""
+
+import random
+
+from interval_union import hitsToArrays, countMerged, fdrCurve
+
+def bedtoolsMergeCount(intervals):
+	"""
+	bedtoolsMergeCount(intervals) - Reference count of the lines
+	"bedtools merge" prints for the given (start, end) intervals of
+	one chromosome: sorted by start, an interval is merged into the
+	current one if it starts at or before the current end.
+	"""
+	count = 0
+	current_end = None
+	for start, end in sorted(intervals):
+		if current_end == None or start > current_end:
+			count += 1
+			current_end = end
+		else:
+			current_end = max(current_end, end)
+	return count
+
+def randomHits(rng, n, span):
+	hits = {}
+	for i in range(n):
+		chrom = rng.choice(["1", "2", "X"])
+		start = rng.randrange(span)
+		end = start + rng.randrange(1, 300)
+		if chrom not in hits:
+			hits[chrom] = []
+		hits[chrom].append(((start, end), rng.randrange(50, 400)))
+	return hits
+
+def test_countMerged():
+	rng = random.Random(0)
+	for n, span in [(0, 10), (1, 10), (50, 1000), (2000, 100000), (2000, 5000)]:
+		hits = randomHits(rng, n, span)
+		intervals = hitsToArrays(hits)
+		for threshold in [0, 100.05, 200.05, 399.05, 1000]:
+			expected = 0
+			for chrom in hits:
+				expected += bedtoolsMergeCount([h[0] for h in hits[chrom]
+						if h[1] > threshold])
+			assert countMerged(intervals, threshold) == expected
+
+def test_bookEnded():
+	hits = {"1": [((0, 10), 100), ((10, 20), 100), ((21, 30), 100),
+			((25, 26), 100), ((5, 8), 100)]}
+	assert countMerged(hitsToArrays(hits), 0) == 2
+
+def test_fdrCurve():
+	rng = random.Random(1)
+	genomic = hitsToArrays(randomHits(rng, 3000, 200000))
+	benchmark = hitsToArrays(randomHits(rng, 1000, 200000))
+	for row in fdrCurve(genomic, benchmark):
+		assert row[1] == countMerged(genomic, row[0])
+		assert row[2] == countMerged(benchmark, row[0])
+	thresholds = [60.05, 128.05, 129.05, 500.05]
+	rows = fdrCurve(genomic, benchmark, thresholds)
+	assert [r[0] for r in rows] == sorted(thresholds, reverse=True)
+	for row in rows:
+		assert row[1] == countMerged(genomic, row[0])
+		assert row[2] == countMerged(benchmark, row[0])
+
+if __name__ == '__main__':
+	test_countMerged()
+	test_bookEnded()
+	test_fdrCurve()
+	print("Tests finished for interval_union.py")
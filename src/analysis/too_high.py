@@ -1,52 +1,194 @@
-import re
-
-# For score thresholds that are too high!
-# Find the low complexity sequences that score high in benchmark genome
-
-def main(fpath):
-	consensus_size = 5102
-	counts = [0] * consensus_size
-	ranges = []
-
-	regex1 = re.compile(r"(\d+)\s+(\d+)\s+\(\d+\)\s*$")
-	regex2 = re.compile(r"\(\d+\)\s+(\d+)\s+(\d+)\s*$")
-	
-	f = open("../../results/benchmark_hits/DF0000187/DF0000187_" + fpath, "r")
-	line = f.readline()
-	while line != "":
-		mo1 = regex1.search(line)
-		mo2 = regex2.search(line)
-		if mo1:
-			start = int(mo1.group(1))
-			end = int(mo1.group(2))
-			ranges.append((start, end))
-		if mo2:
-			start = int(mo2.group(2))
-			end = int(mo2.group(1))
-			ranges.append((start, end))
-		line = f.readline()
-	f.close()
-
-	for r in ranges:
-		for x in range(r[0], r[1]):
-			counts[x] += 1
-
-	return counts
-	
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+too_high.py - For score thresholds that are too high! Finds the
+regions of a consensus sequence that attract benchmark (false) hits,
+e.g. low complexity sequence that scores high in the benchmark genome.
+
+For every matrix of the given family, the consensus coverage of its
+benchmark hits is built with a difference array and a cumulative sum,
+one matrix per process. The output is a compact table of the runs of
+consensus positions with the same coverage:
+
+start\tend\ttotal\t[coverage per matrix...]
+
+with one-based, inclusive positions.
+
+$ python3 too_high.py family [--consensus FA] [--min_score S]
+
+With --explain N, the alignment text of the N best benchmark hits of
+the family (across matrices) is written to [family].explain: each hit
+is aligned again against its own region of the benchmark bins (see
+generate_alignments.explainHits), so this also works on score-only
+alignment files.
+
+$ python3 too_high.py family --explain N [--bins DIR] [--aligner NAME]
+
+AUTHOR(S):
+	Eric Yeh
+"""
+
+#
+# Module imports
+#
+import argparse
+import os
+import sys
+from multiprocessing import Pool
+
+import numpy as np
+
+# ahead of this directory: generate_alignments.py needs the
+# sequence_util.py of the pipeline, not the older copy here
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+		".."))
+from sequence_util import consensusSize
+from hit_store import loadHits
+from sc_io import isScFile, plainName, findScFile
+from generate_alignments import ConsensusSequence, explainHits
+from aligners import ALIGNERS, fromArgs
+
+def consensusRanges(fpath, min_score=0):
+	"""
+	consensusRanges(fpath, min_score) - Reads the consensus start and
+	end of every hit in the given alignment file scoring at least
+	min_score.
+
+	Returns: tuple (starts, ends) of arrays of one-based, inclusive
+		consensus positions.
+	"""
+	hits = loadHits(fpath).hits
+	hits = hits[hits["score"] >= min_score]
+	return (hits["cons_start"].astype(np.int64),
+			hits["cons_end"].astype(np.int64))
+
+def coverage(starts, ends, consensus_size):
+	"""
+	coverage(starts, ends, consensus_size) - Number of ranges covering
+	each position of the consensus, from a difference array: +1 where
+	a range starts, -1 after it ends, then a cumulative sum.
+	"""
+	starts = np.clip(starts, 1, consensus_size)
+	ends = np.clip(ends, 1, consensus_size)
+	diff = (np.bincount(starts - 1, minlength=consensus_size + 1) -
+			np.bincount(ends, minlength=consensus_size + 1))
+	return np.cumsum(diff[:consensus_size])
+
+def __matrixCoverage__(job):
+	fpath, consensus_size, min_score = job
+	starts, ends = consensusRanges(fpath, min_score)
+	return coverage(starts, ends, consensus_size)
+
+def familyCoverage(family, consensus_size, hits_dir, min_score=0,
+		processes=None):
+	"""
+	familyCoverage(family, consensus_size, hits_dir) - Coverage of the
+	consensus by the hits of every matrix of the given family.
+
+	Returns: tuple (matrices, counts) where counts is an array with one
+		row per matrix and one column per consensus position.
+	"""
+	family_dir = os.path.join(hits_dir, family)
+	files = sorted(set([plainName(f) for f in os.listdir(family_dir)
+			if isScFile(f)]))
+	matrices = [f[len(family) + 1:-3] for f in files]
+	jobs = [(findScFile(os.path.join(family_dir, f)), consensus_size,
+			min_score) for f in files]
+	with Pool(processes) as pool:
+		counts = pool.map(__matrixCoverage__, jobs)
+	if len(counts) == 0:
+		return matrices, np.zeros((0, consensus_size), dtype=np.int64)
+	return matrices, np.vstack(counts)
+
+def writeTable(matrices, counts, out):
+	"""
+	writeTable(matrices, counts, out) - Writes the runs of positions
+	with identical coverage in every matrix as one row each.
+	"""
+	out.write("start\tend\ttotal\t" + "\t".join(matrices) + "\n")
+	total = counts.sum(axis=0)
+	if len(total) == 0:
+		return
+	changed = np.any(counts[:, 1:] != counts[:, :-1], axis=0)
+	run_starts = np.concatenate(([0], np.nonzero(changed)[0] + 1))
+	run_ends = np.concatenate((run_starts[1:], [len(total)]))
+	for s, e in zip(run_starts, run_ends):
+		out.write(str(s + 1) + "\t" + str(e) + "\t" + str(total[s]) + "\t" +
+				"\t".join([str(c) for c in counts[:, s]]) + "\n")
+
+def explainTopHits(family, consensus_file, hits_dir, bins_dir, matrices_dir,
+		aligner, n, out, min_score=0):
+	"""
+	explainTopHits(family, consensus_file, hits_dir, bins_dir,
+	matrices_dir, aligner, n, out) - Writes the alignment text of the
+	n best hits of the given family, across its matrices, to out.
+
+	Returns: number of hits written.
+	"""
+	family_dir = os.path.join(hits_dir, family)
+	files = sorted(set([plainName(f) for f in os.listdir(family_dir)
+			if isScFile(f)]))
+	stores = {}
+	top = []
+	for f in files:
+		matrix = f[len(family) + 1:-3]
+		stores[matrix] = loadHits(findScFile(os.path.join(family_dir, f)))
+		scores = stores[matrix].scores()
+		for i in np.nonzero(scores >= min_score)[0]:
+			top.append((-int(scores[i]), matrix, int(i)))
+	top = sorted(top)[:n]
+	cs = ConsensusSequence(consensus_file)
+	written = 0
+	for matrix in sorted(set([t[1] for t in top])):
+		store = stores[matrix]
+		idx = [t[2] for t in top if t[1] == matrix]
+		gc = matrix.split("p")[1][:-1]
+		out.write("# " + matrix + "\n")
+		written += explainHits(cs, store.hits[idx], store.seqs,
+				os.path.join(bins_dir, "bin" + gc + ".fa"),
+				os.path.join(matrices_dir, matrix + ".matrix"), aligner, out)
+	return written
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument("family",
+			help="name of the consensus sequence, e.g. DF0000187")
+	parser.add_argument("--consensus", default=None,
+			help="fa file of the consensus sequence (default: " +
+				"../../data/consensus/Dfam_HG38_Families.fa_/[family].fa)")
+	parser.add_argument("--hits", default="../../results/benchmark_hits/",
+			help="directory containing the benchmark hits")
+	parser.add_argument("--min_score", type=int, default=0,
+			help="only count hits scoring at least this much")
+	parser.add_argument("-p", "--processes", type=int, default=None,
+			help="number of worker processes")
+	parser.add_argument("--explain", type=int, default=0, metavar="N",
+			help="write the alignments of the N best hits to " +
+				"[family].explain")
+	parser.add_argument("--bins", default="../../data/hg38bins/benchmark_bins",
+			help="bins the hits were found in, for --explain")
+	parser.add_argument("--matrices", default="../../data/matrices",
+			help="directory of the matrices, for --explain")
+	parser.add_argument("--aligner", default="rmblast",
+			choices=sorted(ALIGNERS),
+			help="aligner backend used by --explain, see aligners.py")
+	parser.add_argument("--rbn", default=None,
+			help="path of the rbn script run by the rmblast aligner")
+	args = parser.parse_args()
+
+	consensus = args.consensus
+	if consensus == None:
+		consensus = os.path.join("../../data/consensus/Dfam_HG38_Families.fa_",
+				args.family + ".fa")
+	matrices, counts = familyCoverage(args.family, consensusSize(consensus),
+			args.hits, args.min_score, args.processes)
+	writeTable(matrices, counts, sys.stdout)
+
+	if args.explain > 0:
+		aligner = fromArgs(args)
+		with open(args.family + ".explain", "w") as out:
+			explainTopHits(args.family, consensus, args.hits, args.bins,
+					args.matrices, aligner, args.explain, out, args.min_score)
+
 if __name__ == '__main__':
-	seqs = []
-	seqs.append(main("14p35g.sc"))
-	seqs.append(main("14p37g.sc"))
-	seqs.append(main("14p39g.sc"))
-	seqs.append(main("14p41g.sc"))
-	seqs.append(main("14p43g.sc"))
-	seqs.append(main("14p45g.sc"))
-	seqs.append(main("14p47g.sc"))
-	seqs.append(main("14p49g.sc"))
-	seqs.append(main("14p51g.sc"))
-	seqs.append(main("14p53g.sc"))
-
-	final = [0] * 5102
-	for x in range(5102):
-		final[x] = seqs[0][x] + seqs[1][x] + seqs[2][x] + seqs[3][x] + seqs[4][x] + seqs[5][x] + seqs[6][x] + seqs[7][x] + seqs[8][x] + seqs[9][x]
-	print(final)
+	main()
@@ -0,0 +1,361 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+annotate.py - Turns the genomic hits of every family of a genome into
+a final annotation with the per-family thresholds, and compares it
+with the annotation given by a single fixed threshold, to answer how
+much annotation improves with per-family thresholds.
+
+Every family with a [family].thresh table is streamed, one alignment
+file at a time. The hits copied by the batch overlaps are dropped (see
+dedup_hits.py) and each hit is kept if it scores at least the final
+threshold of the matrix of its file; since every GC bin has its own
+alignment file, that is the matrix of the GC bin of the batch of the
+hit. Hits are also checked against the fixed threshold (225 by
+default, the RepeatMasker cutoff). No annotation made with the old
+fixed threshold is kept in the tree, so the fixed-threshold annotation
+compared against is rebuilt here from the same deduplicated hits; it
+shows the effect of the thresholds alone, not of any other change
+since the old annotation was made. Kept hits are written to sorted
+runs of at most RUN_SIZE hits and merged by chromosome and start with
+heapq.merge, so memory does not grow with the number of families.
+
+Overlapping annotations of different families are then resolved by a
+per-chromosome sweep line: each base goes to the highest scoring hit
+covering it. The resolved annotations are written as BED files
+(chrom, start, end, family, score, strand) to the output directory,
+annotation.family.bed with the per-family thresholds and
+annotation.fixed.bed with the fixed threshold, along with
+annotation_summary.txt, the hits kept and bases covered by each family
+under both thresholds:
+
+family\thits_family\thits_fixed\tbases_family\tbases_fixed
+
+You can run this script directly, once the thresholds are computed:
+
+$ python3 annotate.py [--genome NAME] [--fixed SCORE] [--output DIR]
+
+AUTHOR(S):
+    Eric Yeh
+"""
+
+#
+# Module imports
+#
+import argparse
+import heapq
+import os
+import shutil
+import tempfile
+
+from hit_store import loadHits
+from dedup_hits import duplicateMask
+from score_thresholds import matrixName, readThresholds
+from sc_io import plainName, findScFile
+from genome_registry import getGenome, GENOME_REGISTRY, DEFAULT_GENOME
+
+FIXED_THRESHOLD = 225
+RUN_SIZE = 1 << 20
+PURGE_MIN = 1024
+SETS = ["family", "fixed"]
+
+def familyHits(hits_dir, thresholds, fixed):
+    """
+    familyHits(hits_dir, thresholds, fixed) - Hits of one family kept
+    under its per-matrix thresholds or the fixed threshold.
+
+    Args:
+        hits_dir - directory of the genomic alignment files of the
+            family.
+        thresholds - dict mapping each matrix to its final threshold;
+            files of other matrices are skipped.
+        fixed - fixed threshold.
+
+    Yields: (chrom, start, end, score, strand, kept by the per-family
+        threshold, kept by the fixed threshold) for each hit kept by
+        either, start zero-based and end exclusive.
+    """
+    for f in sorted(set([plainName(f) for f in os.listdir(hits_dir)])):
+        matrix = matrixName(f)
+        if matrix not in thresholds:
+            continue
+        store = loadHits(findScFile(os.path.join(hits_dir, f)))
+        hits = store.hits[duplicateMask(store.hits)]
+        threshold = thresholds[matrix]
+        hits = hits[(hits["score"] >= threshold) | (hits["score"] >= fixed)]
+        for h in hits:
+            score = int(h["score"])
+            yield (store.seqs[h["seq"]], int(h["start"]) - 1, int(h["end"]),
+                    score, int(h["strand"]), score >= threshold,
+                    score >= fixed)
+
+def writeRun(run, tmp_dir):
+    """
+    writeRun(run, tmp_dir) - Sorts the given hits by chromosome and
+    start and writes them to a new run file in tmp_dir.
+
+    Returns: path of the run file.
+    """
+    run.sort()
+    fd, path = tempfile.mkstemp(dir=tmp_dir, suffix=".run")
+    with os.fdopen(fd, "w") as f:
+        for r in run:
+            f.write("\t".join([str(x) for x in r]) + "\n")
+    return path
+
+def readRun(path):
+    with open(path, "r") as f:
+        for line in f:
+            t = line.rstrip("\n").split("\t")
+            yield (t[0], int(t[1]), int(t[2]), int(t[3]), t[4], int(t[5]),
+                    t[6] == "True", t[7] == "True")
+
+def writeRuns(families, tmp_dir, fixed=FIXED_THRESHOLD, run_size=RUN_SIZE):
+    """
+    writeRuns(families, tmp_dir, fixed, run_size) - Writes the kept
+    hits of the given families to sorted run files of at most run_size
+    hits.
+
+    Args:
+        families - list of (family, hits dir, thresholds).
+
+    Returns: (run files, dict of the hits kept by each family under
+        each set of thresholds)
+    """
+    runs = []
+    run = []
+    counts = {}
+    for family, hits_dir, thresholds in families:
+        c = counts.setdefault(family, dict([(s, 0) for s in SETS]))
+        for chrom, start, end, score, strand, kept, kept_fixed in \
+                familyHits(hits_dir, thresholds, fixed):
+            run.append((chrom, start, end, score, family, strand, kept,
+                        kept_fixed))
+            c["family"] += kept
+            c["fixed"] += kept_fixed
+            if len(run) >= run_size:
+                runs.append(writeRun(run, tmp_dir))
+                run = []
+    if len(run) > 0:
+        runs.append(writeRun(run, tmp_dir))
+    return runs, counts
+
+class OverlapResolver:
+    """
+    Per-chromosome sweep line giving each base to the highest scoring
+    hit covering it. Hits are added sorted by chromosome and start;
+    the active hits are kept in a heap by score. A hit that has ended
+    is dropped once it reaches the top, and the heap is purged of all
+    the ended hits whenever it has doubled in size since the last
+    purge, so memory stays within twice the number of hits
+    overlapping at one point (lower scoring hits under a long, high
+    scoring one would otherwise stay until it ends).
+
+    Fields:
+        out - open file the resolved annotations are written to.
+        covered - dict of the bases given to each family.
+    """
+    def __init__(self, out):
+        self.out = out
+        self.covered = {}
+        self.chrom = None
+        self.active = []
+        self.pos = 0
+        self.added = 0
+        self.segment = None
+        self.purge_at = PURGE_MIN
+
+    def add(self, hit):
+        """
+        add(self, hit) - Adds a (chrom, start, end, score, family,
+        strand) hit, which must not start before the last one added
+        on the same chromosome.
+        """
+        chrom, start = hit[0], hit[1]
+        if chrom != self.chrom:
+            self.sweep(None)
+            self.chrom = chrom
+            self.pos = start
+        else:
+            self.sweep(start)
+            self.pos = max(self.pos, start)
+        self.added += 1
+        # best score first, then the earliest hit
+        heapq.heappush(self.active, (-hit[3], self.added, hit))
+        if len(self.active) >= self.purge_at:
+            self.active = [a for a in self.active if a[2][2] > self.pos]
+            heapq.heapify(self.active)
+            self.purge_at = max(PURGE_MIN, 2 * len(self.active))
+
+    def sweep(self, limit):
+        """
+        sweep(self, limit) - Gives every base before limit (the end of
+        the chromosome if None) to the best active hit covering it.
+        """
+        while len(self.active) > 0 and (limit == None or self.pos < limit):
+            hit = self.active[0][2]
+            if hit[2] <= self.pos:
+                heapq.heappop(self.active)
+                continue
+            end = hit[2] if limit == None else min(hit[2], limit)
+            self.emit(hit, self.pos, end)
+            self.pos = end
+        if limit == None:
+            self.flush()
+
+    def emit(self, hit, start, end):
+        # consecutive pieces of one hit make one annotation
+        if (self.segment != None and self.segment[0] is hit and
+                self.segment[2] == start):
+            self.segment[2] = end
+            return
+        self.flush()
+        self.segment = [hit, start, end]
+
+    def flush(self):
+        if self.segment == None:
+            return
+        hit, start, end = self.segment
+        self.out.write("\t".join([hit[0], str(start), str(end), hit[4],
+                    str(hit[3]), "+" if hit[5] == 1 else "-"]) + "\n")
+        self.covered[hit[4]] = self.covered.get(hit[4], 0) + end - start
+        self.segment = None
+
+    def close(self):
+        self.sweep(None)
+
+def readBed(path):
+    with open(path, "r") as f:
+        for line in f:
+            t = line.split("\t")
+            yield t[0], int(t[1]), int(t[2])
+
+def sharedBases(bed_a, bed_b):
+    """
+    sharedBases(bed_a, bed_b) - Bases covered by both of the given
+    resolved annotations, whose intervals do not overlap and are
+    sorted the same way (chromosomes in merge order, then start).
+    """
+    shared = 0
+    a = readBed(bed_a)
+    b = readBed(bed_b)
+    x = next(a, None)
+    y = next(b, None)
+    while x != None and y != None:
+        if x[0] != y[0]:
+            if x[0] < y[0]:
+                x = next(a, None)
+            else:
+                y = next(b, None)
+            continue
+        shared += max(0, min(x[2], y[2]) - max(x[1], y[1]))
+        if x[2] <= y[2]:
+            x = next(a, None)
+        else:
+            y = next(b, None)
+    return shared
+
+def thresholdedFamilies(hits_root, thresholds_dir):
+    """
+    thresholdedFamilies(hits_root, thresholds_dir) - Families with both
+    genomic hits and a thresholds table.
+
+    Returns: list of (family, hits dir, dict of final threshold by
+        matrix).
+    """
+    families = []
+    for family in sorted(os.listdir(hits_root)):
+        thresh_file = os.path.join(thresholds_dir, family + ".thresh")
+        hits_dir = os.path.join(hits_root, family)
+        if os.path.isdir(hits_dir) and os.path.exists(thresh_file):
+            families.append((family, hits_dir,
+                            readThresholds(thresh_file, family)))
+    return families
+
+def annotate(hits_root, thresholds_dir, output_dir, fixed=FIXED_THRESHOLD,
+        run_size=RUN_SIZE):
+    """
+    annotate(hits_root, thresholds_dir, output_dir, fixed, run_size) -
+    Writes the annotations of the genome with the per-family and the
+    fixed thresholds, and their summary, to output_dir (see the module
+    docstring).
+
+    Args:
+        hits_root - genomic hits directory of the genome, holding one
+            directory of alignment files per family.
+        thresholds_dir - directory of the [family].thresh tables.
+        fixed - fixed threshold compared against.
+        run_size - largest number of hits held in memory for sorting.
+
+    Returns: dict with, for each set of thresholds, the hits kept and
+        the bases covered, and the bases covered by both.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    families = thresholdedFamilies(hits_root, thresholds_dir)
+    tmp_dir = tempfile.mkdtemp(dir=output_dir)
+    try:
+        runs, counts = writeRuns(families, tmp_dir, fixed, run_size)
+        beds = dict([(s, os.path.join(output_dir, "annotation." + s + ".bed"))
+                    for s in SETS])
+        outs = dict([(s, open(beds[s] + ".tmp", "w")) for s in SETS])
+        resolvers = dict([(s, OverlapResolver(outs[s])) for s in SETS])
+        merged = heapq.merge(*[readRun(r) for r in runs],
+                        key=lambda r: (r[0], r[1]))
+        for r in merged:
+            if r[6]:
+                resolvers["family"].add(r[:6])
+            if r[7]:
+                resolvers["fixed"].add(r[:6])
+        for s in SETS:
+            resolvers[s].close()
+            outs[s].close()
+            os.replace(beds[s] + ".tmp", beds[s])
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    summary_file = os.path.join(output_dir, "annotation_summary.txt")
+    with open(summary_file + ".tmp", "w") as f:
+        for family, hits_dir, thresholds in families:
+            f.write("\t".join([family] +
+                    [str(counts[family][s]) for s in SETS] +
+                    [str(resolvers[s].covered.get(family, 0))
+                    for s in SETS]) + "\n")
+    os.replace(summary_file + ".tmp", summary_file)
+
+    result = {"families": len(families),
+            "shared_bases": sharedBases(beds["family"], beds["fixed"])}
+    for s in SETS:
+        result[s] = {"hits": sum([c[s] for c in counts.values()]),
+                    "bases": sum(resolvers[s].covered.values())}
+    return result
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--genome", default=DEFAULT_GENOME,
+            help="registered genome to annotate")
+    parser.add_argument("--registry", default=GENOME_REGISTRY,
+            help="path of the genome registry")
+    parser.add_argument("--fixed", type=float, default=FIXED_THRESHOLD,
+            help="fixed threshold the annotation is compared against")
+    parser.add_argument("--output", default=None,
+            help="output directory (default: annotation in the results " +
+                "directory of the genome)")
+    parser.add_argument("--run_size", type=int, default=RUN_SIZE,
+            help="hits sorted in memory at once")
+    args = parser.parse_args()
+
+    genome = getGenome(args.genome, args.registry)
+    output_dir = args.output
+    if output_dir == None:
+        output_dir = os.path.join(genome.results, "annotation")
+    result = annotate(genome.genomicHits(), genome.thresholdsDir(),
+                output_dir, args.fixed, args.run_size)
+    print(str(result["families"]) + " families annotated in " + output_dir)
+    print("thresholds\thits\tcovered_bases")
+    for s in SETS:
+        print(s + "\t" + str(result[s]["hits"]) + "\t" +
+                str(result[s]["bases"]))
+    gained = result["family"]["bases"] - result["shared_bases"]
+    lost = result["fixed"]["bases"] - result["shared_bases"]
+    print("per-family thresholds cover " + str(gained) + " more bases and " +
+            str(lost) + " fewer bases than the fixed threshold")
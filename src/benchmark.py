@@ -0,0 +1,406 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+benchmark.py - Reproducible performance benchmarks for the hot paths
+of the pipeline, run on a deterministic synthetic genome and synthetic
+alignment files.
+
+Each benchmark runs in its own process so its peak RSS can be
+reported, and is repeated to keep the fastest time. Results can be
+saved as a JSON baseline and later compared against it; the comparison
+fails (exit status 1) when any throughput drops by more than the
+allowed fraction.
+
+$ python3 benchmark.py [--genome_mb MB] [--hits N] [--save FILE]
+        [--compare FILE] [--tolerance T]
+
+AUTHOR(S):
+    Eric Yeh
+"""
+
+#
+# Module imports
+#
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from multiprocessing import get_context
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                    "analysis"))
+
+from bin_genome import binGenome
+from hit_store import parseScFile, storePaths
+from score_histogram import histogramPath
+from score_thresholds import (readScoresFromFile, readHistogramFromFile,
+        empiricalHistogramCalculation, empiricalFDRCalculation,
+        theoreticalFDRCalculation)
+from cache_hits import writeJson
+from sc_io import ScWriter, scPath, zstandard
+from interval_union import storesToArrays, fdrCurve
+
+SEQ_LENGTH = 10000000
+CHUNK_LENGTH = 20000
+ROW_LENGTH = 60
+SC_MATRIX = "25p41g"
+
+def syntheticGenome(fa_file, size, gc_mean=0.41, gc_sd=0.05, seed=0):
+    """
+    syntheticGenome(fa_file, size) - Writes a genome of size bases to
+    fa_file, split into sequences of at most SEQ_LENGTH bases. Every
+    CHUNK_LENGTH bases get a GC fraction drawn from a normal
+    distribution, so the batches spread over the GC bins. The genome
+    only depends on the arguments.
+    """
+    rng = np.random.default_rng(seed)
+    bases = np.frombuffer(b"ACGT", dtype=np.uint8)
+    with open(fa_file, "w") as f:
+        written = 0
+        seq = 1
+        while written < size:
+            length = min(SEQ_LENGTH, size - written)
+            chunks = []
+            for i in range(0, length, CHUNK_LENGTH):
+                n = min(CHUNK_LENGTH, length - i)
+                gc = min(max(rng.normal(gc_mean, gc_sd), 0.0), 1.0)
+                p = [(1 - gc) / 2, gc / 2, gc / 2, (1 - gc) / 2]
+                chunks.append(bases[rng.choice(4, size=n, p=p)])
+            seq_bytes = np.concatenate(chunks).tobytes().decode()
+            f.write(">chr" + str(seq) + "\n")
+            for i in range(0, length, ROW_LENGTH):
+                f.write(seq_bytes[i:i + ROW_LENGTH] + "\n")
+            written += length
+            seq += 1
+
+def syntheticScFile(sc_file, n_hits, consensus="DF0000001", mean=40,
+        seed=0):
+    """
+    syntheticScFile(sc_file, n_hits) - Writes an alignment file with
+    n_hits hits in the format produced by RMBlast with -a, each hit
+    being a header line followed by a short alignment. Scores are 50
+    plus an exponential with the given mean.
+    """
+    rng = random.Random(seed)
+    with open(sc_file, "w") as f:
+        for i in range(n_hits):
+            score = 50 + int(rng.expovariate(1.0 / mean))
+            batch = rng.randrange(0, 50000) * 58000 + 1
+            start = rng.randrange(1, 59000)
+            end = start + rng.randrange(30, 300)
+            cons_start = rng.randrange(1, 100)
+            cons_end = cons_start + end - start
+            seq = "chr" + str(rng.randrange(1, 23))
+            name = seq + ":" + str(batch) + "-" + str(batch + 59999)
+            if rng.random() < 0.5:
+                f.write("%d 15.21 1.20 0.80 %s %d %d (%d) %s %d %d (%d)\n" %
+                    (score, name, start, end, 60000 - end, consensus,
+                    cons_start, cons_end, 300))
+            else:
+                f.write("%d 15.21 1.20 0.80 %s %d %d (%d) C %s (%d) %d %d\n"
+                    % (score, name, start, end, 60000 - end, consensus,
+                    300, cons_end, cons_start))
+            f.write("\n  %s %10d ACGTTGCAACGTAGCTAGCTAGGCTA %d\n" %
+                    (name, start, start + 25))
+            f.write("                     i  v   -    i\n")
+            f.write("  %-20s %10d ACGTTGCAAGGTAGCTAG-TAGGTTA %d\n\n" %
+                    (consensus, cons_start, cons_start + 24))
+
+def syntheticFamily(root, consensus, n_hits, seed):
+    """
+    syntheticFamily(root, consensus, n_hits, seed) - Writes genomic
+    and benchmark alignment files for one consensus sequence under
+    root, laid out like /results/genomic_hits and benchmark_hits.
+    """
+    for kind, mean, n in (("genomic_hits", 60, n_hits),
+            ("benchmark_hits", 25, n_hits // 2)):
+        family_dir = os.path.join(root, kind, consensus)
+        os.makedirs(family_dir, exist_ok=True)
+        syntheticScFile(os.path.join(family_dir, consensus + "_" +
+                SC_MATRIX + ".sc"), n, consensus, mean, seed)
+        seed += 1
+
+def peakRss():
+    """
+    peakRss() - Peak resident set size of this process in MB.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def benchBinGenome(work_dir, config):
+    fa_file = os.path.join(work_dir, "genome.fa")
+    bins_dir = os.path.join(work_dir, "bins")
+    if os.path.exists(bins_dir):
+        shutil.rmtree(bins_dir)
+    os.mkdir(bins_dir)
+    start = time.perf_counter()
+    binGenome(fa_file, bins_dir)
+    elapsed = time.perf_counter() - start
+    return elapsed, {"Mb/s": config["genome_mb"] / elapsed}
+
+def benchParse(work_dir, config):
+    sc_file = os.path.join(work_dir, "results", "genomic_hits",
+                "DF0000001", "DF0000001_" + SC_MATRIX + ".sc")
+    mb = os.path.getsize(sc_file) / 1e6
+    start = time.perf_counter()
+    store = parseScFile(sc_file)
+    elapsed = time.perf_counter() - start
+    return elapsed, {"hits/s": len(store) / elapsed, "Mb/s": mb / elapsed}
+
+def compressedCopy(work_dir, compression):
+    """
+    compressedCopy(work_dir, compression) - Compresses the synthetic
+    genomic alignment file with the given method, outside of the
+    results directory, unless already done.
+
+    Returns: tuple (plain file, compressed file).
+    """
+    sc_file = os.path.join(work_dir, "results", "genomic_hits",
+                "DF0000001", "DF0000001_" + SC_MATRIX + ".sc")
+    copy = scPath(os.path.join(work_dir, "compressed",
+                os.path.basename(sc_file)), compression)
+    if not os.path.exists(copy):
+        os.makedirs(os.path.dirname(copy), exist_ok=True)
+        with open(sc_file, "rb") as f, ScWriter(copy, compression) as out:
+            out.copyFrom(f)
+    return sc_file, copy
+
+def benchParseCompressed(work_dir, config, compression):
+    # Mb/s of uncompressed text, comparable with parseScFile
+    sc_file, copy = compressedCopy(work_dir, compression)
+    mb = os.path.getsize(sc_file) / 1e6
+    start = time.perf_counter()
+    store = parseScFile(copy)
+    elapsed = time.perf_counter() - start
+    return elapsed, {"hits/s": len(store) / elapsed, "Mb/s": mb / elapsed,
+            "ratio": os.path.getsize(sc_file) / os.path.getsize(copy)}
+
+def benchParseGzip(work_dir, config):
+    return benchParseCompressed(work_dir, config, "gzip")
+
+def benchParseZstd(work_dir, config):
+    return benchParseCompressed(work_dir, config, "zstd")
+
+def clearCaches(sc_files):
+    """
+    clearCaches(sc_files) - Removes the hit stores and histograms saved
+    next to the given alignment files, so the next read parses them.
+    """
+    for sc_file in sc_files:
+        for path in storePaths(sc_file) + (histogramPath(sc_file),):
+            if os.path.exists(path):
+                os.remove(path)
+
+def familyFiles(work_dir):
+    family = os.path.join(work_dir, "results", "%s", "DF0000001",
+                "DF0000001_" + SC_MATRIX + ".sc")
+    return family % "genomic_hits", family % "benchmark_hits"
+
+def benchReadScores(work_dir, config, cached=False):
+    # without cached, the scores are parsed from the alignment file,
+    # comparable with parseScFile
+    sc_file = familyFiles(work_dir)[0]
+    if cached:
+        readScoresFromFile(sc_file)
+    else:
+        clearCaches([sc_file])
+    start = time.perf_counter()
+    scores = readScoresFromFile(sc_file)
+    elapsed = time.perf_counter() - start
+    return elapsed, {"hits/s": len(scores) / elapsed}
+
+def benchReadScoresCached(work_dir, config):
+    return benchReadScores(work_dir, config, cached=True)
+
+def benchThresholds(work_dir, config):
+    genomic_file, benchmark_file = familyFiles(work_dir)
+    genomic = readScoresFromFile(genomic_file)
+    benchmark = readScoresFromFile(benchmark_file)
+    start = time.perf_counter()
+    empiricalFDRCalculation(genomic, benchmark)
+    theoreticalFDRCalculation(genomic, benchmark, SC_MATRIX)
+    elapsed = time.perf_counter() - start
+    return elapsed, {"hits/s": (len(genomic) + len(benchmark)) / elapsed}
+
+def benchHistogramThresholds(work_dir, config):
+    genomic_file, benchmark_file = familyFiles(work_dir)
+    genomic = readHistogramFromFile(genomic_file)
+    benchmark = readHistogramFromFile(benchmark_file)
+    start = time.perf_counter()
+    empiricalHistogramCalculation(genomic, benchmark)
+    theoreticalFDRCalculation(genomic, benchmark, SC_MATRIX)
+    elapsed = time.perf_counter() - start
+    return elapsed, {"hits/s": (len(genomic) + len(benchmark)) / elapsed}
+
+def benchWriteJson(work_dir, config, cached=False):
+    results = os.path.join(work_dir, "results")
+    if cached:
+        for sc_file in familyFiles(work_dir):
+            readHistogramFromFile(sc_file)
+    else:
+        clearCaches(familyFiles(work_dir))
+    start = time.perf_counter()
+    writeJson(os.path.join(results, "genomic_hits", "DF0000001"),
+        os.path.join(results, "benchmark_hits", "DF0000001"),
+        os.path.join(work_dir, "DF0000001.json"))
+    elapsed = time.perf_counter() - start
+    return elapsed, {"hits/s": config["hits"] * 1.5 / elapsed}
+
+def benchWriteJsonCached(work_dir, config):
+    return benchWriteJson(work_dir, config, cached=True)
+
+def benchUnion(work_dir, config):
+    from hit_store import loadHits
+    genomic_file, benchmark_file = familyFiles(work_dir)
+    genomic = storesToArrays([loadHits(genomic_file)])
+    benchmark = storesToArrays([loadHits(benchmark_file)])
+    start = time.perf_counter()
+    fdrCurve(genomic, benchmark)
+    elapsed = time.perf_counter() - start
+    return elapsed, {"hits/s": config["hits"] * 1.5 / elapsed}
+
+BENCHMARKS = [
+    ("binGenome", benchBinGenome),
+    ("parseScFile", benchParse),
+    ("parseScFile.gz", benchParseGzip),
+    ("readScoresFromFile", benchReadScores),
+    ("readScoresFromFile.cached", benchReadScoresCached),
+    ("thresholds", benchThresholds),
+    ("histogramThresholds", benchHistogramThresholds),
+    ("writeJson", benchWriteJson),
+    ("writeJson.cached", benchWriteJsonCached),
+    ("union", benchUnion)
+]
+if zstandard != None:
+    BENCHMARKS.insert(3, ("parseScFile.zst", benchParseZstd))
+
+def __runBenchmark__(job):
+    """
+    Runs one benchmark in a fresh worker process, returning the
+    fastest time over the repeats and the peak RSS of the worker.
+    """
+    name, work_dir, config = job
+    func = dict(BENCHMARKS)[name]
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        best = None
+        for i in range(config["repeat"]):
+            elapsed, throughput = func(work_dir, config)
+            if best == None or elapsed < best[0]:
+                best = (elapsed, throughput)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    result = {"seconds": best[0], "peak_rss_mb": peakRss()}
+    result.update(best[1])
+    return name, result
+
+def runBenchmarks(config, names=None):
+    """
+    runBenchmarks(config) - Builds the synthetic inputs described by
+    config in a temporary directory and runs the benchmarks.
+
+    Args:
+        config - dict with genome_mb, gc_mean, gc_sd, hits, repeat
+            and seed.
+        names - names of the benchmarks to run (default: all).
+
+    Returns: dict mapping each benchmark name to its results.
+    """
+    work_dir = tempfile.mkdtemp(prefix="dfam_bench_")
+    ctx = get_context("spawn")
+    try:
+        syntheticGenome(os.path.join(work_dir, "genome.fa"),
+            int(config["genome_mb"] * 1e6), config["gc_mean"],
+            config["gc_sd"], config["seed"])
+        syntheticFamily(os.path.join(work_dir, "results"), "DF0000001",
+            config["hits"], config["seed"])
+        results = {}
+        for name, func in BENCHMARKS:
+            if names != None and name not in names:
+                continue
+            with ctx.Pool(1) as pool:
+                name, result = pool.apply(__runBenchmark__,
+                                    ((name, work_dir, config),))
+            results[name] = result
+            print(name + "\t" + "\t".join([k + "=" + ("%.4g" % v)
+                    for k, v in sorted(result.items())]))
+        return results
+    finally:
+        shutil.rmtree(work_dir)
+
+def compareResults(results, baseline, tolerance):
+    """
+    compareResults(results, baseline, tolerance) - Compares every
+    throughput of results with the baseline.
+
+    Returns: list of regressions, each (benchmark, metric, baseline,
+        current), for throughputs lower than baseline * (1 - tolerance).
+    """
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        for metric, value in sorted(results[name].items()):
+            if "/s" not in metric or metric not in baseline[name]:
+                continue
+            if value < baseline[name][metric] * (1 - tolerance):
+                regressions.append((name, metric, baseline[name][metric],
+                                    value))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--genome_mb", type=float, default=20,
+            help="size of the synthetic genome in Mb")
+    parser.add_argument("--gc_mean", type=float, default=0.41,
+            help="mean GC fraction of the synthetic genome")
+    parser.add_argument("--gc_sd", type=float, default=0.05,
+            help="standard deviation of the GC fraction")
+    parser.add_argument("--hits", type=int, default=200000,
+            help="number of genomic hits in the synthetic alignments")
+    parser.add_argument("--repeat", type=int, default=3,
+            help="runs of each benchmark, the fastest is kept")
+    parser.add_argument("--seed", type=int, default=0,
+            help="seed of the synthetic inputs")
+    parser.add_argument("--only", nargs="+", default=None,
+            help="names of the benchmarks to run")
+    parser.add_argument("--save", default=None,
+            help="write the results as a JSON baseline")
+    parser.add_argument("--compare", default=None,
+            help="JSON baseline to compare the results with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+            help="allowed drop in throughput before failing")
+    args = parser.parse_args()
+
+    config = {"genome_mb": args.genome_mb, "gc_mean": args.gc_mean,
+            "gc_sd": args.gc_sd, "hits": args.hits,
+            "repeat": args.repeat, "seed": args.seed}
+    results = runBenchmarks(config, args.only)
+    if args.save != None:
+        with open(args.save, "w") as f:
+            json.dump({"config": config, "results": results}, f, indent=2,
+                sort_keys=True)
+    if args.compare != None:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+        if baseline["config"] != config:
+            print("warning: baseline was run with " +
+                    json.dumps(baseline["config"], sort_keys=True))
+        regressions = compareResults(results, baseline["results"],
+                            args.tolerance)
+        for name, metric, before, after in regressions:
+            print("REGRESSION: " + name + " " + metric + " " +
+                    ("%.4g" % before) + " -> " + ("%.4g" % after))
+        if len(regressions) > 0:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -14,11 +14,13 @@ extend past the batch boundaries.
 You can run this script directly to generate bins for a given genome
 fa file:
 
-$ python3 bin_genome.py fa_file output_dir [-c C]
+$ python3 bin_genome.py fa_file output_dir [-c C] [--kmer_index]
 
 where fa_file is the fa file containing the genome, output_dir is the
 directory where the batches should be written, and C is the number of
-bases per line in the output files (default unlimited bases per line)
+bases per line in the output files (default unlimited bases per line).
+With --kmer_index, the k-mer prefilter index of every bin is built
+afterwards (see kmer_index.py).
 
 AUTHOR(S):
     Eric Yeh
@@ -31,6 +33,8 @@ import argparse
 import io
 import os
 
+from kmer_index import buildIndexes, K, W
+
 BATCH_LENGTH = 60000
 BATCH_OVERLAP = 2000
 MIN_BATCH_LENGTH = 40000
@@ -296,6 +300,14 @@ if __name__ == '__main__':
             help="dir where bin files are placed")
     parser.add_argument("-c", type=int, default=-1,
             help="number of bases per row in output")
+    parser.add_argument("--kmer_index", action="store_true",
+            help="also build the k-mer prefilter index of every bin")
+    parser.add_argument("--k", type=int, default=K,
+            help="k-mer length of the prefilter index")
+    parser.add_argument("--w", type=int, default=W,
+            help="minimizer window of the prefilter index")
     args = parser.parse_args()
 
     binGenome(args.genome_fa_file, args.output_dir, row_length=args.c)
+    if args.kmer_index:
+        buildIndexes(args.output_dir, args.k, args.w)
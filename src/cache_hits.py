@@ -7,13 +7,26 @@ following structure:
 
 {
     genomic: {
-        xxpxxg: [ ... ],
-        xxpxxg: [ ... ],
+        xxpxxg: { scores: [ ... ], counts: [ ... ] },
+        xxpxxg: { scores: [ ... ], counts: [ ... ] },
         ...
     },
     benchmark: { ... },
+    evalue: {
+        genomic: {
+            xxpxxg: [ ... ],
+            ...
+        },
+        benchmark: { ... }
+    }
 }
 
+where each matrix holds the histogram of the scores of the hits (see
+score_histogram.py): the distinct scores in decreasing order and the
+number of hits with each score, so the size of the JSON does not
+depend on the number of hits. Each evalue array holds the E-values of
+the scores at the same positions in the scores arrays.
+
 AUTHOR(S):
     Eric Yeh
 """
@@ -25,7 +38,11 @@ import argparse
 import os
 import json
 
-from score_thresholds import readScoresFromFile
+from sequence_util import binSizes
+from consensus_store import querySize
+from score_thresholds import (readHistogramFromFile, matrixName,
+        computeEValues, TEMP_CONSENSUS_SIZE, TEMP_GENOME_SIZE)
+from sc_io import plainName, findScFile
 
 def writeToFile(hits, fname):
     """
@@ -39,14 +56,15 @@ def writeToFile(hits, fname):
     with open(fname, "w") as f:
         f.write(json.dumps(hits))
 
-def writeJson(genomic_hits, benchmark_hits, cache_dir):
+def writeJson(genomic_hits, benchmark_hits, cache_dir,
+        query_size=TEMP_CONSENSUS_SIZE, subject_size=TEMP_GENOME_SIZE):
     """
     writeJson(genomic_hits, benchmark_hits, cache_dir) -
 
     Reads the scores from genomic hits and benchmark hits of a
     consensus sequence for each GC-tuned matrix of a consensus
-    sequence, storing these scores in a sorted array in decreasing
-    order.
+    sequence, storing them as histograms (distinct scores in
+    decreasing order with their number of hits).
 
     Creates a JSON of all the genomic/benchmark hits for a given
     consenus sequence for each GC background and writes the JSON to
@@ -58,17 +76,26 @@ def writeJson(genomic_hits, benchmark_hits, cache_dir):
         benchmark_hits - path to directory containing all alignments
             of a consensus sequnece against the benchmark genome.
         cache_dir - output directory where json will be written to.
+        query_size - number of bps in the consensus sequence.
+        subject_size - number of bps searched, or dict of sizes per GC
+            bin.
     """
-    hits = {"genomic": {}, "benchmark": {}}
+    hits = {"genomic": {}, "benchmark": {},
+            "evalue": {"genomic": {}, "benchmark": {}}}
     print(hits)
     consensus = os.path.dirname(genomic_hits).split("/")[-1]
     print(os.listdir(genomic_hits))
-    for sc in os.listdir(genomic_hits):
-        matrix = sc.split("_")[1][:-3]
-        hits["genomic"][matrix] = readScoresFromFile(
-                    os.path.join(genomic_hits, sc))
-        hits["benchmark"][matrix] = readScoresFromFile(
-                    os.path.join(benchmark_hits, sc))
+    for sc in sorted(set([plainName(f) for f in os.listdir(genomic_hits)])):
+        matrix = matrixName(sc)
+        if matrix == None:
+            continue
+        for kind, path in (("genomic", genomic_hits),
+                ("benchmark", benchmark_hits)):
+            histogram = readHistogramFromFile(
+                            findScFile(os.path.join(path, sc))).toDict()
+            hits[kind][matrix] = histogram
+            hits["evalue"][kind][matrix] = computeEValues(histogram["scores"],
+                        matrix, query_size, subject_size).tolist()
     writeToFile(hits, cache_dir)
 
 if __name__ == '__main__':
@@ -79,11 +106,26 @@ if __name__ == '__main__':
             help="path to directory containing benchmark hits")
     parser.add_argument("cache_dir",
             help="path to directory to write output jsons")
+    parser.add_argument("--consensus_dir", default=None,
+            help="directory of consensus fa files (or consensus " +
+                "library), used to find the size of each consensus for " +
+                "its E-values")
+    parser.add_argument("--bins", default=None,
+            help="directory of genome bins, used to find the size " +
+                "searched with each matrix for its E-values")
     args = parser.parse_args()
 
+    subject_size = TEMP_GENOME_SIZE
+    if args.bins != None:
+        subject_size = binSizes(args.bins)
+
     print(os.listdir(args.benchmark_hits))
     for consensus in os.listdir(args.benchmark_hits):
         if consensus[:2] == "DF":
+            query_size = TEMP_CONSENSUS_SIZE
+            if args.consensus_dir != None:
+                query_size = querySize(args.consensus_dir, consensus)
             writeJson(os.path.join(args.genomic_hits, consensus),
                     os.path.join(args.benchmark_hits, consensus),
-                    os.path.join(args.cache_dir, consensus + ".json"))
+                    os.path.join(args.cache_dir, consensus + ".json"),
+                    query_size, subject_size)
@@ -0,0 +1,288 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+campaign.py - Runs a set of consensus sequences against several
+registered genomes (see genome_registry.py) in one campaign: generates
+the alignments of every family against the bins and benchmark bins of
+every genome and computes its score thresholds per GC tuned matrix.
+
+The families are staged once, as one fa file each in
+../results/consensus, whatever the number of genomes, and every
+(genome, family) pair is a unit of work, run as a task of one
+pipeline (see pipeline_dag.py) with up to N units at a time, biggest
+units first. The alignments, .thresh files and
+results database of each genome are written to its own results
+directory (../results for hg38, ../results/[genome] otherwise), and
+the thresholds of every genome are gathered into one table,
+../results/genome_thresholds.txt:
+
+genome\tsequence_name\tmatrix\tempirical\ttheoretical\tfinal
+
+sorted by family, matrix and genome, so the thresholds of a family
+across taxa sit next to each other. Campaigns are run by
+jobs_batch.py:
+
+$ python3 jobs_batch.py consensus [--genomes NAME ...] [-p N]
+
+AUTHOR(S):
+    Eric Yeh
+"""
+
+#
+# Module imports
+#
+import os
+import sys
+
+from generate_alignments import generateAlignments, ConsensusSequence
+from consensus_store import ConsensusStore
+from sequence_util import readShard, countBins
+from score_thresholds import (scoreThresholds, setGumbelParams, formatRow,
+        AdaptiveMinScore)
+from genome_registry import (getGenome, GENOME_REGISTRY, DEFAULT_GENOME,
+        RESULTS_ROOT)
+from results_db import ResultsDB
+from aligners import getAligner, RMBlastAligner
+from kmer_index import KmerPrefilter
+from pipeline_dag import Pipeline, Task
+import progress
+from failures import requeueBins, ledgerPath
+
+STAGING_DIR = os.path.join(RESULTS_ROOT, "consensus")
+GENOME_TABLE = os.path.join(RESULTS_ROOT, "genome_thresholds.txt")
+CAMPAIGN_STATE = ".campaign_state.json"
+
+def stageFamilies(source, shard=None, staging_dir=STAGING_DIR):
+    """
+    stageFamilies(source, shard, staging_dir) - fa file of each family
+    to run: the fa files of the directory source as they are, or the
+    families of the library source (those of the given shard only, if
+    any) written to staging_dir, unless already staged.
+
+    Returns: list of (name, fa file, consensus length).
+    """
+    families = []
+    if os.path.isdir(source):
+        for f in sorted(os.listdir(source)):
+            cs = ConsensusSequence(os.path.join(source, f))
+            families.append((cs.name, os.path.join(source, f), len(cs.seq)))
+        return families
+    os.makedirs(staging_dir, exist_ok=True)
+    store = ConsensusStore(source)
+    names = store.names
+    if shard != None:
+        names = readShard(source, shard)
+    for name in names:
+        fa_file = os.path.join(staging_dir, name + ".fa")
+        record = store.record(name)
+        if (not os.path.exists(fa_file) or
+                os.path.getsize(fa_file) != len(record.encode())):
+            tmp = fa_file + ".tmp" + str(os.getpid())
+            with open(tmp, "w") as f:
+                f.write(record)
+            os.replace(tmp, fa_file)
+        families.append((name, fa_file, store.size(name)))
+    store.close()
+    return families
+
+def __runUnit__(genome, name, fa_file, subject_size, aligner, min_shared,
+        margin, bins, run_id):
+    """
+    Action of the task running one (genome, family) unit of a campaign,
+    in its own process (see pipeline_dag.py). The thresholds of the
+    family are written to its .thresh file in the thresholds directory
+    of the genome; a failing unit raises, failing its task only.
+    """
+    key = genome.name + ":" + name
+    progress.unitStarted(key)
+    try:
+        setGumbelParams(genome.gumbel_params)
+        prefilter = None
+        if min_shared != None:
+            prefilter = KmerPrefilter(min_shared)
+        minscore = None
+        if margin != None:
+            minscore = AdaptiveMinScore(subject_size, margin)
+        cs = ConsensusSequence(fa_file)
+
+        errors = []
+        if "genomic" in bins:
+            print("Generating " + genome.name + " genomic alignments for " +
+                    name)
+            errors += generateAlignments(cs, genome.bins,
+                    genome.genomicHits(), aligner, prefilter, minscore,
+                    bins["genomic"])
+        if "benchmark" in bins:
+            print("Generating " + genome.name + " benchmark alignments for " +
+                    name)
+            # benchmark hits are the false positives of the empirical
+            # FDR, never prefiltered
+            errors += generateAlignments(cs, genome.benchmark_bins,
+                    genome.benchmarkHits(), aligner, None, minscore,
+                    bins["benchmark"])
+        if len(errors) > 0:
+            # thresholds missing a bin would be wrong
+            raise RuntimeError(str(len(errors)) + " alignments failed, see " +
+                    ledgerPath(genome.genomicHits()))
+
+        print("Calculating " + genome.name + " score thresholds for " + name)
+        with ResultsDB(genome.resultsDb(), run_id) as db:
+            scoreThresholds(os.path.join(genome.genomicHits(), name),
+                    os.path.join(genome.benchmarkHits(), name),
+                    len(cs.seq), subject_size, db,
+                    thresholds_dir=genome.thresholdsDir(),
+                    floor_only=margin != None)
+    except Exception as e:
+        progress.unitFinished(key, repr(e))
+        raise
+    progress.unitFinished(key)
+
+def readThreshFile(thresh_file):
+    """
+    readThreshFile(thresh_file) - Rows of a [family].thresh table
+    written by score_thresholds.scoreThresholds, with the fields of
+    each row as strings.
+    """
+    with open(thresh_file, "r") as f:
+        return [tuple(line.rstrip("\n").split("\t")) for line in f]
+
+def writeGenomeTable(rows, output_file=GENOME_TABLE):
+    """
+    writeGenomeTable(rows, output_file) - Writes the thresholds of
+    every genome, given as a list of (genome, row), as one table
+    sorted by family, matrix and genome (written to a temporary file
+    and then moved over output_file).
+    """
+    rows = sorted(rows, key=lambda r: (r[1][0], r[1][1], r[0]))
+    tmp_file = output_file + ".tmp"
+    with open(tmp_file, "w") as table:
+        for genome, row in rows:
+            table.write(genome + "\t" + formatRow(row) + "\n")
+    os.replace(tmp_file, output_file)
+
+def readGenomeTable(table_file):
+    """
+    readGenomeTable(table_file) - Reads the rows of a table written by
+    writeGenomeTable, as a list of (genome, row) with the fields of
+    each row as strings. An empty list if there is no table.
+    """
+    rows = []
+    if not os.path.exists(table_file):
+        return rows
+    with open(table_file, "r") as table:
+        for line in table:
+            fields = line.rstrip("\n").split("\t")
+            rows.append((fields[0], tuple(fields[1:])))
+    return rows
+
+def runCampaign(source, genome_names=None, registry=GENOME_REGISTRY,
+        aligner=None, processes=1, shard=None, output_file=GENOME_TABLE,
+        staging_dir=STAGING_DIR, min_shared=None, minscore_margin=None,
+        requeue=False):
+    """
+    runCampaign(source, genome_names) - Runs every family of source
+    against every given genome.
+
+    Args:
+        source - directory of consensus fa files, or consensus library.
+        genome_names - names of registered genomes (default: hg38).
+        registry - path of the genome registry.
+        aligner - aligner backend (see aligners.py, e.g. from
+            aligners.fromArgs), RMBlast through rbn by default. Without
+            alignments, only the header line of each hit is written to
+            the alignment files.
+        processes - number of units run at once, each in its own
+            process.
+        shard - with a consensus library, only run the families of
+            this shard (see dfam_pipeline.py).
+        output_file - table the thresholds of every genome are
+            gathered into.
+        staging_dir - directory the families of a library are staged
+            to, shared by every genome.
+        min_shared - if given, families are only aligned against the
+            genome batches sharing this many indexed k-mers with them
+            (see kmer_index.py); benchmark bins are always searched in
+            full.
+        minscore_margin - if given, only the hits scoring at most this
+            many points under the lowest theoretical threshold of each
+            matrix are reported (see score_thresholds.adaptiveMinScore),
+            for the genome and benchmark bins alike.
+        requeue - only run the units with alignments that failed for
+            good (see failures.py), redoing those alignments only, and
+            then their thresholds.
+
+    Returns: number of units that failed.
+    """
+    if genome_names == None:
+        genome_names = [DEFAULT_GENOME]
+    if aligner == None:
+        aligner = getAligner(RMBlastAligner.name)
+    genomes = [getGenome(name, registry) for name in genome_names]
+    families = stageFamilies(source, shard, staging_dir)
+
+    units = []
+    plan = []
+    run_ids = {}
+    for genome in genomes:
+        genome.makeDirs()
+        subject_size = genome.subjectSize()
+        with ResultsDB(genome.resultsDb()) as db:
+            run_ids[genome.name] = db.startRun(params={"genome": genome.name,
+                    "genomes": genome_names, "aligner": aligner.name,
+                    "subject_size": subject_size, "prefilter": min_shared,
+                    "score_only": not aligner.alignments,
+                    "adaptive_minscore": minscore_margin})
+        num_bins = countBins([genome.bins, genome.benchmark_bins])
+        bases = (progress.binBytes(genome.bins) +
+                progress.binBytes(genome.benchmark_bins))
+        if requeue:
+            requeued = requeueBins(ledgerPath(genome.genomicHits()))
+        for name, fa_file, length in families:
+            # bins to align by genome kind, all of them unless requeuing
+            bins = {"genomic": None, "benchmark": None}
+            if requeue:
+                if name not in requeued:
+                    continue
+                bins = requeued[name]
+            plan.append((genome.name + ":" + name, bases))
+            thresh_file = os.path.join(genome.thresholdsDir(),
+                                name + ".thresh")
+            units.append((length * num_bins, genome.name, name,
+                    Task("unit:" + genome.name + ":" + name, __runUnit__,
+                        (genome, name, fa_file, subject_size, aligner,
+                        min_shared, minscore_margin, bins,
+                        run_ids[genome.name]),
+                        inputs=[fa_file], outputs=[thresh_file])))
+    # every unit is a task of one pipeline, biggest first, so the
+    # campaign does not end on a long one
+    units = sorted(units, key=lambda u: -u[0])
+    pipeline = Pipeline(os.path.join(os.path.dirname(
+                        os.path.abspath(output_file)), CAMPAIGN_STATE))
+    for cost, genome_name, name, task in units:
+        pipeline.add(task)
+    progress.planUnits(plan)
+    result = pipeline.run(cpus=processes, force=True)
+
+    rows = []
+    if requeue:
+        # keep the thresholds of the units not requeued
+        requeued = set([(genome_name, name)
+                        for cost, genome_name, name, task in units])
+        rows = [(genome_name, row)
+                for genome_name, row in readGenomeTable(output_file)
+                if (genome_name, row[0]) not in requeued]
+    ran = set(result["ran"])
+    for cost, genome_name, name, task in units:
+        if task.name in ran:
+            rows.extend([(genome_name, row)
+                        for row in readThreshFile(task.outputs[0])])
+        else:
+            sys.stderr.write("failed " + genome_name + " " + name + "\n")
+
+    writeGenomeTable(rows, output_file)
+    for genome in genomes:
+        with ResultsDB(genome.resultsDb(), run_ids[genome.name]) as db:
+            db.finishRun()
+    print("wrote " + str(len(rows)) + " thresholds for " +
+            str(len(genomes)) + " genomes to " + output_file)
+    return len(result["failed"])
@@ -82,27 +82,8 @@ function cacheToChart(consensus, matrix, hits) {
 
     var threshold = thresholds[consensus][matrix]
 
-    var genomic_hits = new Array(10001).fill(0);
-    for (var j = 0; j < hits.genomic[matrix].length; j++) {
-        var hit = hits.genomic[matrix][j];
-        if (hit <= 10000 && hit >= 0) {
-            genomic_hits[hit]++;
-        }
-    }
-    for (var j = genomic_hits.length - 2; j >= 0; j--) {
-        genomic_hits[j] += genomic_hits[j + 1];
-    }
-
-    var benchmark_hits = new Array(10001).fill(0);
-    for (var j = 0; j < hits.benchmark[matrix].length; j++) {
-        var hit = hits.benchmark[matrix][j];
-        if (hit <= 10000 && hit >= 0) {
-            benchmark_hits[hit]++;
-        }
-    }
-    for (var j = benchmark_hits.length - 2; j >= 0; j--) {
-        benchmark_hits[j] += benchmark_hits[j + 1];
-    }
+    var genomic_hits = cumulativeCounts(hits.genomic[matrix]);
+    var benchmark_hits = cumulativeCounts(hits.benchmark[matrix]);
 
     var xMax = Math.ceil(threshold + 60);
     var xMin = Math.ceil(threshold - 80);
@@ -115,6 +96,22 @@ function cacheToChart(consensus, matrix, hits) {
     drawChart(consensus, matrix, genomic_hits, benchmark_hits);
  }
 
+// Number of hits scoring at least each score 0..10000, from a cached
+// histogram ({scores: [...], counts: [...]}, see score_histogram.py).
+function cumulativeCounts(histogram) {
+    var counts = new Array(10001).fill(0);
+    for (var j = 0; j < histogram.scores.length; j++) {
+        var score = histogram.scores[j];
+        if (score <= 10000 && score >= 0) {
+            counts[score] += histogram.counts[j];
+        }
+    }
+    for (var j = counts.length - 2; j >= 0; j--) {
+        counts[j] += counts[j + 1];
+    }
+    return counts;
+}
+
 function loadHits(consensus, matrix) {
     $('.charts').append(`<div class='chartWithOverlay' id='${matrix}'></div>`);
     $(`#${matrix}.chartWithOverlay`).append(`<div id='chart_${matrix}' class='chart'></div>`);
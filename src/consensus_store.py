@@ -0,0 +1,178 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+consensus_store.py - Reads the consensus sequences of a library
+straight from its multi-sequence fa file, instead of splitting it into
+one fa file per family.
+
+The first time a library is opened, an index is written next to it
+([library].idx), with one tab-separated line per consensus:
+
+name\toffset\tlength\tsize\tavg_kimura
+
+where offset and length are the position and number of bytes of the
+record (header line included) in the library, size is the number of
+bases of the consensus and avg_kimura the divergence from its header.
+A consensus is then read with a single seek, and the index is rebuilt
+whenever the library is newer than it.
+
+You can run this script directly to build the index of a library, or
+to print some of its consensus sequences:
+
+$ python3 consensus_store.py library_fa [name ...]
+
+AUTHOR(S):
+    Eric Yeh
+"""
+
+#
+# Module imports
+#
+import argparse
+import os
+from functools import lru_cache
+
+from sequence_util import consensusSize
+
+INDEX_SUFFIX = ".idx"
+
+def indexPath(fa_file):
+    return fa_file + INDEX_SUFFIX
+
+def buildIndex(fa_file):
+    """
+    buildIndex(fa_file) - Scans the given library once and writes its
+    index (under a temporary name first, then moved into place).
+
+    Returns: list of (name, offset, length, size, avg_kimura).
+    """
+    entries = []
+    current = None
+    f = open(fa_file, "rb")
+    offset = 0
+    for line in f:
+        if line[:1] == b">":
+            if current != None:
+                current[2] = offset - current[1]
+                entries.append(tuple(current))
+            description = line[1:].decode().split()
+            avg_kimura = 0.0
+            for token in description[1:]:
+                if token.startswith("avg_kimura="):
+                    avg_kimura = float(token.split("=")[1])
+            current = [description[0], offset, 0, 0, avg_kimura]
+        elif current != None:
+            current[3] += len(line.strip())
+        offset += len(line)
+    f.close()
+    if current != None:
+        current[2] = offset - current[1]
+        entries.append(tuple(current))
+
+    index_file = indexPath(fa_file)
+    tmp = index_file + ".tmp" + str(os.getpid())
+    with open(tmp, "w") as g:
+        for name, offset, length, size, avg_kimura in entries:
+            g.write(name + "\t" + str(offset) + "\t" + str(length) + "\t" +
+                    str(size) + "\t" + str(avg_kimura) + "\n")
+    os.replace(tmp, index_file)
+    return entries
+
+def readIndex(fa_file):
+    """
+    readIndex(fa_file) - Entries of the index of the given library,
+    building the index first if it is missing or older than the
+    library.
+    """
+    index_file = indexPath(fa_file)
+    if (not os.path.exists(index_file) or
+            os.path.getmtime(index_file) < os.path.getmtime(fa_file)):
+        return buildIndex(fa_file)
+    entries = []
+    with open(index_file, "r") as f:
+        for line in f:
+            name, offset, length, size, avg_kimura = line.split("\t")
+            entries.append((name, int(offset), int(length), int(size),
+                        float(avg_kimura)))
+    return entries
+
+class ConsensusStore:
+    """
+    Indexed consensus library.
+
+    Fields:
+        fa_file - path of the library.
+        names - names of the consensus sequences, in library order.
+        index - dict mapping each name to its (offset, length, size,
+            avg_kimura).
+    """
+    def __init__(self, fa_file):
+        self.fa_file = fa_file
+        self.names = []
+        self.index = {}
+        for name, offset, length, size, avg_kimura in readIndex(fa_file):
+            self.names.append(name)
+            self.index[name] = (offset, length, size, avg_kimura)
+        self.f = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def record(self, name):
+        """
+        record(self, name) - Text of the fa record of the given
+        consensus, header line included. ConsensusSequence(text=...)
+        (see generate_alignments.py) builds a consensus from it.
+        """
+        offset, length, size, avg_kimura = self.index[name]
+        if self.f == None:
+            self.f = open(self.fa_file, "rb")
+        self.f.seek(offset)
+        return self.f.read(length).decode()
+
+    def size(self, name):
+        """
+        size(self, name) - Number of bases of the given consensus.
+        """
+        return self.index[name][2]
+
+    def close(self):
+        if self.f != None:
+            self.f.close()
+            self.f = None
+
+def querySize(consensus_source, name):
+    """
+    querySize(consensus_source, name) - Number of bases of the given
+    consensus, looked up either in a directory of [name].fa files or
+    in an indexed library.
+    """
+    if os.path.isdir(consensus_source):
+        return consensusSize(os.path.join(consensus_source, name + ".fa"))
+    return openStore(consensus_source).size(name)
+
+@lru_cache(maxsize=None)
+def openStore(fa_file):
+    """
+    openStore(fa_file) - ConsensusStore of the given library, opened
+    once per process.
+    """
+    return ConsensusStore(fa_file)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("library",
+            help="fa file containing the consensus sequences")
+    parser.add_argument("names", nargs="*",
+            help="consensus sequences to print")
+    args = parser.parse_args()
+
+    store = ConsensusStore(args.library)
+    if len(args.names) == 0:
+        print(indexPath(args.library) + "\t" + str(len(store)) +
+            " consensus sequences")
+    for name in args.names:
+        print(store.record(name), end="")
@@ -0,0 +1,133 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+dedup_hits.py - Removes the hits reported twice because they sit in
+the overlap between two adjacent batches.
+
+bin_genome.py cuts each sequence into batches that overlap by
+BATCH_OVERLAP bases, so a TE inside an overlap is found once in each
+batch. The hit store (hit_store.py) already translates the batch
+coordinates (sequence:start-end plus the offsets in the batch) into
+genome coordinates; here the hits of each sequence and strand are
+swept in order of genome start, and two hits from different batches
+whose genome ranges and consensus ranges both overlap are collapsed
+into the higher scoring one.
+
+Only hits in the same alignment file are compared: adjacent batches
+in different GC bins were aligned with different matrices, and their
+hits are scored against different thresholds anyway.
+
+You can run this script directly to report the duplicates found in
+every alignment file under the given directories:
+
+$ python3 dedup_hits.py dir [dir ...]
+
+AUTHOR(S):
+    Eric Yeh
+"""
+
+#
+# Module imports
+#
+import argparse
+import os
+
+import numpy as np
+
+from hit_store import loadHits
+from score_histogram import histogramFromScores
+from sc_io import isScFile
+
+def duplicateMask(hits):
+    """
+    duplicateMask(hits) - Finds the hits duplicated by the batch
+    overlaps.
+
+    Hits are sorted by (sequence, strand, genome start). Comparing
+    each hit with the one d places after it, for d = 1, 2, ..., finds
+    every pair of overlapping hits; the sweep stops at the first d for
+    which no hit overlaps the one d places after it, since the starts
+    only grow from there. Of each duplicate pair, the lower scoring
+    hit (or, on a tie, the one from the later batch) is dropped.
+
+    Args:
+        hits - structured array of hits from a HitStore.
+
+    Returns: boolean array, True for the hits to keep.
+    """
+    n = len(hits)
+    keep = np.ones(n, dtype=bool)
+    if n < 2:
+        return keep
+    order = np.lexsort((hits["start"], hits["strand"], hits["seq"]))
+    seq = hits["seq"][order]
+    strand = hits["strand"][order]
+    start = hits["start"][order]
+    end = hits["end"][order]
+    batch = hits["batch_start"][order]
+    score = hits["score"][order]
+    cons_start = hits["cons_start"][order]
+    cons_end = hits["cons_end"][order]
+
+    d = 1
+    while d < n:
+        a = np.arange(n - d)
+        b = a + d
+        near = ((seq[a] == seq[b]) & (strand[a] == strand[b]) &
+                (start[b] <= end[a]))
+        if not near.any():
+            break
+        dup = (near & (batch[a] != batch[b]) &
+                (cons_start[a] <= cons_end[b]) & (cons_start[b] <= cons_end[a]))
+        a = a[dup]
+        b = b[dup]
+        a_wins = ((score[a] > score[b]) |
+                    ((score[a] == score[b]) & (batch[a] < batch[b])))
+        keep[order[np.where(a_wins, b, a)]] = False
+        d += 1
+    return keep
+
+def dedupHits(sc_file):
+    """
+    dedupHits(sc_file) - Returns the hits of the given alignment file
+    (a structured array, see hit_store.py) without the copies produced
+    by the batch overlaps.
+    """
+    hits = loadHits(sc_file).hits
+    return hits[duplicateMask(hits)]
+
+def dedupScores(sc_file):
+    """
+    dedupScores(sc_file) - Returns the scores of the deduplicated hits
+    of the given alignment file, sorted in decreasing order.
+    """
+    return np.sort(dedupHits(sc_file)["score"].astype(np.int64))[::-1]
+
+def dedupHistogram(sc_file):
+    """
+    dedupHistogram(sc_file) - Returns the ScoreHistogram of the scores
+    of the deduplicated hits of the given alignment file.
+    """
+    return histogramFromScores(dedupHits(sc_file)["score"])
+
+def reportDuplicates(dirs):
+    """
+    reportDuplicates(dirs) - Prints, for every alignment file under
+    the given directories, the number of hits and of duplicates.
+    """
+    for d in dirs:
+        for root, subdirs, files in os.walk(d):
+            for f in sorted(files):
+                if isScFile(f):
+                    hits = loadHits(os.path.join(root, f)).hits
+                    dups = len(hits) - int(duplicateMask(hits).sum())
+                    print(os.path.join(root, f) + "\t" + str(len(hits)) +
+                            "\t" + str(dups))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dirs", nargs="+",
+            help="directories containing alignment files")
+    args = parser.parse_args()
+
+    reportDuplicates(args.dirs)
@@ -6,6 +6,21 @@ score thresholds for each sequence for the given genome, one for each
 GC tuned matrix. Also generates alignments for the consensus sequence
 against the given genome.
 
+Spreads the families of the consensus file over N shards, each of
+which can be given to a separate jobs_batch.py session
+(jobs_batch.py consensus_fa --shard K). Every family is aligned
+against the same bins, so the time to align it grows with the length
+of its consensus; families are assigned longest first to the least
+loaded shard, and the shards finish at about the same time. The
+assignment is written to [consensus_fa].shards.tsv.
+
+Families are read from the consensus file through its index (see
+consensus_store.py), and written out as one fa file per family in
+shard directories ([consensus_fa]_, [consensus_fa]_2, ...), which
+run_job.py and job_headers.py take them from. With --no_split, only
+the assignment is written; jobs_batch.py then reads the families
+straight from the consensus file.
+
 AUTHOR(S):
     Eric Yeh
 """
@@ -14,42 +29,100 @@ AUTHOR(S):
 # Module imports
 #
 import argparse
+import heapq
 import os
-import subprocess
 
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument("consensus",
-        help="a fa file containing one or more consensus sequences")
-    args = parser.parse_args()
+from consensus_store import ConsensusStore
 
-    consensus_fa = args.consensus
+NUM_SHARDS = 5
+
+def shardFamilies(sizes, num_shards):
+    """
+    shardFamilies(sizes, num_shards) - Assigns families to shards by
+    longest processing time first: families are taken in decreasing
+    order of consensus length, each going to the shard with the least
+    bases so far.
+
+    Args:
+        sizes - list of (name, consensus length).
+        num_shards - number of shards.
+
+    Returns: list of (shard, name, length), shards numbered from 0, in
+        the order the families were assigned.
+    """
+    loads = [(0, shard) for shard in range(num_shards)]
+    heapq.heapify(loads)
+    assignment = []
+    for name, length in sorted(sizes, key=lambda r: (-r[1], r[0])):
+        load, shard = heapq.heappop(loads)
+        assignment.append((shard, name, length))
+        heapq.heappush(loads, (load + length, shard))
+    return assignment
+
+def shardDir(consensus_fa, shard):
+    """
+    shardDir(consensus_fa, shard) - Directory of the given shard:
+    [consensus_fa]_ for the first, then [consensus_fa]_2, _3, ...
+    """
+    if shard == 0:
+        return consensus_fa + "_"
+    return consensus_fa + "_" + str(shard + 1)
 
-    dir_names = [consensus_fa + "_", consensus_fa + "_2", consensus_fa + "_3",
-                consensus_fa + "_4", consensus_fa + "_5"]
-    for dir_name in dir_names:
+def writeManifest(consensus_fa, assignment):
+    """
+    writeManifest(consensus_fa, assignment) - Writes the assignment of
+    families to shards to [consensus_fa].shards.tsv:
+
+    shard\tfamily\tlength
+
+    with shards numbered from 1.
+    """
+    with open(consensus_fa + ".shards.tsv", "w") as f:
+        for shard, name, length in assignment:
+            f.write(str(shard + 1) + "\t" + name + "\t" + str(length) +
+                    "\n")
+
+def writeShards(consensus_fa, store, assignment, num_shards):
+    """
+    writeShards(consensus_fa, store, assignment, num_shards) - Writes
+    the fa file of each family into its shard directory, emptying the
+    directories first.
+    """
+    for shard in range(num_shards):
+        dir_name = shardDir(consensus_fa, shard)
         if not os.path.exists(dir_name):
             os.mkdir(dir_name)
         else:
-            filelist = os.listdir(dir_name)
-            for f in filelist:
+            for f in os.listdir(dir_name):
                 os.remove(os.path.join(dir_name, f))
 
-    f = open(consensus_fa, "r")
-    g = None
-    i = 0
-    line = f.readline()
-    while line != "":
-        if line[0] == ">":
-            if g != None:
-                g.close()
-            g = open(os.path.join(consensus_fa + "_", line[1:].split()[0] + ".fa"), "a")
-            i += 1
-        g.write(line)
-        line = f.readline()
-
-    f.close()
-    g.close()
+    for shard, name, length in assignment:
+        dir_name = shardDir(consensus_fa, shard)
+        with open(os.path.join(dir_name, name + ".fa"), "w") as g:
+            g.write(store.record(name))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("consensus",
+        help="a fa file containing one or more consensus sequences")
+    parser.add_argument("-n", "--shards", type=int, default=NUM_SHARDS,
+        help="number of shards to split the families into")
+    parser.add_argument("--no_split", action="store_true",
+        help="only write the assignment, not the fa file of each " +
+            "family in its shard directory")
+    args = parser.parse_args()
+
+    consensus_fa = args.consensus
+    store = ConsensusStore(consensus_fa)
+    assignment = shardFamilies([(name, store.size(name))
+                            for name in store.names], args.shards)
+    writeManifest(consensus_fa, assignment)
+    if not args.no_split:
+        writeShards(consensus_fa, store, assignment, args.shards)
+    for shard in range(args.shards):
+        families = [a for a in assignment if a[0] == shard]
+        print("shard " + str(shard + 1) + "\t" + str(len(families)) +
+            " families\t" + str(sum([a[2] for a in families])) + " bases")
 
 if __name__ == '__main__':
     main()
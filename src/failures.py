@@ -0,0 +1,212 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+failures.py - Retry policy and failure ledger of the aligner runs.
+
+An alignment (one family against one bin of one genome kind, see
+generate_alignments.runRMBlast) that fails is classified as:
+
+    exit    - the aligner exited with a non-zero status
+    timeout - it ran longer than the timeout and was killed
+    oom     - it was killed by SIGKILL (or exited with 137, the status
+              of a shell whose child was), as the OOM killer does, or
+              Python ran out of memory
+    signal  - it was killed by another signal
+    error   - anything else (e.g. a missing matrix), not retried
+
+and retried, unless it is an error, up to the number of retries set,
+waiting backoff, 2 * backoff, 4 * backoff... seconds in between. The
+retry policy is set by environment variables, inherited by every
+process a job starts (see setRetryPolicy, or the --retries, --timeout
+and --backoff options of the drivers):
+
+    DFAM_RETRIES        - retries after the first attempt (default 2)
+    DFAM_ALIGN_TIMEOUT  - seconds before an aligner process is killed
+                          (default: no timeout)
+    DFAM_RETRY_BACKOFF  - seconds before the first retry (default 30)
+
+Every failed attempt is appended as one JSON line to the failure
+ledger of the genome, failures.jsonl in its results directory (next to
+genomic_hits and benchmark_hits), with the family, genome kind, bin,
+failure class, exit status and attempt; the last attempt of an
+alignment that could not be recovered is marked final. Its alignment
+file is not written; that of an earlier run, if any, is kept. The
+drivers (run_job.py, jobs_batch.py) can then requeue only the
+alignments whose final failure has not been followed by a successful
+run, with --requeue.
+
+You can run this script directly to list the pending failures of a
+ledger:
+
+$ python3 failures.py ledger [--json]
+
+AUTHOR(S):
+    Eric Yeh
+"""
+
+#
+# Module imports
+#
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import time
+
+from sc_io import findScFile
+
+FAILURE_LEDGER = "failures.jsonl"
+RETRIES_ENV = "DFAM_RETRIES"
+TIMEOUT_ENV = "DFAM_ALIGN_TIMEOUT"
+BACKOFF_ENV = "DFAM_RETRY_BACKOFF"
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF = 30.0
+RETRYABLE = ("exit", "timeout", "oom", "signal")
+OOM_EXIT = 128 + signal.SIGKILL
+
+def setRetryPolicy(retries=None, timeout=None, backoff=None):
+    """
+    setRetryPolicy(retries, timeout, backoff) - Sets the retry policy
+    of the alignments run by this process, and by every process it
+    starts; None leaves a setting as it is.
+    """
+    for env, value in [(RETRIES_ENV, retries), (TIMEOUT_ENV, timeout),
+                    (BACKOFF_ENV, backoff)]:
+        if value != None:
+            os.environ[env] = str(value)
+
+def retryPolicy():
+    """
+    retryPolicy() - Current retry policy.
+
+    Returns: (retries, timeout in seconds or None, backoff in seconds)
+    """
+    retries = int(os.environ.get(RETRIES_ENV, DEFAULT_RETRIES))
+    timeout = os.environ.get(TIMEOUT_ENV)
+    if timeout:
+        timeout = float(timeout)
+    else:
+        timeout = None
+    backoff = float(os.environ.get(BACKOFF_ENV, DEFAULT_BACKOFF))
+    return retries, timeout, backoff
+
+def classifyFailure(exc):
+    """
+    classifyFailure(exc) - Class of the failure of an alignment that
+    raised the given exception, see the module docstring.
+
+    Returns: (class, exit status or None)
+    """
+    if isinstance(exc, subprocess.TimeoutExpired):
+        return "timeout", None
+    if isinstance(exc, MemoryError):
+        return "oom", None
+    if isinstance(exc, subprocess.CalledProcessError):
+        if exc.returncode == -signal.SIGKILL or exc.returncode == OOM_EXIT:
+            return "oom", exc.returncode
+        if exc.returncode < 0:
+            return "signal", exc.returncode
+        return "exit", exc.returncode
+    return "error", None
+
+def backoffDelay(attempt, backoff):
+    """
+    backoffDelay(attempt, backoff) - Seconds to wait after the given
+    failed attempt (1 for the first) before the next one.
+    """
+    return backoff * 2 ** (attempt - 1)
+
+def ledgerPath(output_dir):
+    """
+    ledgerPath(output_dir) - Failure ledger of the alignments written
+    to output_dir (e.g. ../results/genomic_hits => ../results/
+    failures.jsonl).
+    """
+    return os.path.join(os.path.dirname(os.path.normpath(
+                os.path.abspath(output_dir))), FAILURE_LEDGER)
+
+def recordFailure(ledger, record):
+    """
+    recordFailure(ledger, record) - Appends the given dict as one JSON
+    line to the failure ledger, with the time, host and pid. Records
+    are written with a single write, so parallel jobs can share a
+    ledger.
+    """
+    record = dict(record, time=time.time(), host=socket.gethostname(),
+                pid=os.getpid())
+    line = (json.dumps(record, sort_keys=True) + "\n").encode()
+    fd = os.open(ledger, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+def readLedger(ledger):
+    """
+    readLedger(ledger) - Records of the given failure ledger, skipping
+    lines cut short by a killed job. An empty list if there is none.
+    """
+    records = []
+    if not os.path.exists(ledger):
+        return records
+    with open(ledger, "r") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                pass
+    return records
+
+def pendingFailures(ledger):
+    """
+    pendingFailures(ledger) - Alignments of the given ledger to requeue:
+    those whose last final failure is more recent than their alignment
+    file, if any.
+
+    Returns: dict mapping (family, kind, bin) to the record of its last
+        final failure.
+    """
+    pending = {}
+    for r in readLedger(ledger):
+        if r.get("final"):
+            pending[(r["family"], r["kind"], r["bin"])] = r
+    for key, r in list(pending.items()):
+        sc_file = findScFile(r["sc_file"])
+        if os.path.exists(sc_file) and os.path.getmtime(sc_file) >= r["time"]:
+            del pending[key]
+    return pending
+
+def requeueBins(ledger):
+    """
+    requeueBins(ledger) - Bins to align again for each family of the
+    given ledger, by genome kind.
+
+    Returns: dict mapping each family with pending failures to a dict
+        mapping each genome kind to the set of its bin file names.
+    """
+    bins = {}
+    for (family, kind, bin_name) in pendingFailures(ledger):
+        bins.setdefault(family, {}).setdefault(kind, set()).add(bin_name)
+    return bins
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("ledger", help="failure ledger (failures.jsonl)")
+    parser.add_argument("--json", action="store_true",
+            help="print the pending failures as JSON lines")
+    args = parser.parse_args()
+
+    pending = pendingFailures(args.ledger)
+    counts = {}
+    for key, r in sorted(pending.items()):
+        counts[r["failure"]] = counts.get(r["failure"], 0) + 1
+        if args.json:
+            print(json.dumps(r, sort_keys=True))
+        else:
+            print("\t".join([r["family"], r["kind"], r["bin"], r["failure"],
+                    str(r.get("returncode")), str(r["attempt"]), r["error"]]))
+    if not args.json:
+        print(str(len(pending)) + " alignments to requeue" +
+            "".join([", " + str(n) + " " + c for c, n in sorted(counts.items())]))
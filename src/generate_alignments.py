@@ -9,8 +9,11 @@ project.
 Contains variety of util functions for:
  - separating consensus sequences into their own fa file
  - generating alignments between consensus sequences and genome GC
-   bins by running rmblastn
+   bins by running rmblastn, or another aligner backend (see
+   aligners.py)
  - Extracting scores from alignment output
+ - recovering the alignment text of selected hits of a score-only run
+   (--score_only) by aligning again against their region only
 
 You can run this script directly to split a given consensus file:
 $ python3 generate_alignments.py fa_file
@@ -27,8 +30,23 @@ import argparse
 import sys
 import os
 import subprocess
+import copy
+import re
+import tempfile
+import time
 
-from sequence_util import nearestDivergence
+from sequence_util import nearestDivergence, binSizes, BIN_FILE_REGEX
+from instrument import stage, fileSize
+from aligners import RMBlastAligner, ALIGNERS, fromArgs, readBatches
+from consensus_store import ConsensusStore
+from kmer_index import KmerPrefilter
+from hit_store import STORE_SUFFIX, SEQS_SUFFIX, HEADER_REGEX
+from score_histogram import HIST_SUFFIX
+from score_thresholds import AdaptiveMinScore
+from sc_io import ScWriter, scPath, scVariants, setCompression, SC_SUFFIXES
+import progress
+from failures import (retryPolicy, setRetryPolicy, classifyFailure,
+        recordFailure, ledgerPath, backoffDelay, RETRYABLE)
 
 DIV_VALUES = [14, 18, 20, 25, 30]
 GAP_PARAMS = {
@@ -37,6 +55,9 @@ GAP_PARAMS = {
         20: {"open": -30, "ext": -5},
         25: {"open": -27, "ext": -5}
     }
+# batch names of the bins: sequence:start-end in the genome
+BATCH_NAME_REGEX = re.compile(r"^(.+):(\d+)-(\d+)$")
+EXPLAIN_FLANK = 100
 
 def splitConsensus(fa_file):
     """
@@ -86,13 +107,15 @@ class ConsensusSequence:
             from.
         name - Name of the consensus sequence as given in original
             .fa file.
+        header - Header line of the original .fa file, without the
+            newline.
         seq - Sequence of bases making up this consensus sequence.
         divergence - Rounded average kimura divergence as given in
             original .fa file.
         gi - gap init parameter
         ge - gap extension parameter
     """
-    def __init__(self, fa_file):
+    def __init__(self, fa_file=None, text=None):
         """
         Initializes this ConsensusSequence with the given parameters.
         Retrieves the name and divergence from the given fa file.
@@ -106,15 +129,21 @@ class ConsensusSequence:
         Args:
             fa_file - name of the consensus fa file following the fa
             format.
+            text - the fa record itself, e.g. read from a
+            ConsensusStore (see consensus_store.py), in which case
+            fa_file is not read and fname is None.
         """
-        f = open(fa_file, "r")
-        lines = f.readlines()
+        if text == None:
+            f = open(fa_file, "r")
+            text = f.read()
+            f.close()
+        lines = text.splitlines()
         description = lines[0][1:].split()
         self.fname = fa_file
+        self.header = lines[0]
         self.name = description[0]
-        self.seq = "".join([x[:-1] for x in lines[1:]])
+        self.seq = "".join(lines[1:])
         self.__setDivergence__(float(description[1].split("=")[1]))
-        f.close()
 
     def __setDivergence__(self, div):
         """
@@ -128,63 +157,187 @@ class ConsensusSequence:
         self.gi = GAP_PARAMS[self.divergence]["open"]
         self.ge = GAP_PARAMS[self.divergence]["ext"]
 
-def runRMBlast(consensus, bin_file, output_dir):
+def genomeKind(output_dir):
     """
-    runRMBlast(consensus, bin_file, output_dir) - Run RMBlast against
-    bin_file, generating all the alignments of the given
-    ConsensusSequence against that bin and placing the results in
-    output_dir.
+    genomeKind(output_dir) - Name of the kind of genome the alignments
+    in output_dir are against, e.g. "genomic" for
+    ../results/genomic_hits/.
+    """
+    return os.path.basename(os.path.normpath(output_dir)).split("_")[0]
+
+def removeStale(sc_file):
+    """
+    removeStale(sc_file) - Removes the other variants (plain or
+    compressed, see sc_io.py) of the given alignment file, with the
+    hit stores and histograms built from them, so readers never pick
+    up the results of an earlier run.
+    """
+    for stale in scVariants(sc_file):
+        if stale == sc_file:
+            continue
+        for suffix in ["", STORE_SUFFIX, SEQS_SUFFIX, HIST_SUFFIX]:
+            if os.path.exists(stale + suffix):
+                os.remove(stale + suffix)
+
+def alignOnce(consensus, bin_file, matrix_file, sc_file, stderr_file,
+        aligner, prefilter, st):
+    """
+    alignOnce(consensus, bin_file, matrix_file, sc_file, stderr_file,
+    aligner, prefilter, st) - One attempt at the alignments of
+    runRMBlast, written to a temporary file moved over sc_file once the
+    aligner has succeeded, and removed otherwise.
+
+    Returns: None, or the exception that stopped the aligner.
+    """
+    tmp_file = sc_file + ".tmp" + str(os.getpid())
+    fStdout = ScWriter(tmp_file)
+    fStderr = open(stderr_file, "w")
+    error = None
+    try:
+        if prefilter == None:
+            proc = aligner.align(consensus, bin_file, matrix_file,
+                                fStdout, fStderr, st)
+        else:
+            with prefilter.subject(bin_file, consensus.seq) as (subject,
+                    selected, total):
+                st.set(batches=selected, bin_batches=total)
+                proc = 0
+                if subject != None:
+                    proc = aligner.align(consensus, subject, matrix_file,
+                                        fStdout, fStderr, st)
+        if proc != 0:
+            raise subprocess.CalledProcessError(proc, aligner.name)
+    except Exception as e:
+        error = e
+    fStdout.close()
+    fStderr.close()
+    if error == None:
+        os.replace(tmp_file, sc_file)
+    else:
+        os.remove(tmp_file)
+    return error
+
+def runRMBlast(consensus, bin_file, output_dir, aligner=None, prefilter=None,
+        minscore=None, stderr_file=None):
+    """
+    runRMBlast(consensus, bin_file, output_dir, aligner, prefilter,
+    minscore, stderr_file) -
+    Run RMBlast
+    (or the given aligner) against bin_file, generating all the
+    alignments of the given ConsensusSequence against that bin and
+    placing the results in output_dir.
 
     The format of the output file produced will be:
-        [consensus_name]_[##]p[##]g.sc
+        [consensus_name]_[##]p[##]g.sc[.gz|.zst]
+
+        Ex: DF00001_25p49g.sc.gz
 
-        Ex: DF00001_25p49g.sc
+    compressed as the aligner writes it, with the compression set in
+    sc_io.py (any other variant of the file left by an earlier run is
+    removed).
 
     The first column of each entry in the output file is the score
     for that particular alignment, which will be extracted in later
     steps to calculate E-values and false discovery rate.
 
+    The output is written under a temporary name and only moved into
+    place once the aligner has succeeded. Failed attempts are retried
+    with the retry policy and timeout set in failures.py, and recorded
+    in the failure ledger of the genome; when every attempt fails, the
+    alignment file of an earlier run, if any, is left as it was.
+
     Args:
         consensus - A ConsensusSequence generated from a fa file for
             a single consensus sequence.
         bin_file - File containing batches to align against, produced
             from bin_genome.py.
         output_dir - Directory to place output alignment files.
+        aligner - Aligner backend to run (see aligners.py), RMBlast
+            through rbn by default.
+        prefilter - optional KmerPrefilter (see kmer_index.py): only
+            the batches of the bin sharing enough k-mers with the
+            consensus are aligned against.
+        minscore - optional AdaptiveMinScore (see score_thresholds.py)
+            setting the smallest score reported for this consensus and
+            matrix, instead of the minscore of the aligner.
+        stderr_file - file receiving the stderr of the aligner
+            (default: output_dir/stderr, shared by every alignment).
+
+    Returns: None, or the error that stopped the aligner at the last
+        attempt, as "[failure class]: [exception]".
     """
     bin_num = bin_file[-5:-3]
-    fname = (consensus.name + "/" + consensus.name + "_" +
-            str(consensus.divergence) + "p" + bin_num + "g.sc")
-    matrix_file = ("../data/matrices/" + str(consensus.divergence) +
-                "p" + bin_num + "g.matrix")
-
-    params = [ "/home/rhubley/scripts/rbn",
-                bin_file, consensus.fname,
-                "-matrix", matrix_file,
-                "-gi", str(consensus.gi),
-                "-ge", str(consensus.ge),
-                "-minmatch", "7",
-                "-masklevel", "101",
-                "-minscore", "50",
-                "-a", "-r" ]
-    print(" ".join(params))
+    matrix = str(consensus.divergence) + "p" + bin_num + "g"
+    fname = scPath(consensus.name + "/" + consensus.name + "_" + matrix +
+                ".sc")
+    sc_file = os.path.join(output_dir, fname)
+    matrix_file = "../data/matrices/" + matrix + ".matrix"
+
+    if stderr_file == None:
+        stderr_file = os.path.join(output_dir, "stderr")
+    if aligner == None:
+        aligner = RMBlastAligner()
+    if minscore != None:
+        score = minscore.minScore(consensus, matrix)
+        if score != None:
+            aligner = copy.copy(aligner)
+            aligner.minscore = score
+    retries, timeout, backoff = retryPolicy()
+    if timeout != None:
+        aligner = copy.copy(aligner)
+        aligner.timeout = timeout
 
     if not os.path.exists(os.path.join(output_dir, consensus.name)):
         os.mkdir(os.path.join(output_dir, consensus.name))
-    fStdout = open(os.path.join(output_dir, fname), "w")
-    fStderr = open(os.path.join(output_dir, "stderr"), "w")
-    proc = None
-    try:
-        proc = subprocess.check_call(params, stdout=fStdout,
-                                        stderr=fStderr)
-    except:
-        fStdout.write("rmblast exception: " + str(sys.exc_info()[0]) )
-        pass
-    fStdout.close()
-    fStderr.close()
+    kind = genomeKind(output_dir)
+    bin_name = os.path.basename(bin_file)
+    progress.binStarted(consensus.name, kind, bin_name)
+    with stage("runRMBlast", family=consensus.name, matrix=matrix,
+            kind=kind, bin=bin_name, aligner=aligner.name,
+            minscore=getattr(aligner, "minscore", None),
+            input_bytes=fileSize(bin_file) + len(consensus.seq)) as st:
+        attempt = 0
+        error = None
+        while True:
+            attempt += 1
+            exc = alignOnce(consensus, bin_file, matrix_file, sc_file,
+                        stderr_file, aligner, prefilter, st)
+            if exc == None:
+                error = None
+                # the results of earlier runs only go once replaced
+                removeStale(sc_file)
+                for suffix in [STORE_SUFFIX, SEQS_SUFFIX, HIST_SUFFIX]:
+                    if os.path.exists(sc_file + suffix):
+                        os.remove(sc_file + suffix)
+                break
+            failure, returncode = classifyFailure(exc)
+            error = failure + ": " + repr(exc)
+            final = failure not in RETRYABLE or attempt > retries
+            recordFailure(ledgerPath(output_dir), {"family": consensus.name,
+                    "kind": kind, "bin": bin_name, "bin_file": bin_file,
+                    "matrix": matrix, "sc_file": os.path.abspath(sc_file),
+                    "aligner": aligner.name, "failure": failure,
+                    "returncode": returncode, "error": repr(exc),
+                    "attempt": attempt, "final": final})
+            if final:
+                break
+            sys.stderr.write(consensus.name + " " + kind + " " + bin_name +
+                    " failed (" + error + "), retry " + str(attempt) + "/" +
+                    str(retries) + "\n")
+            time.sleep(backoffDelay(attempt, backoff))
+        st.set(attempts=attempt)
+        if error != None:
+            st.set(error=error)
+        st.set(output_bytes=fileSize(sc_file))
+    progress.binFinished(consensus.name, kind, bin_name, fileSize(bin_file),
+            error)
+    return error
 
-def generateAlignments(consensus_file, bins_dir, output_dir):
+def generateAlignments(consensus_file, bins_dir, output_dir, aligner=None,
+        prefilter=None, minscore=None, bins=None):
     """
-    generateAlignments(consensus_file, bins_dir, output_dir) -
+    generateAlignments(consensus_file, bins_dir, output_dir, aligner,
+    prefilter, minscore, bins) -
     Wrapper for runRMBlast that generates alignments for every bin in
     bins_dir, printing them all to files in output_dir.
 
@@ -193,16 +346,123 @@ def generateAlignments(consensus_file, bins_dir, output_dir):
 
     Args:
         consensus_file - Path to a .fa file containing a single
-            consensus sequence.
+            consensus sequence, or a ConsensusSequence.
         bins_dir - Path to directory containing bins from a genome,
             produced from bin_genome.py.
         output_dir - Directory to place output alignments files.
+        aligner - Aligner backend to run, see runRMBlast.
+        prefilter - optional KmerPrefilter, see runRMBlast.
+        minscore - optional AdaptiveMinScore, see runRMBlast.
+        bins - if given, only align against the bin files of bins_dir
+            with these names (e.g. those to requeue, see failures.py).
+
+    Returns: list of (bin file name, error) of the alignments that
+        failed.
     """
-    cs = ConsensusSequence(consensus_file)
+    if isinstance(consensus_file, ConsensusSequence):
+        cs = consensus_file
+    else:
+        cs = ConsensusSequence(consensus_file)
     binlist = [ b for b in os.listdir(bins_dir) ]
-    for b in binlist:
-        if b[:9] != "ncResults":
-            runRMBlast(cs, os.path.join(bins_dir, b), output_dir)
+    errors = []
+    with stage("generateAlignments", family=cs.name,
+            kind=genomeKind(output_dir)):
+        for b in binlist:
+            if BIN_FILE_REGEX.match(b) and (bins == None or b in bins):
+                error = runRMBlast(cs, os.path.join(bins_dir, b), output_dir,
+                        aligner, prefilter, minscore)
+                if error != None:
+                    errors.append((b, error))
+    return errors
+
+def splitRecords(text):
+    """
+    splitRecords(text) - Splits the output of an aligner into one
+    record per hit: its header line and the alignment text after it.
+
+    Returns: list of (header match, record text).
+    """
+    records = []
+    for line in text.splitlines(True):
+        mo = HEADER_REGEX.match(line)
+        if mo:
+            records.append((mo, [line]))
+        elif len(records) > 0:
+            records[-1][1].append(line)
+    return [(mo, "".join(lines)) for mo, lines in records]
+
+def explainHits(consensus, hits, seqs, bin_file, matrix_file, aligner, out,
+        flank=EXPLAIN_FLANK):
+    """
+    explainHits(consensus, hits, seqs, bin_file, matrix_file, aligner,
+    out) - Recovers the alignment text of the given hits, e.g. of a
+    score-only run, by aligning the consensus again against the region
+    of each hit only: its genome coordinates in its batch of bin_file,
+    widened by flank bases on each side.
+
+    The region is named after its genome coordinates, so the header
+    line written for each hit keeps the coordinates of the original
+    run. Of the alignments found in a region, the one on the strand of
+    the hit overlapping it the most is written to out.
+
+    Args:
+        consensus - ConsensusSequence the hits were found with.
+        hits - records of a HitStore (see hit_store.py).
+        seqs - sequence names of that HitStore.
+        bin_file - bin the hits were found in.
+        matrix_file - matrix they were found with.
+        aligner - Aligner backend (see aligners.py); the alignment
+            text is written whatever its alignments setting.
+        out - open file the alignments are written to.
+        flank - bases added on each side of a hit.
+
+    Returns: number of hits whose alignment was found again.
+    """
+    aligner = copy.copy(aligner)
+    aligner.alignments = True
+    wanted = set([(seqs[h["seq"]], int(h["batch_start"])) for h in hits])
+    batches = {}
+    for name, seq in readBatches(bin_file):
+        mo = BATCH_NAME_REGEX.match(name)
+        if mo and (mo.group(1), int(mo.group(2))) in wanted:
+            batches[(mo.group(1), int(mo.group(2)))] = seq
+    found = 0
+    for h in hits:
+        key = (seqs[h["seq"]], int(h["batch_start"]))
+        if key not in batches:
+            continue
+        batch = batches[key]
+        lo = max(int(h["start"]) - key[1] - flank, 0)
+        hi = min(int(h["end"]) - key[1] + 1 + flank, len(batch))
+        fd, region_file = tempfile.mkstemp(suffix=".fa")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(">" + key[0] + ":" + str(key[1] + lo) + "-" +
+                        str(key[1] + hi - 1) + "\n")
+                for i in range(lo, hi, 60):
+                    f.write(batch[i:min(i + 60, hi)] + "\n")
+            with tempfile.TemporaryFile("w+") as f_out:
+                with open(os.devnull, "w") as f_err:
+                    aligner.align(consensus, region_file, matrix_file,
+                                f_out, f_err)
+                f_out.seek(0)
+                records = splitRecords(f_out.read())
+        finally:
+            os.remove(region_file)
+        best = None
+        for mo, record in records:
+            region_start = int(mo.group(6))
+            start = region_start + int(mo.group(7)) - 1
+            end = region_start + int(mo.group(8)) - 1
+            strand = -1 if mo.group(9) else 1
+            overlap = min(end, int(h["end"])) - max(start, int(h["start"]))
+            if strand == h["strand"] and overlap >= 0 and (best == None or
+                    overlap > best[0]):
+                best = (overlap, record)
+        if best != None:
+            out.write(best[1])
+            found += 1
+    return found
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -217,14 +477,70 @@ if __name__ == '__main__':
             help="path to directory containing genome bins")
     parser.add_argument("output_dir",
             help="path to directory to put alignment output files")
+    parser.add_argument("--aligner", default="rmblast",
+            choices=sorted(ALIGNERS),
+            help="aligner backend, see aligners.py")
+    parser.add_argument("--rbn", default=None,
+            help="path of the rbn script run by the rmblast aligner " +
+                "(default: $DFAM_RBN, or rbn on the PATH)")
+    parser.add_argument("--prefilter", type=int, default=None,
+            metavar="MIN_SHARED",
+            help="only align against the batches sharing at least " +
+                "MIN_SHARED indexed k-mers with the consensus (needs " +
+                "the k-mer indexes of the bins, see kmer_index.py)")
+    parser.add_argument("--compression", default=None,
+            choices=sorted(SC_SUFFIXES),
+            help="compression of the alignment files (default: " +
+                "$DFAM_SC_COMPRESSION, or zstd if installed, else gzip)")
+    parser.add_argument("--score_only", action="store_true",
+            help="only write the header line of each hit, without the " +
+                "alignment text (see explainHits to recover it)")
+    parser.add_argument("--adaptive_minscore", type=int, default=None,
+            metavar="MARGIN",
+            help="report the hits scoring at most MARGIN under the " +
+                "lowest theoretical threshold of each matrix, instead " +
+                "of every hit over 50 (see score_thresholds.py)")
+    parser.add_argument("--genome_bins", default=None,
+            help="with --adaptive_minscore, bins of the genome the " +
+                "thresholds are computed for (default: bins_dir); pass " +
+                "them when aligning against benchmark bins")
+    parser.add_argument("--retries", type=int, default=None,
+            help="retries of a failed alignment (default: " +
+                "$DFAM_RETRIES, or 2), see failures.py")
+    parser.add_argument("--timeout", type=float, default=None,
+            help="seconds before an aligner process is killed " +
+                "(default: $DFAM_ALIGN_TIMEOUT, or no timeout)")
+    parser.add_argument("--backoff", type=float, default=None,
+            help="seconds before the first retry, doubled at each " +
+                "retry (default: $DFAM_RETRY_BACKOFF, or 30)")
     args = parser.parse_args()
 
-    if args.m:
-        dir_name = splitConsensus(args.fa_file)
+    if args.compression != None:
+        setCompression(args.compression)
+    setRetryPolicy(args.retries, args.timeout, args.backoff)
 
-        filelist = [ f for f in os.listdir(dir_name) ]
-        for f in filelist:
-            generateAlignments(os.path.join(dir_name, f),
-                            args.bins_dir, args.output_dir)
+    aligner = fromArgs(args)
+    prefilter = None
+    if args.prefilter != None:
+        prefilter = KmerPrefilter(args.prefilter)
+    minscore = None
+    if args.adaptive_minscore != None:
+        genome_bins = args.genome_bins
+        if genome_bins == None:
+            genome_bins = args.bins_dir
+        minscore = AdaptiveMinScore(binSizes(genome_bins),
+                        args.adaptive_minscore)
+
+    errors = []
+    if args.m:
+        store = ConsensusStore(args.fa_file)
+        for name in store.names:
+            errors += generateAlignments(
+                            ConsensusSequence(text=store.record(name)),
+                            args.bins_dir, args.output_dir, aligner,
+                            prefilter, minscore)
     else:
-        generateAlignments(args.fa_file, args.bins_dir, args.output_dir)
+        errors = generateAlignments(args.fa_file, args.bins_dir,
+                        args.output_dir, aligner, prefilter, minscore)
+    if len(errors) > 0:
+        sys.exit(1)
@@ -0,0 +1,181 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+genome_registry.py - Registry of the genome assemblies thresholds can
+be computed for, read from ../data/genomes.json:
+
+{
+    "hg38": {
+        "bins": "../data/hg38bins/dfamseq_bins",
+        "benchmark_bins": "../data/hg38bins/benchmark_bins",
+        "size": 3209286105,
+        "gumbel_params": "../data/gumbel_params.txt",
+        "results": "../results"
+    },
+    ...
+}
+
+where bins and benchmark_bins are the GC bins of the genome and of its
+benchmark (see bin_genome.py), size is the number of bps of the
+assembly, gumbel_params the Gumbel parameter file fitted for it (see
+gumbel_fit.py) and results the directory its alignments, thresholds
+and results database are written to. results defaults to
+../results/[genome]; hg38 keeps ../results.
+
+You can run this script directly to list the registered genomes, or
+to register one:
+
+$ python3 genome_registry.py list [--registry FILE]
+$ python3 genome_registry.py add name bins benchmark_bins size
+        [--gumbel_params FILE] [--results DIR] [--registry FILE]
+
+AUTHOR(S):
+    Eric Yeh
+"""
+
+#
+# Module imports
+#
+import argparse
+import json
+import os
+
+from sequence_util import binSizes
+
+GENOME_REGISTRY = "../data/genomes.json"
+DEFAULT_GENOME = "hg38"
+RESULTS_ROOT = "../results"
+DEFAULT_GUMBEL_PARAMS = "../data/gumbel_params.txt"
+
+class Genome:
+    """
+    Registered genome assembly.
+
+    Fields:
+        name - name of the assembly, e.g. hg38.
+        bins - directory of the GC bins of the genome.
+        benchmark_bins - directory of the GC bins of its benchmark.
+        size - number of bps of the assembly.
+        gumbel_params - Gumbel parameter file fitted for the genome.
+        results - directory the results of the genome are written to.
+    """
+    def __init__(self, name, bins, benchmark_bins, size,
+            gumbel_params=DEFAULT_GUMBEL_PARAMS, results=None):
+        self.name = name
+        self.bins = bins
+        self.benchmark_bins = benchmark_bins
+        self.size = int(size)
+        self.gumbel_params = gumbel_params
+        if results == None:
+            results = os.path.join(RESULTS_ROOT, name)
+        self.results = results
+
+    def genomicHits(self):
+        return os.path.join(self.results, "genomic_hits")
+
+    def benchmarkHits(self):
+        return os.path.join(self.results, "benchmark_hits")
+
+    def thresholdsDir(self):
+        return os.path.join(self.results, "thresholds")
+
+    def thresholdsTable(self):
+        return os.path.join(self.results, "thresholds.txt")
+
+    def resultsDb(self):
+        return os.path.join(self.results, "results.db")
+
+    def subjectSize(self):
+        """
+        subjectSize(self) - Subject size of the thresholds: the size of
+        each GC bin if the bins exist, otherwise the assembly size.
+        """
+        if os.path.isdir(self.bins):
+            return binSizes(self.bins)
+        return self.size
+
+    def makeDirs(self):
+        """
+        makeDirs(self) - Creates the result directories of the genome.
+        """
+        for d in [self.genomicHits(), self.benchmarkHits(),
+                self.thresholdsDir()]:
+            os.makedirs(d, exist_ok=True)
+
+    def toDict(self):
+        return {"bins": self.bins, "benchmark_bins": self.benchmark_bins,
+                "size": self.size, "gumbel_params": self.gumbel_params,
+                "results": self.results}
+
+def readRegistry(path=GENOME_REGISTRY):
+    """
+    readRegistry(path) - Reads the genome registry.
+
+    Returns: dict mapping each genome name to its Genome.
+    """
+    with open(path, "r") as f:
+        entries = json.load(f)
+    return {name: Genome(name, e["bins"], e["benchmark_bins"], e["size"],
+                    e.get("gumbel_params", DEFAULT_GUMBEL_PARAMS),
+                    e.get("results"))
+            for name, e in entries.items()}
+
+def getGenome(name=DEFAULT_GENOME, path=GENOME_REGISTRY):
+    """
+    getGenome(name, path) - Genome registered under the given name.
+
+    Raises: KeyError if the genome is not registered.
+    """
+    registry = readRegistry(path)
+    if name not in registry:
+        raise KeyError(name + " is not registered in " + path +
+                ", add it with genome_registry.py add")
+    return registry[name]
+
+def writeRegistry(registry, path=GENOME_REGISTRY):
+    """
+    writeRegistry(registry, path) - Writes the given dict of Genomes
+    as the genome registry (under a temporary name first, then moved
+    into place).
+    """
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({name: g.toDict() for name, g in sorted(registry.items())},
+                f, indent=4)
+        f.write("\n")
+    os.replace(tmp, path)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    list_parser = subparsers.add_parser("list",
+            help="list the registered genomes")
+    add_parser = subparsers.add_parser("add",
+            help="register a genome (or replace its entry)")
+    add_parser.add_argument("name", help="name of the assembly")
+    add_parser.add_argument("bins", help="directory of its GC bins")
+    add_parser.add_argument("benchmark_bins",
+            help="directory of the GC bins of its benchmark")
+    add_parser.add_argument("size", type=int,
+            help="number of bps of the assembly")
+    add_parser.add_argument("--gumbel_params", default=DEFAULT_GUMBEL_PARAMS,
+            help="Gumbel parameter file fitted for the genome")
+    add_parser.add_argument("--results", default=None,
+            help="results directory (default: ../results/[name])")
+    for p in [list_parser, add_parser]:
+        p.add_argument("--registry", default=GENOME_REGISTRY,
+                help="path of the genome registry")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        for name, g in sorted(readRegistry(args.registry).items()):
+            print(name + "\t" + str(g.size) + "\t" + g.bins + "\t" +
+                    g.benchmark_bins + "\t" + g.gumbel_params + "\t" +
+                    g.results)
+    else:
+        registry = {}
+        if os.path.exists(args.registry):
+            registry = readRegistry(args.registry)
+        registry[args.name] = Genome(args.name, args.bins, args.benchmark_bins,
+                                args.size, args.gumbel_params, args.results)
+        writeRegistry(registry, args.registry)
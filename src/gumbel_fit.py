@@ -0,0 +1,292 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+gumbel_fit.py: Fits the Gumbel parameters lambda and K used to
+compute E-values for each scoring matrix, and caches them in the
+parameter file read by score_thresholds.py (../data/gumbel_params.txt).
+
+Alignments against benchmark bins (or of shuffled consensus
+sequences against genomic bins) are hits found by chance, so their
+scores follow the extreme value distribution of random alignments.
+The expected number of such hits scoring at least x is
+
+    N(x) = K * m * n * e^(-lambda * x)
+
+so the scores above a cutoff u are geometrically distributed. The
+maximum-likelihood estimates are
+
+    lambda = log(1 + 1 / mean(S - u))
+    K = N(u) * e^(lambda * u) / sum(m * n)
+
+where S are the scores >= u and the sum runs over every alignment
+run used in the fit. Each matrix is fitted in its own process.
+
+You can run this script directly to fit every matrix found in a
+directory of alignments:
+
+$ python3 gumbel_fit.py fit hits_dir [--consensus_dir DIR] [--bins BINS]
+
+or to write a shuffled copy of a consensus library, whose alignments
+can then be used for the fit instead of the benchmark alignments:
+
+$ python3 gumbel_fit.py shuffle fa_file output_file
+
+AUTHOR(S):
+    Eric Yeh
+"""
+
+#
+# Module imports
+#
+import argparse
+import os
+import random
+import re
+from multiprocessing import Pool
+
+import numpy as np
+
+from sequence_util import binSizes
+from consensus_store import querySize
+from score_thresholds import (readScoresFromFile,
+        matrixChecksum, readGumbelParams, subjectSize, GUMBEL_PARAMS,
+        MATRIX_DIR, TEMP_CONSENSUS_SIZE, TEMP_GENOME_SIZE)
+from sc_io import findScFile
+
+MIN_FIT_HITS = 100
+TAIL_QUANTILE = 0.5
+GC_MATRIX_REGEX = re.compile(r"\d+p\d+g")
+
+def fitGumbel(scores, search_space, cutoff=None):
+    """
+    fitGumbel(scores, search_space, cutoff) - Estimates lambda and K
+    from the scores of chance alignments by maximum likelihood on the
+    tail of the score distribution.
+
+    Args:
+        scores - array of the raw scores of all the chance alignments
+            found for one matrix.
+        search_space - sum of m * n over every alignment run the
+            scores were taken from.
+        cutoff - only scores >= cutoff are used. Defaults to the
+            median score, low scores being truncated by -minscore.
+
+    Returns: dict with "lambda", "k" and "hits" (number of scores
+        used in the fit), or None if there are too few scores.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    if cutoff == None and len(scores) > 0:
+        cutoff = int(np.floor(np.quantile(scores, TAIL_QUANTILE)))
+    tail = scores[scores >= cutoff] if len(scores) > 0 else scores
+    if len(tail) < MIN_FIT_HITS:
+        return None
+    excess = tail.mean() - cutoff
+    if excess <= 0:
+        return None
+    lam = float(np.log1p(1.0 / excess))
+    k = float(len(tail) * np.exp(lam * cutoff) / search_space)
+    return {"lambda": lam, "k": k, "hits": len(tail)}
+
+def collectScores(hits_dir, matrix, consensus_dir=None,
+        subject_size=TEMP_GENOME_SIZE):
+    """
+    collectScores(hits_dir, matrix) - Gathers the scores of every
+    consensus' alignments with the given matrix, along with the
+    search space they were found in.
+
+    Args:
+        hits_dir - directory with one directory of alignments per
+            consensus sequence (e.g. ../results/benchmark_hits).
+        matrix - name of the matrix to collect scores for.
+        consensus_dir - directory of [consensus_name].fa files, or a
+            consensus library, used for the size of each consensus (m).
+        subject_size - number of bps searched (n), or dict of sizes per
+            GC bin.
+
+    Returns: tuple (scores, search_space)
+    """
+    scores = []
+    search_space = 0
+    n = subjectSize(subject_size, matrix)
+    for consensus in sorted(os.listdir(hits_dir)):
+        sc_file = findScFile(os.path.join(hits_dir, consensus,
+                        consensus + "_" + matrix + ".sc"))
+        if not os.path.exists(sc_file):
+            continue
+        m = TEMP_CONSENSUS_SIZE
+        if consensus_dir != None:
+            m = querySize(consensus_dir, consensus)
+        scores.append(np.asarray(readScoresFromFile(sc_file),
+                            dtype=np.int64))
+        search_space += m * n
+    if len(scores) == 0:
+        return np.zeros(0, dtype=np.int64), 0
+    return np.concatenate(scores), search_space
+
+def __fitMatrix__(job):
+    """
+    Worker run by fitMatrices in a separate process.
+    """
+    matrix, hits_dir, consensus_dir, subject_size, cutoff = job
+    scores, search_space = collectScores(hits_dir, matrix, consensus_dir,
+                                subject_size)
+    if search_space == 0:
+        return matrix, None
+    return matrix, fitGumbel(scores, search_space, cutoff)
+
+def writeGumbelParams(params, params_file=GUMBEL_PARAMS):
+    """
+    writeGumbelParams(params, params_file) - Writes the given
+    parameters (keyed by matrix checksum, see
+    score_thresholds.readGumbelParams) to params_file, sorted by
+    matrix name. The file is replaced atomically so jobs reading it
+    never see a partial file.
+    """
+    tmp_file = params_file + ".tmp"
+    with open(tmp_file, "w") as f:
+        f.write("#checksum\tmatrix\tlambda\tk\thits\n")
+        for checksum, p in sorted(params.items(),
+                key=lambda x: x[1]["matrix"]):
+            f.write(checksum + "\t" + p["matrix"] + "\t" +
+                str(p["lambda"]) + "\t" + str(p["k"]) + "\t" +
+                str(p["hits"]) + "\n")
+    os.replace(tmp_file, params_file)
+
+def fitMatrices(hits_dir, matrices=None, consensus_dir=None,
+        subject_size=TEMP_GENOME_SIZE, cutoff=None, refit=False,
+        params_file=GUMBEL_PARAMS, processes=None):
+    """
+    fitMatrices(hits_dir) - Fits the Gumbel parameters of each matrix
+    in parallel and merges them into the parameter file.
+
+    Matrices whose checksum is already in the parameter file are
+    skipped unless refit is set, so a new matrix (or a changed one)
+    only costs a fit for that matrix.
+
+    Args:
+        hits_dir - directory with one directory of chance alignments
+            per consensus sequence.
+        matrices - names of the matrices to fit (default: every GC
+            matrix in MATRIX_DIR, e.g. 14p41g, of a bin of subject_size
+            if it is a dict).
+        consensus_dir - directory of consensus fa files, or a
+            consensus library.
+        subject_size - number of bps searched, or dict of sizes per GC
+            bin.
+        cutoff - score cutoff for the fit (default: median score).
+        refit - fit matrices that already have parameters.
+        params_file - parameter file to update.
+        processes - number of worker processes.
+
+    Returns: dict mapping each fitted matrix to its parameters.
+    """
+    if matrices == None:
+        matrices = sorted([ f[:-7] for f in os.listdir(MATRIX_DIR)
+                        if f.endswith(".matrix") and
+                        GC_MATRIX_REGEX.fullmatch(f[:-7]) ])
+        if isinstance(subject_size, dict):
+            matrices = [ matrix for matrix in matrices
+                        if int(matrix[-3:-1]) in subject_size ]
+    params = readGumbelParams(params_file)
+    checksums = {}
+    for matrix in matrices:
+        checksums[matrix] = matrixChecksum(os.path.join(MATRIX_DIR,
+                                    matrix + ".matrix"))
+    jobs = [ (matrix, hits_dir, consensus_dir, subject_size, cutoff)
+                for matrix in matrices
+                if refit or checksums[matrix] not in params ]
+    fitted = {}
+    with Pool(processes) as pool:
+        for matrix, fit in pool.imap_unordered(__fitMatrix__, jobs):
+            if fit == None:
+                print("not enough hits to fit " + matrix)
+                continue
+            print(matrix + "\tlambda=" + str(fit["lambda"]) + "\tk=" +
+                    str(fit["k"]) + "\thits=" + str(fit["hits"]))
+            fit["matrix"] = matrix
+            params[checksums[matrix]] = fit
+            fitted[matrix] = fit
+    writeGumbelParams(params, params_file)
+    return fitted
+
+def shuffleConsensus(fa_file, output_file, seed=0):
+    """
+    shuffleConsensus(fa_file, output_file, seed) - Writes a copy of
+    the given consensus library in which every sequence has been
+    shuffled, keeping its header, length and base composition.
+    Alignments of the shuffled library against genomic bins are
+    chance alignments that can be passed to fitMatrices.
+
+    Args:
+        fa_file - fa file containing consensus sequence(s).
+        output_file - path of the shuffled fa file to write.
+        seed - seed of the random number generator.
+    """
+    rng = random.Random(seed)
+
+    def writeRecord(out, header, seq):
+        bases = list("".join(seq))
+        rng.shuffle(bases)
+        out.write(header)
+        out.write("".join(bases) + "\n")
+
+    with open(fa_file, "r") as f, open(output_file, "w") as out:
+        header = None
+        seq = []
+        for line in f:
+            if line[0] == ">":
+                if header != None:
+                    writeRecord(out, header, seq)
+                header = line
+                seq = []
+            else:
+                seq.append(line.strip())
+        if header != None:
+            writeRecord(out, header, seq)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    fit_parser = subparsers.add_parser("fit",
+            help="fit lambda and K for each matrix")
+    fit_parser.add_argument("hits_dir",
+            help="directory with one directory of benchmark (or " +
+                "shuffled) alignments per consensus sequence")
+    fit_parser.add_argument("--matrices", nargs="+", default=None,
+            help="names of the matrices to fit (default: all GC " +
+                "matrices)")
+    fit_parser.add_argument("--consensus_dir", default=None,
+            help="directory of consensus fa files (or consensus " +
+                "library), used for the size of each consensus")
+    fit_parser.add_argument("--bins", default=None,
+            help="directory of the bins the alignments were run " +
+                "against, used for the size searched by each matrix")
+    fit_parser.add_argument("--n", type=int, default=TEMP_GENOME_SIZE,
+            help="size searched by each matrix if --bins is not given")
+    fit_parser.add_argument("--cutoff", type=int, default=None,
+            help="lowest score used in the fit (default: median)")
+    fit_parser.add_argument("--refit", action="store_true",
+            help="refit matrices that already have parameters")
+    fit_parser.add_argument("--params", default=GUMBEL_PARAMS,
+            help="parameter file to update")
+    fit_parser.add_argument("-p", "--processes", type=int, default=None,
+            help="number of worker processes")
+    shuffle_parser = subparsers.add_parser("shuffle",
+            help="write a shuffled copy of a consensus library")
+    shuffle_parser.add_argument("fa_file",
+            help="fa file containing consensus sequence(s)")
+    shuffle_parser.add_argument("output_file",
+            help="path of the shuffled fa file")
+    shuffle_parser.add_argument("--seed", type=int, default=0,
+            help="random seed")
+    args = parser.parse_args()
+
+    if args.command == "shuffle":
+        shuffleConsensus(args.fa_file, args.output_file, args.seed)
+    else:
+        subject_size = args.n
+        if args.bins != None:
+            subject_size = binSizes(args.bins)
+        fitMatrices(args.hits_dir, args.matrices, args.consensus_dir,
+            subject_size, args.cutoff, args.refit, args.params,
+            args.processes)
@@ -0,0 +1,265 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+hit_store.py - Parses the alignment (.sc) files produced by RMBlast
+once into a columnar store, so the scores, coordinates and strands of
+the hits never have to be regexed out of the text again.
+
+Each alignment header line has the form:
+
+  239 13.93 0.00 1.61 chr1:10001-70000 10469 10592 (59408) DF0000002 1 124 (187)
+  239 13.93 0.00 1.61 chr1:10001-70000 10469 10592 (59408) C DF0000002 (187) 124 1
+
+i.e. score, divergence, deletions, insertions, subject batch
+(sequence:start-end in the genome), start and end in the batch, bases
+left in the batch, "C" for hits on the reverse strand, consensus name,
+and the consensus start/end (reversed for "C" hits) with the bases left
+in the consensus.
+
+The parsed hits are stored next to the alignment file as a NumPy
+structured array ([file].npy, loaded memory-mapped) and the names of
+the sequences the batches come from ([file].seqs, after a first line
+with the size and mtime of the alignment file the store was parsed
+from). Each record holds:
+
+    score - raw alignment score
+    div, dels, ins - divergence, deletion and insertion percentages
+    seq - index into the sequence names
+    batch_start - one-based genome position where the batch starts
+    start, end - one-based, inclusive genome coordinates of the hit
+    strand - 1 for forward hits, -1 for "C" hits
+    cons_start, cons_end - one-based, inclusive consensus coordinates
+    cons_left - consensus bases after cons_end
+
+You can run this script directly to build the stores for every
+alignment file under the given directories:
+
+$ python3 hit_store.py dir [dir ...]
+
+AUTHOR(S):
+    Eric Yeh
+"""
+
+#
+# Module imports
+#
+import argparse
+import os
+import re
+
+import numpy as np
+
+from score_histogram import histogramFromScores
+from sc_io import openSc, isScFile
+
+HIT_DTYPE = np.dtype([
+        ("score", np.int32),
+        ("div", np.float32),
+        ("dels", np.float32),
+        ("ins", np.float32),
+        ("seq", np.int32),
+        ("batch_start", np.int64),
+        ("start", np.int64),
+        ("end", np.int64),
+        ("strand", np.int8),
+        ("cons_start", np.int32),
+        ("cons_end", np.int32),
+        ("cons_left", np.int32)
+    ])
+HEADER_REGEX = re.compile(r"^\s*(\d+)\s+(\d+\.\d+)\s+(\d+\.\d+)\s+" +
+        r"(\d+\.\d+)\s+(\S+):(\d+)-\d+\s+(\d+)\s+(\d+)\s+\(\d+\)\s+" +
+        r"(C\s+)?\S+\s+\(?(\d+)\)?\s+\(?(\d+)\)?\s+\(?(\d+)\)?(\s|$)")
+# the same pattern matched over blocks of lines, so the lines that are
+# not headers (most of them) are skipped by the regex engine; [ \t]
+# instead of \s keeps every match within one line
+BLOCK_REGEX = re.compile(HEADER_REGEX.pattern.replace(r"\s", r"[ \t]"),
+        re.MULTILINE)
+BLOCK_SIZE = 1 << 22
+STORE_SUFFIX = ".npy"
+# last line of the alignment files of failed runs, before failed runs
+# stopped leaving an alignment file
+FAILED_RUN_MARKER = "rmblast exception:"
+SEQS_SUFFIX = ".seqs"
+
+class HitStore:
+    """
+    Columnar store of the hits of one alignment file.
+
+    Fields:
+        sc_file - alignment file the hits were parsed from.
+        hits - NumPy structured array of HIT_DTYPE, one record per
+            hit, in the order of the alignment file.
+        seqs - names of the sequences the batches come from, indexed
+            by hits["seq"].
+    """
+    def __init__(self, sc_file, hits, seqs):
+        self.sc_file = sc_file
+        self.hits = hits
+        self.seqs = seqs
+
+    def __len__(self):
+        return len(self.hits)
+
+    def scores(self):
+        """
+        scores(self) - Scores of the hits as an int64 array, in the
+        order of the alignment file.
+        """
+        return self.hits["score"].astype(np.int64)
+
+    def histogram(self):
+        """
+        histogram(self) - ScoreHistogram of the scores of the hits.
+        """
+        return histogramFromScores(self.hits["score"])
+
+    def bedStarts(self):
+        """
+        bedStarts(self) - Zero-based genome start of each hit, as used
+        in BED files.
+        """
+        return self.hits["start"] - 1
+
+def headerMatches(f):
+    """
+    headerMatches(f) - Yields the match of every alignment header line
+    read from the given text stream, reading it in blocks of whole
+    lines.
+
+    Raises ValueError at the end of the output of a failed run, which
+    only holds the hits found before the aligner stopped.
+    """
+    rest = ""
+    while True:
+        block = f.read(BLOCK_SIZE)
+        if not block:
+            break
+        text = rest + block
+        cut = text.rfind("\n") + 1
+        yield from BLOCK_REGEX.finditer(text, 0, cut)
+        rest = text[cut:]
+    if rest.startswith(FAILED_RUN_MARKER):
+        raise ValueError("output of a failed run: " + rest.strip())
+    yield from BLOCK_REGEX.finditer(rest)
+
+def parseScFile(sc_file):
+    """
+    parseScFile(sc_file) - Parses every alignment header line of the
+    given alignment file (plain or compressed, see sc_io.py) into a
+    HitStore. Alignment text and any other lines are skipped.
+    """
+    seq_index = {}
+    seqs = []
+    rows = []
+    f = openSc(sc_file)
+    for mo in headerMatches(f):
+        seq = mo.group(5)
+        if seq not in seq_index:
+            seq_index[seq] = len(seqs)
+            seqs.append(seq)
+        batch_start = int(mo.group(6))
+        if mo.group(9):
+            strand = -1
+            cons_left = int(mo.group(10))
+            cons_end = int(mo.group(11))
+            cons_start = int(mo.group(12))
+        else:
+            strand = 1
+            cons_start = int(mo.group(10))
+            cons_end = int(mo.group(11))
+            cons_left = int(mo.group(12))
+        rows.append((int(mo.group(1)), float(mo.group(2)),
+                float(mo.group(3)), float(mo.group(4)), seq_index[seq],
+                batch_start, batch_start + int(mo.group(7)) - 1,
+                batch_start + int(mo.group(8)) - 1, strand, cons_start,
+                cons_end, cons_left))
+    f.close()
+    return HitStore(sc_file, np.array(rows, dtype=HIT_DTYPE), seqs)
+
+def storePaths(sc_file):
+    """
+    storePaths(sc_file) - Returns the paths of the structured array
+    and sequence names stored for the given alignment file.
+    """
+    return sc_file + STORE_SUFFIX, sc_file + SEQS_SUFFIX
+
+def sourceStamp(sc_file):
+    """
+    sourceStamp(sc_file) - First line of the sequence names file of the
+    store of the given alignment file: its size and mtime (in ns).
+    """
+    st = os.stat(sc_file)
+    return "#" + str(st.st_size) + "\t" + str(st.st_mtime_ns) + "\n"
+
+def writeStore(store, stamp):
+    """
+    writeStore(store, stamp) - Saves the given HitStore next to its
+    alignment file, stamped with the sourceStamp of the alignment file
+    taken before it was parsed. Files are written under temporary names
+    and moved into place, so a reader never sees a partial store.
+    """
+    npy_file, seqs_file = storePaths(store.sc_file)
+    # one temporary name per process, in case two build the same store
+    tmp = ".tmp" + str(os.getpid())
+    with open(npy_file + tmp, "wb") as f:
+        np.save(f, store.hits)
+    with open(seqs_file + tmp, "w") as f:
+        f.write(stamp)
+        for seq in store.seqs:
+            f.write(seq + "\n")
+    os.replace(seqs_file + tmp, seqs_file)
+    os.replace(npy_file + tmp, npy_file)
+
+def isCurrent(sc_file):
+    """
+    isCurrent(sc_file) - True if the store of the given alignment file
+    exists and was parsed from the alignment file as it is now (same
+    size and mtime). A store is only written once the whole file has
+    been parsed, so an alignment file replaced by the output of a
+    failed run, or stamps left by older versions, are parsed again
+    (see headerMatches).
+    """
+    npy_file, seqs_file = storePaths(sc_file)
+    if not (os.path.exists(npy_file) and os.path.exists(seqs_file)):
+        return False
+    with open(seqs_file, "r") as f:
+        return f.readline() == sourceStamp(sc_file)
+
+def loadHits(sc_file):
+    """
+    loadHits(sc_file) - Returns the HitStore of the given alignment
+    file. The alignment file is parsed and its store written the first
+    time; afterwards the store is memory-mapped, so the hits are only
+    read from disk as they are used.
+    """
+    if not isCurrent(sc_file):
+        stamp = sourceStamp(sc_file)
+        store = parseScFile(sc_file)
+        writeStore(store, stamp)
+        return store
+    npy_file, seqs_file = storePaths(sc_file)
+    with open(seqs_file, "r") as f:
+        seqs = f.read().splitlines()[1:]
+    hits = np.load(npy_file, mmap_mode="r")
+    return HitStore(sc_file, hits, seqs)
+
+def buildStores(dirs):
+    """
+    buildStores(dirs) - Builds (or refreshes) the store of every
+    alignment file (.sc, .sc.gz or .sc.zst) found under the given
+    directories.
+    """
+    for d in dirs:
+        for root, subdirs, files in os.walk(d):
+            for f in sorted(files):
+                if isScFile(f):
+                    store = loadHits(os.path.join(root, f))
+                    print(os.path.join(root, f) + "\t" + str(len(store)))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dirs", nargs="+",
+            help="directories containing alignment files")
+    args = parser.parse_args()
+
+    buildStores(args.dirs)
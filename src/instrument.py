@@ -0,0 +1,278 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+instrument.py - Per-stage timing and resource records for the
+pipeline, written as JSON lines.
+
+Stages are wrapped with the stage() context manager:
+
+    with stage("runRMBlast", family=name, matrix=matrix) as st:
+        ...
+        st.set(hits=len(hits))
+
+When the DFAM_METRICS environment variable names a file, every stage
+appends one JSON object to it with the stage name, its fields, wall
+and CPU time, and the user/sys time and max RSS of the child processes
+it ran. The file is opened in append mode and each record is written
+with a single write, so parallel jobs can share one log. When
+DFAM_METRICS is not set, stages cost next to nothing.
+
+You can run this script directly to summarize the records of a
+campaign:
+
+$ python3 instrument.py log [log ...] [--top N]
+
+AUTHOR(S):
+    Eric Yeh
+"""
+
+#
+# Module imports
+#
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import threading
+import time
+
+METRICS_ENV = "DFAM_METRICS"
+
+def setMetricsLog(path):
+    """
+    setMetricsLog(path) - Sends the records of this process, and of
+    every process it starts, to the given file.
+    """
+    os.environ[METRICS_ENV] = os.path.abspath(path)
+
+def writeRecord(record):
+    """
+    writeRecord(record) - Appends the given dict as one JSON line to
+    the metrics log, if there is one.
+    """
+    path = os.environ.get(METRICS_ENV)
+    if not path:
+        return
+    line = (json.dumps(record, sort_keys=True) + "\n").encode()
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+def fileSize(path):
+    """
+    fileSize(path) - Size of the given file in bytes, 0 if missing.
+    """
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+class stage:
+    """
+    Context manager timing one stage of the pipeline.
+
+    Fields:
+        name - name of the stage, e.g. "runRMBlast".
+        fields - dict of what the stage worked on (family, matrix,
+            genome kind, bin...) and what it produced (hits, bytes).
+    """
+    def __init__(self, name, **fields):
+        self.name = name
+        self.fields = fields
+        self.enabled = bool(os.environ.get(METRICS_ENV))
+        self.children = []
+
+    def set(self, **fields):
+        """
+        set(self, **fields) - Adds fields to the record of this stage.
+        """
+        self.fields.update(fields)
+
+    def addChild(self, rusage):
+        """
+        addChild(self, rusage) - Adds the resource usage of a child
+        process run during this stage (see runChild).
+        """
+        self.children.append(rusage)
+
+    def __enter__(self):
+        if self.enabled:
+            self.start = time.time()
+            self.wall = time.perf_counter()
+            self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.enabled:
+            return False
+        record = {"stage": self.name, "start": self.start,
+                "host": socket.gethostname(), "pid": os.getpid(),
+                "wall": time.perf_counter() - self.wall,
+                "cpu": time.process_time() - self.cpu}
+        if len(self.children) > 0:
+            record["child_user"] = sum([r.ru_utime for r in self.children])
+            record["child_sys"] = sum([r.ru_stime for r in self.children])
+            # ru_maxrss is in KB on Linux
+            record["child_maxrss_mb"] = max([r.ru_maxrss
+                                    for r in self.children]) / 1024.0
+        if exc_type != None:
+            record["error"] = exc_type.__name__
+        record.update(self.fields)
+        writeRecord(record)
+        return False
+
+def runChild(params, stdout=None, stderr=None, st=None, timeout=None):
+    """
+    runChild(params, stdout, stderr, st, timeout) - Runs the given
+    command like subprocess.check_call, collecting the resource usage
+    of that one child process with os.wait4 and adding it to the stage
+    st.
+
+    If stdout is a writer marked with a pipe attribute (e.g. a
+    compressing sc_io.ScWriter), the output of the command is read
+    from a pipe and written to it.
+
+    With a timeout, the command runs in its own process group, killed
+    (with every process it started) after that many seconds, and
+    subprocess.TimeoutExpired is raised if it was killed that way. A
+    command exiting as the timeout expires keeps its own exit status.
+    If copying the output fails, the command is killed and reaped
+    before the error is raised.
+
+    Returns: the exit status of the command (negative for a signal).
+    """
+    if getattr(stdout, "pipe", False):
+        proc = subprocess.Popen(params, stdout=subprocess.PIPE,
+                    stderr=stderr, start_new_session=timeout != None)
+    else:
+        proc = subprocess.Popen(params, stdout=stdout, stderr=stderr,
+                    start_new_session=timeout != None)
+    expired = []
+    exited = []
+    lock = threading.Lock()
+    timer = None
+    if timeout != None:
+        def kill():
+            with lock:
+                if len(exited) > 0:
+                    return
+                expired.append(True)
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except OSError:
+                    pass
+        timer = threading.Timer(timeout, kill)
+        timer.daemon = True
+        timer.start()
+    copied = False
+    try:
+        if proc.stdout != None:
+            stdout.copyFrom(proc.stdout)
+        copied = True
+    finally:
+        if not copied:
+            # the output could not be written: kill the command (and,
+            # with a timeout, every process it started) before reaping
+            try:
+                if timeout != None:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                else:
+                    os.kill(proc.pid, signal.SIGKILL)
+            except OSError:
+                pass
+        if proc.stdout != None:
+            proc.stdout.close()
+        if timer != None:
+            # wait for the command without reaping it, so the timer
+            # never signals a process group id that could have been
+            # reused
+            os.waitid(os.P_PID, proc.pid, os.WEXITED | os.WNOWAIT)
+            with lock:
+                exited.append(True)
+            timer.cancel()
+        pid, status, rusage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if st != None:
+        st.addChild(rusage)
+    if len(expired) > 0 and proc.returncode == -signal.SIGKILL:
+        raise subprocess.TimeoutExpired(params, timeout)
+    return proc.returncode
+
+def readRecords(paths):
+    """
+    readRecords(paths) - Reads the records of the given metrics logs,
+    skipping lines cut short by a killed job.
+    """
+    records = []
+    for path in paths:
+        with open(path, "r") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    pass
+    return records
+
+def summarize(records, top=10):
+    """
+    summarize(records, top) - Aggregates the records of a campaign.
+
+    Returns: dict with, for each stage, the number of records and the
+        total wall/CPU time; the slowest families by total runRMBlast
+        wall time; and the slowest (bin, genome kind) pairs by mean
+        runRMBlast wall time.
+    """
+    stages = {}
+    families = {}
+    bins = {}
+    for r in records:
+        s = stages.setdefault(r["stage"], {"count": 0, "wall": 0.0,
+                                "cpu": 0.0, "child_cpu": 0.0, "errors": 0})
+        s["count"] += 1
+        s["wall"] += r.get("wall", 0.0)
+        s["cpu"] += r.get("cpu", 0.0)
+        s["child_cpu"] += r.get("child_user", 0.0) + r.get("child_sys", 0.0)
+        if "error" in r:
+            s["errors"] += 1
+        if r["stage"] != "runRMBlast":
+            continue
+        family = r.get("family")
+        families[family] = families.get(family, 0.0) + r["wall"]
+        key = (r.get("bin"), r.get("kind"))
+        b = bins.setdefault(key, {"count": 0, "wall": 0.0, "maxrss_mb": 0.0})
+        b["count"] += 1
+        b["wall"] += r["wall"]
+        b["maxrss_mb"] = max(b["maxrss_mb"], r.get("child_maxrss_mb", 0.0))
+    slow_families = sorted(families.items(), key=lambda x: -x[1])[:top]
+    slow_bins = sorted(bins.items(),
+                key=lambda x: -x[1]["wall"] / x[1]["count"])[:top]
+    return {"stages": stages, "families": slow_families, "bins": slow_bins}
+
+def printSummary(summary):
+    print("stage\tcount\twall\tcpu\tchild_cpu\terrors")
+    for name, s in sorted(summary["stages"].items()):
+        print(name + "\t" + str(s["count"]) + "\t" + ("%.1f" % s["wall"]) +
+            "\t" + ("%.1f" % s["cpu"]) + "\t" + ("%.1f" % s["child_cpu"]) +
+            "\t" + str(s["errors"]))
+    print("\nslowest families (runRMBlast wall)")
+    for family, wall in summary["families"]:
+        print(str(family) + "\t" + ("%.1f" % wall))
+    print("\nslowest bins\tkind\tmean runRMBlast wall\truns\tmax_rss_mb")
+    for (b_name, kind), b in summary["bins"]:
+        print(str(b_name) + "\t" + str(kind) + "\t" +
+            ("%.1f" % (b["wall"] / b["count"])) + "\t" + str(b["count"]) +
+            "\t" + ("%.1f" % b["maxrss_mb"]))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("logs", nargs="+",
+            help="metrics logs written through DFAM_METRICS")
+    parser.add_argument("--top", type=int, default=10,
+            help="number of families and bins to list")
+    args = parser.parse_args()
+
+    printSummary(summarize(readRecords(args.logs), args.top))
@@ -2,9 +2,15 @@
 # -*- coding: utf-8 -*-
 """
 jobs_batch.py - For each of the given fa files in args, generate
-alignments against hg38 and compute a score threshold per GC tuned
-matrix. For one instance of this program, all the consensus sequences
-will be run sequentially.
+alignments against one or more registered genomes (hg38 by default,
+see genome_registry.py) and compute a score threshold per GC tuned
+matrix. The (genome, family) pairs run one after the other, or up to
+N at a time with -p N (see campaign.py).
+
+The consensus sequences are either the fa files of a directory, or
+the families of a consensus library read through its index (see
+consensus_store.py), optionally only those of one shard assigned by
+dfam_pipeline.py.
 
 AUTHOR(S):
     Eric Yeh
@@ -14,37 +20,89 @@ AUTHOR(S):
 # Module imports
 #
 import argparse
-import os
+import sys
 
-from sequence_util import consensusSize, genomeSize
-from generate_alignments import generateAlignments, splitConsensus
-from score_thresholds import scoreThresholds
+from campaign import runCampaign, GENOME_TABLE, STAGING_DIR
+from genome_registry import GENOME_REGISTRY, DEFAULT_GENOME
+from instrument import setMetricsLog
+from aligners import ALIGNERS, fromArgs
+from sc_io import setCompression, SC_SUFFIXES
+from progress import setProgressDir
+from failures import setRetryPolicy
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("dirname",
             help="dir with consensus sequence fa files whose score " +
-                "thresholds will be computed.")
+                "thresholds will be computed, or a consensus library.")
+    parser.add_argument("--shard", type=int, default=None,
+            help="with a consensus library, only run the families of " +
+                "this shard (see dfam_pipeline.py)")
+    parser.add_argument("--genomes", nargs="+", default=[DEFAULT_GENOME],
+            help="registered genomes to run the families against")
+    parser.add_argument("--registry", default=GENOME_REGISTRY,
+            help="path of the genome registry")
+    parser.add_argument("-p", "--processes", type=int, default=1,
+            help="number of (genome, family) pairs run at once")
+    parser.add_argument("--output", default=GENOME_TABLE,
+            help="table the thresholds of every genome are gathered into")
+    parser.add_argument("--metrics", default=None,
+            help="append per-stage timing records (JSON lines) to " +
+                "this file")
+    parser.add_argument("--aligner", default="rmblast",
+            choices=sorted(ALIGNERS),
+            help="aligner backend, see aligners.py")
+    parser.add_argument("--rbn", default=None,
+            help="path of the rbn script run by the rmblast aligner " +
+                "(default: $DFAM_RBN, or rbn on the PATH)")
+    parser.add_argument("--prefilter", type=int, default=None,
+            metavar="MIN_SHARED",
+            help="only align against the genome batches sharing at " +
+                "least MIN_SHARED indexed k-mers with the consensus " +
+                "(needs the k-mer indexes of the bins, see " +
+                "kmer_index.py); benchmark bins are searched in full")
+    parser.add_argument("--compression", default=None,
+            choices=sorted(SC_SUFFIXES),
+            help="compression of the alignment files (default: " +
+                "$DFAM_SC_COMPRESSION, or zstd if installed, else gzip)")
+    parser.add_argument("--score_only", action="store_true",
+            help="only write the header line of each hit, without the " +
+                "alignment text, which is all the thresholds need")
+    parser.add_argument("--adaptive_minscore", type=int, default=None,
+            metavar="MARGIN",
+            help="only report the hits scoring at most MARGIN under " +
+                "the lowest theoretical threshold of each matrix (see " +
+                "score_thresholds.adaptiveMinScore)")
+    parser.add_argument("--progress", default=None, metavar="DIR",
+            help="keep the progress state of every worker in DIR, " +
+                "shared by every job of the campaign (see progress.py)")
+    parser.add_argument("--retries", type=int, default=None,
+            help="retries of a failed alignment (default: " +
+                "$DFAM_RETRIES, or 2), see failures.py")
+    parser.add_argument("--timeout", type=float, default=None,
+            help="seconds before an aligner process is killed " +
+                "(default: $DFAM_ALIGN_TIMEOUT, or no timeout)")
+    parser.add_argument("--backoff", type=float, default=None,
+            help="seconds before the first retry, doubled at each " +
+                "retry (default: $DFAM_RETRY_BACKOFF, or 30)")
+    parser.add_argument("--requeue", action="store_true",
+            help="only redo the alignments that failed for good (see " +
+                "failures.py), then the thresholds of their families")
     args = parser.parse_args()
 
-    n = 3209286105 # size of hg38
-
-    for fpath in [os.path.join(args.dirname, f)
-                for f in os.listdir(args.dirname)]:
-        name = fpath.split("/")[-1][:-3]
-        m = consensusSize(fpath)
-
-        print("Generating genomic alignments for " + name)
-        generateAlignments(fpath,
-            "../data/hg38bins/dfamseq_bins", "../results/genomic_hits/")
-        print("Generating benchmark alignments for " + name)
-        generateAlignments(fpath,
-            "../data/hg38bins/benchmark_bins", "../results/benchmark_hits/")
+    if args.metrics != None:
+        setMetricsLog(args.metrics)
+    if args.compression != None:
+        setCompression(args.compression)
+    if args.progress != None:
+        setProgressDir(args.progress)
+    setRetryPolicy(args.retries, args.timeout, args.backoff)
 
-        print("Calculating score thresholds for " + name)
-        scoreThresholds(os.path.join("../results/genomic_hits/", name),
-                        os.path.join("../results/benchmark_hits/", name),
-                        query_size=m, subject_size=n)
+    failed = runCampaign(args.dirname, args.genomes, args.registry,
+                fromArgs(args), args.processes, args.shard, args.output,
+                STAGING_DIR, args.prefilter, args.adaptive_minscore,
+                args.requeue)
+    sys.exit(1 if failed else 0)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,377 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+kmer_index.py - k-mer prefilter over the batches of GC bins, so a
+family is only aligned against the batches it shares seed words with.
+
+For every bin file, the index holds the minimizers of each batch: the
+canonical k-mers (the smaller of a k-mer and its reverse complement,
+2 bits per base) picked as the smallest, by a hash, of every W
+consecutive k-mers. The (k-mer, batch) pairs are stored sorted by
+k-mer, next to the bin:
+
+    [bin].kmers.npy - k-mer codes, sorted (uint32)
+    [bin].kbatch.npy - batch of each code (uint32)
+    [bin].batches - "#k=K w=W" then one line per batch:
+        name\toffset\tlength
+        with offset and length the bytes of its record in the bin
+
+To prefilter a family, every canonical k-mer of its consensus is
+looked up in the sorted codes, and the batches holding at least
+min_shared of them are copied into a reduced subject file, which is
+aligned instead of the whole bin. The indexes are built by
+bin_genome.py --kmer_index, or for existing bins with:
+
+$ python3 kmer_index.py build bins_dir [--k K] [--w W]
+
+Since the prefilter can only lose hits, validate it on a few families
+before relying on it; the full search and the prefiltered one are
+compared and the hits above threshold missing from the latter listed:
+
+$ python3 kmer_index.py validate consensus_fa bins_dir
+        [--thresholds FILE | --min_score S] [--min_shared N]
+
+AUTHOR(S):
+    Eric Yeh
+"""
+
+#
+# Module imports
+#
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+from contextlib import contextmanager
+from functools import lru_cache
+
+import numpy as np
+
+from sequence_util import BIN_FILE_REGEX
+from score_thresholds import readThresholds
+
+K = 12
+W = 5
+MIN_SHARED = 2
+KMERS_SUFFIX = ".kmers.npy"
+KBATCH_SUFFIX = ".kbatch.npy"
+BATCHES_SUFFIX = ".batches"
+HASH_MULTIPLIER = np.uint64(0x9E3779B1)
+HASH_MASK = np.uint64(0xFFFFFFFF)
+INVALID = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for i, base in enumerate("ACGT"):
+    BASE_CODES[ord(base)] = i
+    BASE_CODES[ord(base.lower())] = i
+
+def canonicalKmers(seq, k=K):
+    """
+    canonicalKmers(seq, k) - Code of the canonical k-mer starting at
+    every position of seq, INVALID for k-mers with a base other than
+    ACGT.
+
+    Returns: uint64 NumPy array of len(seq) - k + 1 codes.
+    """
+    enc = BASE_CODES[np.frombuffer(seq.encode(), dtype=np.uint8)]
+    n = len(enc) - k + 1
+    if n <= 0:
+        return np.zeros(0, dtype=np.uint64)
+    fwd = np.zeros(n, dtype=np.uint64)
+    rev = np.zeros(n, dtype=np.uint64)
+    bad = np.zeros(n, dtype=bool)
+    for j in range(k):
+        window = enc[j:j + n]
+        bad |= window > 3
+        bases = window.astype(np.uint64) & np.uint64(3)
+        fwd = (fwd << np.uint64(2)) | bases
+        rev |= (np.uint64(3) - bases) << np.uint64(2 * j)
+    codes = np.minimum(fwd, rev)
+    codes[bad] = INVALID
+    return codes
+
+def minimizers(seq, k=K, w=W):
+    """
+    minimizers(seq, k, w) - Distinct canonical k-mers of seq picked as
+    the smallest, by hash, of every w consecutive k-mers.
+
+    Returns: sorted uint32 NumPy array of k-mer codes.
+    """
+    codes = canonicalKmers(seq, k)
+    if len(codes) == 0:
+        return np.zeros(0, dtype=np.uint32)
+    hashed = np.where(codes == INVALID, INVALID,
+                (codes * HASH_MULTIPLIER) & HASH_MASK)
+    if len(codes) >= w:
+        windows = np.lib.stride_tricks.sliding_window_view(hashed, w)
+        picked = np.argmin(windows, axis=1) + np.arange(len(windows))
+    else:
+        picked = np.array([np.argmin(hashed)])
+    picked = codes[picked]
+    return np.unique(picked[picked != INVALID]).astype(np.uint32)
+
+def indexPaths(bin_file):
+    return (bin_file + KMERS_SUFFIX, bin_file + KBATCH_SUFFIX,
+            bin_file + BATCHES_SUFFIX)
+
+def readRecords(bin_file):
+    """
+    readRecords(bin_file) - Yields the (name, offset, length, sequence)
+    of every batch record of the given bin file, offset and length
+    being the bytes of the record, header line included.
+    """
+    f = open(bin_file, "rb")
+    current = None
+    offset = 0
+    for line in f:
+        if line[:1] == b">":
+            if current != None:
+                yield (current[0], current[1], offset - current[1],
+                        b"".join(current[2]).decode())
+            current = (line[1:].decode().split()[0], offset, [])
+        elif current != None:
+            current[2].append(line.strip())
+        offset += len(line)
+    f.close()
+    if current != None:
+        yield (current[0], current[1], offset - current[1],
+                b"".join(current[2]).decode())
+
+def buildIndex(bin_file, k=K, w=W):
+    """
+    buildIndex(bin_file, k, w) - Builds the k-mer index of the given
+    bin file (files written under temporary names first, then moved
+    into place).
+
+    Returns: number of (k-mer, batch) pairs indexed.
+    """
+    codes = []
+    batch_ids = []
+    entries = []
+    for name, offset, length, seq in readRecords(bin_file):
+        batch_codes = minimizers(seq, k, w)
+        codes.append(batch_codes)
+        batch_ids.append(np.full(len(batch_codes), len(entries),
+                            dtype=np.uint32))
+        entries.append((name, offset, length))
+    codes = np.concatenate(codes) if codes else np.zeros(0, dtype=np.uint32)
+    batch_ids = (np.concatenate(batch_ids) if batch_ids
+                else np.zeros(0, dtype=np.uint32))
+    order = np.argsort(codes, kind="stable")
+
+    kmers_file, kbatch_file, batches_file = indexPaths(bin_file)
+    tmp = ".tmp" + str(os.getpid())
+    with open(kmers_file + tmp, "wb") as f:
+        np.save(f, codes[order])
+    with open(kbatch_file + tmp, "wb") as f:
+        np.save(f, batch_ids[order])
+    with open(batches_file + tmp, "w") as f:
+        f.write("#k=" + str(k) + " w=" + str(w) + "\n")
+        for name, offset, length in entries:
+            f.write(name + "\t" + str(offset) + "\t" + str(length) + "\n")
+    os.replace(kmers_file + tmp, kmers_file)
+    os.replace(kbatch_file + tmp, kbatch_file)
+    # written last, so an index with a batches file is complete
+    os.replace(batches_file + tmp, batches_file)
+    return len(codes)
+
+def buildIndexes(bins_dir, k=K, w=W):
+    """
+    buildIndexes(bins_dir, k, w) - Builds the k-mer index of every bin
+    file in bins_dir.
+    """
+    for b in sorted(os.listdir(bins_dir)):
+        if BIN_FILE_REGEX.match(b):
+            pairs = buildIndex(os.path.join(bins_dir, b), k, w)
+            print("indexed " + b + ": " + str(pairs) + " k-mers")
+
+def isCurrent(bin_file):
+    """
+    isCurrent(bin_file) - True if the k-mer index of the given bin file
+    exists and is newer than the bin.
+    """
+    batches_file = indexPaths(bin_file)[2]
+    return (os.path.exists(batches_file) and
+            os.path.getmtime(batches_file) >= os.path.getmtime(bin_file))
+
+@lru_cache(maxsize=None)
+def loadIndex(bin_file):
+    """
+    loadIndex(bin_file) - (codes, batch ids, batch entries, k) of the
+    k-mer index of the given bin file, loaded once per process with
+    the arrays memory-mapped.
+    """
+    kmers_file, kbatch_file, batches_file = indexPaths(bin_file)
+    entries = []
+    with open(batches_file, "r") as f:
+        params = dict([p.split("=") for p in f.readline()[1:].split()])
+        for line in f:
+            name, offset, length = line.split("\t")
+            entries.append((name, int(offset), int(length)))
+    return (np.load(kmers_file, mmap_mode="r"),
+            np.load(kbatch_file, mmap_mode="r"), entries, int(params["k"]))
+
+class KmerPrefilter:
+    """
+    Selects the batches of a bin a consensus shares enough k-mers with.
+
+    Fields:
+        min_shared - number of distinct indexed k-mers a batch must
+            share with the consensus to be aligned against.
+    """
+    def __init__(self, min_shared=MIN_SHARED):
+        self.min_shared = min_shared
+
+    def select(self, bin_file, seq):
+        """
+        select(self, bin_file, seq) - Indexes of the batches of the
+        given bin selected for the consensus sequence seq, or None if
+        the bin has no current index.
+        """
+        if not isCurrent(bin_file):
+            return None
+        codes, batch_ids, entries, k = loadIndex(bin_file)
+        query = canonicalKmers(seq, k)
+        query = np.unique(query[query != INVALID]).astype(np.uint32)
+        left = np.searchsorted(codes, query, side="left")
+        right = np.searchsorted(codes, query, side="right")
+        sizes = right - left
+        if sizes.sum() == 0:
+            return np.zeros(0, dtype=np.int64)
+        # every position of every matching range of codes
+        starts = np.repeat(left - np.cumsum(sizes) + sizes, sizes)
+        positions = starts + np.arange(sizes.sum())
+        shared = np.bincount(batch_ids[positions], minlength=len(entries))
+        return np.nonzero(shared >= self.min_shared)[0]
+
+    @contextmanager
+    def subject(self, bin_file, seq):
+        """
+        subject(self, bin_file, seq) - Yields (path, selected, total):
+        the subject file to align the consensus sequence seq against
+        instead of bin_file, and the number of batches selected out of
+        the bin's. The subject is a temporary file with the selected
+        batches (removed afterwards), the bin itself if it has no
+        current index, or None if no batch was selected.
+        """
+        selected = self.select(bin_file, seq)
+        if selected is None:
+            yield bin_file, None, None
+            return
+        entries = loadIndex(bin_file)[2]
+        if len(selected) == 0:
+            yield None, 0, len(entries)
+            return
+        fd, path = tempfile.mkstemp(prefix=os.path.basename(bin_file) + ".",
+                        suffix=".fa")
+        try:
+            with open(bin_file, "rb") as f, os.fdopen(fd, "wb") as g:
+                for i in selected:
+                    name, offset, length = entries[i]
+                    f.seek(offset)
+                    g.write(f.read(length))
+            yield path, len(selected), len(entries)
+        finally:
+            os.remove(path)
+
+def validatePrefilter(consensus, bins_dir, aligner, prefilter,
+        thresholds=None, min_score=0):
+    """
+    validatePrefilter(consensus, bins_dir, aligner, prefilter,
+    thresholds, min_score) - Aligns the given ConsensusSequence against
+    every bin of bins_dir both in full and through the prefilter, and
+    compares the hits at or above threshold.
+
+    Args:
+        thresholds - dict of the threshold of each matrix; matrices not
+            in it use min_score.
+
+    Returns: list of (matrix, hits above threshold in the full search,
+        list of those missing from the prefiltered search).
+    """
+    # imported here, generate_alignments uses this module
+    from generate_alignments import generateAlignments
+    from hit_store import parseScFile
+    from score_thresholds import matrixName
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        full_dir = os.path.join(tmp_dir, "full", "genomic_hits")
+        filtered_dir = os.path.join(tmp_dir, "prefiltered", "genomic_hits")
+        os.makedirs(full_dir)
+        os.makedirs(filtered_dir)
+        generateAlignments(consensus, bins_dir, full_dir, aligner)
+        generateAlignments(consensus, bins_dir, filtered_dir, aligner,
+                        prefilter)
+        report = []
+        family_dir = os.path.join(full_dir, consensus.name)
+        for f in sorted(os.listdir(family_dir)):
+            matrix = matrixName(f)
+            if matrix == None:
+                continue
+            threshold = min_score
+            if thresholds != None and matrix in thresholds:
+                threshold = thresholds[matrix]
+            found = []
+            for d in [full_dir, filtered_dir]:
+                store = parseScFile(os.path.join(d, consensus.name, f))
+                h = store.hits[store.hits["score"] >= threshold]
+                found.append(set(zip([store.seqs[s] for s in h["seq"]],
+                        h["start"].tolist(), h["end"].tolist(),
+                        h["strand"].tolist(), h["score"].tolist())))
+            report.append((matrix, len(found[0]),
+                        sorted(found[0] - found[1])))
+        return report
+    finally:
+        shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build",
+            help="build the k-mer index of every bin of a directory")
+    build_parser.add_argument("bins_dir", help="directory of GC bins")
+    build_parser.add_argument("--k", type=int, default=K,
+            help="k-mer length (at most 16)")
+    build_parser.add_argument("--w", type=int, default=W,
+            help="number of consecutive k-mers each minimizer is " +
+                "picked from")
+    validate_parser = subparsers.add_parser("validate",
+            help="check the prefilter loses no hits above threshold")
+    validate_parser.add_argument("consensus_fa",
+            help="fa file of a single consensus sequence")
+    validate_parser.add_argument("bins_dir", help="directory of GC bins")
+    validate_parser.add_argument("--min_shared", type=int,
+            default=MIN_SHARED,
+            help="k-mers a batch must share with the consensus")
+    validate_parser.add_argument("--thresholds", default=None,
+            help="thresholds table giving the threshold of each matrix")
+    validate_parser.add_argument("--min_score", type=float, default=0,
+            help="threshold of the matrices not in --thresholds")
+    validate_parser.add_argument("--aligner", default="rmblast",
+            help="aligner backend, see aligners.py")
+    validate_parser.add_argument("--rbn", default=None,
+            help="path of the rbn script run by the rmblast aligner")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        buildIndexes(args.bins_dir, args.k, args.w)
+    else:
+        from generate_alignments import ConsensusSequence
+        from aligners import fromArgs
+        aligner = fromArgs(args)
+        cs = ConsensusSequence(args.consensus_fa)
+        thresholds = None
+        if args.thresholds != None:
+            thresholds = readThresholds(args.thresholds, cs.name)
+        lost = 0
+        for matrix, hits, missing in validatePrefilter(cs, args.bins_dir,
+                aligner, KmerPrefilter(args.min_shared), thresholds,
+                args.min_score):
+            print(cs.name + "\t" + matrix + "\t" + str(hits) + " hits\t" +
+                    str(len(missing)) + " lost")
+            for hit in missing:
+                print("\t".join([str(x) for x in hit]))
+            lost += len(missing)
+        sys.exit(1 if lost else 0)
@@ -0,0 +1,651 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+pipeline_dag.py - Runs the pipeline as a graph of tasks with declared
+inputs and outputs, redoing only what is out of date.
+
+The stages chained by hand in run_job.py, jobs_batch.py and
+cache_hits.py become tasks:
+
+    bin:[kind]                        genome fa -> GC bins
+    split                             consensus fa -> one fa per family
+    align:[family]:[kind]:[bin]       family fa, bin -> .sc file
+    thresholds:[family]               .sc files -> [family].thresh
+    cache:[family]                    .sc files -> [family].json
+    table                             .thresh files -> thresholds.txt
+
+A task depends on the tasks producing its inputs. It is skipped when
+all of its outputs exist and either they are newer than all of its
+inputs, or its inputs and outputs still have the checksums recorded
+the last time it ran (so copying or touching files does not redo any
+work). Changing the parameters of a task (e.g. the aligner) reruns it.
+The checksums are kept in a JSON state file in the results directory.
+The bins and results directory default to those of a registered genome
+(hg38 unless --genome_name is given, see genome_registry.py).
+
+Independent tasks run in parallel, each in its own process, as long
+as the CPUs and memory they declare fit within the given budget. When
+a task fails, the files it was writing are removed and the tasks
+depending on it are not run; everything else carries on.
+
+$ python3 pipeline_dag.py consensus_fa [--genome FA] [--benchmark FA]
+        [--genome_name NAME] [--registry FILE]
+        [--genome_bins DIR] [--benchmark_bins DIR] [--results DIR]
+        [--aligner NAME] [--cpus N] [--mem GB] [--force] [--dry_run]
+        [--progress DIR]
+
+AUTHOR(S):
+    Eric Yeh
+"""
+
+#
+# Module imports
+#
+import argparse
+import collections
+import hashlib
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import re
+import shutil
+import sys
+
+from sequence_util import (nearestDivergence, consensusSize, binSizes,
+        BIN_FILE_REGEX, BIN_SIZES_FILE)
+from bin_genome import binGenome
+from generate_alignments import (ConsensusSequence, splitConsensus,
+        runRMBlast)
+from score_thresholds import familyThresholds
+from cache_hits import writeJson
+from aligners import ALIGNERS, fromArgs
+from sc_io import scPath, plainName
+from instrument import fileSize
+from genome_registry import getGenome, GENOME_REGISTRY, DEFAULT_GENOME
+import progress
+from failures import setRetryPolicy
+
+STATE_FILE = ".dag_state.json"
+# bin files and the files derived from them (k-mer indexes)
+BIN_PREFIX_REGEX = re.compile(r"^bin\d+\.fa")
+ALIGN_MEM_GB = 2.0
+
+class Task:
+    """
+    One step of the pipeline.
+
+    Fields:
+        name - unique name of the task.
+        action - module level function run by the task.
+        args - tuple of arguments given to action.
+        inputs - paths of the files read by the task.
+        outputs - paths of the files written by the task.
+        cpus - number of CPUs the task keeps busy.
+        mem - memory used by the task, in GB.
+        params - string identifying the parameters of the task; when
+            it changes, the task is rerun.
+    """
+    def __init__(self, name, action, args=(), inputs=(), outputs=(),
+            cpus=1, mem=0.0, params=""):
+        self.name = name
+        self.action = action
+        self.args = args
+        self.inputs = [os.path.normpath(p) for p in inputs]
+        self.outputs = [os.path.normpath(p) for p in outputs]
+        self.cpus = cpus
+        self.mem = mem
+        self.params = params
+
+def fileDigest(path):
+    """
+    fileDigest(path) - md5 checksum of the given file.
+    """
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+class Pipeline:
+    """
+    Graph of tasks and the state of their last runs.
+
+    Fields:
+        tasks - dict of the tasks by name, in the order they were added.
+        producers - dict mapping each output path to the task writing it.
+        state_file - JSON file recording, for each task that ran, its
+            params and the checksums of its inputs and outputs, and
+            for each file checksummed, its mtime, size and checksum.
+        report - optional function called with each task and its
+            status as it starts (running) and ends (ran, skipped,
+            failed or blocked), in this process.
+    """
+    def __init__(self, state_file, report=None):
+        self.report = report
+        self.tasks = {}
+        self.producers = {}
+        self.state_file = state_file
+        self.state = {"tasks": {}, "files": {}}
+        if os.path.exists(state_file):
+            with open(state_file, "r") as f:
+                self.state = json.load(f)
+
+    def add(self, task):
+        """
+        add(self, task) - Adds a task to the graph. The tasks producing
+        its inputs must have been added before it.
+        """
+        if task.name in self.tasks:
+            raise ValueError("duplicate task " + task.name)
+        for path in task.outputs:
+            if path in self.producers:
+                raise ValueError(path + " is written by both " +
+                        self.producers[path].name + " and " + task.name)
+            self.producers[path] = task
+        self.tasks[task.name] = task
+        return task
+
+    def deps(self, task):
+        """
+        deps(self, task) - Names of the tasks producing the inputs of
+        the given task.
+        """
+        return set([self.producers[p].name for p in task.inputs
+                if p in self.producers])
+
+    def digest(self, path):
+        """
+        digest(self, path) - Checksum of the given file, reusing the one
+        recorded in the state while its mtime and size are unchanged.
+        """
+        st = os.stat(path)
+        known = self.state["files"].get(path)
+        if known != None and known[0] == st.st_mtime and known[1] == st.st_size:
+            return known[2]
+        value = fileDigest(path)
+        self.state["files"][path] = [st.st_mtime, st.st_size, value]
+        return value
+
+    def upToDate(self, task):
+        """
+        upToDate(self, task) - True if the given task can be skipped,
+        see the module docstring.
+        """
+        if not all([os.path.exists(p) for p in task.outputs]):
+            return False
+        if any([not os.path.exists(p) for p in task.inputs]):
+            return False
+        record = self.state["tasks"].get(task.name)
+        if record != None and record["params"] != task.params:
+            return False
+        if len(task.outputs) == 0:
+            return record != None
+        newest_input = max([os.path.getmtime(p) for p in task.inputs] + [0])
+        oldest_output = min([os.path.getmtime(p) for p in task.outputs])
+        if newest_input <= oldest_output:
+            return True
+        if record == None:
+            return False
+        return (record["inputs"] == self.checksums(task.inputs) and
+                record["outputs"] == self.checksums(task.outputs))
+
+    def checksums(self, paths):
+        return dict([(p, self.digest(p)) for p in paths])
+
+    def record(self, task):
+        """
+        record(self, task) - Records a successful run of the given task.
+        """
+        self.state["tasks"][task.name] = {"params": task.params,
+                "inputs": self.checksums(task.inputs),
+                "outputs": self.checksums(task.outputs)}
+
+    def saveState(self):
+        """
+        saveState(self) - Writes the state file, under a temporary name
+        first so it is never left half written.
+        """
+        with open(self.state_file + ".tmp", "w") as f:
+            json.dump(self.state, f)
+        os.replace(self.state_file + ".tmp", self.state_file)
+
+    def run(self, cpus=None, mem=None, force=False, dry_run=False):
+        """
+        run(self, cpus, mem, force, dry_run) - Runs the tasks that are
+        out of date, in dependency order, in parallel within the given
+        budget.
+
+        Args:
+            cpus - number of CPUs available (default: all of them). A
+                task declaring more than cpus still runs, alone.
+            mem - memory available in GB (default: unlimited).
+            force - rerun every task.
+            dry_run - only print the tasks that would run.
+
+        Returns: dict with the names of the tasks that ran, were
+            skipped, failed, or were not run because a task they depend
+            on failed.
+        """
+        if cpus == None:
+            cpus = os.cpu_count()
+        status = {}
+        result = {"ran": [], "skipped": [], "failed": [], "blocked": []}
+        deps = dict([(name, self.deps(t)) for name, t in self.tasks.items()])
+        # tasks become ready once every task they depend on is done
+        dependents = dict([(name, []) for name in self.tasks])
+        pending = {}
+        for name in self.tasks:
+            pending[name] = len(deps[name])
+            for d in deps[name]:
+                dependents[d].append(name)
+        ready = collections.deque([name for name in self.tasks
+                                if pending[name] == 0])
+
+        def done(task, outcome):
+            status[task.name] = outcome
+            result[outcome].append(task.name)
+            self.reportTask(task, outcome)
+            for name in dependents[task.name]:
+                pending[name] -= 1
+                if pending[name] == 0:
+                    ready.append(name)
+
+        running = {}
+        used_cpus = 0
+        used_mem = 0.0
+        while len(ready) > 0 or len(running) > 0:
+            while len(ready) > 0:
+                task = self.tasks[ready[0]]
+                if any([status[d] in ("failed", "blocked")
+                        for d in deps[task.name]]):
+                    ready.popleft()
+                    done(task, "blocked")
+                    continue
+                stale = any([status[d] == "ran" for d in deps[task.name]])
+                if not force and not (dry_run and stale) and self.upToDate(task):
+                    ready.popleft()
+                    done(task, "skipped")
+                    continue
+                if dry_run:
+                    print(task.name)
+                    ready.popleft()
+                    done(task, "ran")
+                    continue
+                fits = (used_cpus + task.cpus <= cpus and
+                        (mem == None or used_mem + task.mem <= mem))
+                if len(running) > 0 and not fits:
+                    break
+                ready.popleft()
+                print("Running " + task.name)
+                proc = multiprocessing.Process(target=__runTask__,
+                        args=(task.action, task.args), name=task.name)
+                before = outputStats(task)
+                proc.start()
+                self.reportTask(task, "running")
+                running[proc.sentinel] = (task, proc, before)
+                used_cpus += task.cpus
+                used_mem += task.mem
+            if len(running) == 0:
+                continue
+            for sentinel in multiprocessing.connection.wait(list(running)):
+                task, proc, before = running.pop(sentinel)
+                proc.join()
+                used_cpus -= task.cpus
+                used_mem -= task.mem
+                if proc.exitcode == 0 and all([os.path.exists(p)
+                        for p in task.outputs]):
+                    self.record(task)
+                    done(task, "ran")
+                else:
+                    print(task.name + " failed with exit status " +
+                        str(proc.exitcode))
+                    self.state["tasks"].pop(task.name, None)
+                    removePartial(task, before)
+                    done(task, "failed")
+                self.saveState()
+        return result
+
+    def reportTask(self, task, status):
+        if self.report != None:
+            self.report(task, status)
+
+def outputStats(task):
+    """
+    outputStats(task) - dict mapping each output file of the given task
+    to its (mtime in ns, size), or None if it does not exist.
+    """
+    stats = {}
+    for path in task.outputs:
+        stats[path] = None
+        if os.path.isfile(path):
+            st = os.stat(path)
+            stats[path] = (st.st_mtime_ns, st.st_size)
+    return stats
+
+def removePartial(task, before):
+    """
+    removePartial(task, before) - Removes the output files a failed task
+    wrote since it started (those whose outputStats changed from
+    before), so it is not taken as up to date. Comparing the stats
+    rather than the mtime with the start time does not depend on the
+    granularity of file timestamps.
+    """
+    after = outputStats(task)
+    for path in task.outputs:
+        if after[path] != None and after[path] != before[path]:
+            os.remove(path)
+
+def __runTask__(action, args):
+    """
+    Entry point of the process running one task.
+    """
+    action(*args)
+
+def __binTask__(fa_file, output_dir, bins_list):
+    # binGenome appends to the bin files, so the genome is binned into
+    # an empty directory, and the bins only replace the old ones (and
+    # their sizes and k-mer indexes) once it has succeeded
+    os.makedirs(output_dir, exist_ok=True)
+    tmp_dir = output_dir.rstrip(os.sep) + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    try:
+        binGenome(fa_file, tmp_dir)
+        for f in os.listdir(output_dir):
+            if f == BIN_SIZES_FILE or BIN_PREFIX_REGEX.match(f):
+                os.remove(os.path.join(output_dir, f))
+        bins = binFiles(tmp_dir)
+        for b in bins:
+            os.replace(os.path.join(tmp_dir, b), os.path.join(output_dir, b))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    with open(bins_list + ".tmp", "w") as f:
+        for b in bins:
+            f.write(b + "\n")
+    os.replace(bins_list + ".tmp", bins_list)
+
+def __splitTask__(consensus_fa):
+    splitConsensus(consensus_fa)
+
+def __alignTask__(fa_file, bin_file, output_dir, aligner, sc_file):
+    # the progress of alignment tasks is reported by the process
+    # running the pipeline (see reportProgress), not by runRMBlast
+    os.environ.pop(progress.PROGRESS_ENV, None)
+    # tasks run in parallel, so each keeps the stderr of its aligner
+    # next to its alignment file
+    stderr_file = plainName(sc_file)[:-len(".sc")] + ".stderr"
+    error = runRMBlast(ConsensusSequence(fa_file), bin_file, output_dir,
+                aligner, stderr_file=stderr_file)
+    if error != None:
+        raise RuntimeError("alignment failed: " + error)
+
+def __thresholdsTask__(genome_dir, benchmark_dir, fa_file, subject_size,
+        thresh_file):
+    with open(thresh_file + ".tmp", "w") as f:
+        familyThresholds(genome_dir, benchmark_dir, f,
+            consensusSize(fa_file), subject_size)
+    os.replace(thresh_file + ".tmp", thresh_file)
+
+def __cacheTask__(genome_dir, benchmark_dir, fa_file, subject_size,
+        json_file):
+    writeJson(genome_dir, benchmark_dir, json_file + ".tmp",
+        consensusSize(fa_file), subject_size)
+    os.replace(json_file + ".tmp", json_file)
+
+def __tableTask__(thresh_files, output_file):
+    with open(output_file + ".tmp", "w") as f:
+        for thresh_file in thresh_files:
+            with open(thresh_file, "r") as g:
+                f.write(g.read())
+    os.replace(output_file + ".tmp", output_file)
+
+def readFamilies(consensus_fa):
+    """
+    readFamilies(consensus_fa) - Names and rounded divergences of the
+    consensus sequences in the given fa file, from their header lines
+    (">DF######## avg_kimura=#### [name]").
+    """
+    families = []
+    with open(consensus_fa, "r") as f:
+        for line in f:
+            if line[0] == ">":
+                description = line[1:].split()
+                families.append((description[0],
+                    nearestDivergence(float(description[1].split("=")[1]))))
+    return families
+
+def binFiles(bins_dir):
+    """
+    binFiles(bins_dir) - Sorted names of the GC bin files in bins_dir.
+    """
+    return sorted([b for b in os.listdir(bins_dir) if BIN_FILE_REGEX.match(b)])
+
+def addBinTasks(pipeline, genomes):
+    """
+    addBinTasks(pipeline, genomes) - Adds a task binning each genome fa
+    file. Besides the bins, each writes the list of its bin files; the
+    bins of that list are outputs of the task too, so it reruns when
+    one of them is changed or removed.
+
+    Args:
+        genomes - list of (kind, fa file, bins dir), the fa file being
+            None for genomes that are already binned.
+    """
+    for kind, fa_file, bins_dir in genomes:
+        if fa_file == None:
+            continue
+        bins_list = os.path.join(bins_dir, "bins.txt")
+        bins = []
+        if os.path.isfile(bins_list):
+            with open(bins_list, "r") as f:
+                bins = [os.path.join(bins_dir, b.strip()) for b in f
+                        if b.strip() != ""]
+        pipeline.add(Task("bin:" + kind, __binTask__,
+                (fa_file, bins_dir, bins_list), inputs=[fa_file],
+                outputs=[bins_list] + bins))
+
+def addFamilyTasks(pipeline, consensus_fa, genomes, results_dir, aligner):
+    """
+    addFamilyTasks(pipeline, consensus_fa, genomes, results_dir,
+    aligner) - Adds the tasks splitting the consensus file, aligning
+    every family against every bin of each genome, and computing and
+    caching the thresholds of every family.
+
+    Args:
+        genomes - list of (kind, bins dir), kind being "genomic" or
+            "benchmark". The bins must exist.
+        results_dir - root of the outputs, ../results by default.
+    """
+    families = readFamilies(consensus_fa)
+    split_dir = consensus_fa + "_"
+    fa_files = dict([(name, os.path.join(split_dir, name + ".fa"))
+                    for name, div in families])
+    pipeline.add(Task("split", __splitTask__, (consensus_fa,),
+            inputs=[consensus_fa], outputs=list(fa_files.values())))
+
+    bins = dict([(kind, binFiles(bins_dir)) for kind, bins_dir in genomes])
+    subject_size = binSizes(dict(genomes)["genomic"])
+    thresh_files = []
+    for name, div in families:
+        hits_dirs = {}
+        sc_files = []
+        for kind, bins_dir in genomes:
+            output_dir = os.path.join(results_dir, kind + "_hits")
+            hits_dirs[kind] = os.path.join(output_dir, name)
+            for b in bins[kind]:
+                matrix = str(div) + "p" + BIN_FILE_REGEX.match(b).group(1) + "g"
+                sc_file = scPath(os.path.join(output_dir, name,
+                                    name + "_" + matrix + ".sc"))
+                sc_files.append(sc_file)
+                pipeline.add(Task("align:" + name + ":" + kind + ":" + b,
+                    __alignTask__, (fa_files[name], os.path.join(bins_dir, b),
+                                    output_dir, aligner, sc_file),
+                    inputs=[fa_files[name], os.path.join(bins_dir, b)],
+                    outputs=[sc_file], mem=ALIGN_MEM_GB,
+                    params=aligner.name))
+        thresh_file = os.path.join(results_dir, "thresholds", name + ".thresh")
+        thresh_files.append(thresh_file)
+        pipeline.add(Task("thresholds:" + name, __thresholdsTask__,
+                (hits_dirs["genomic"], hits_dirs["benchmark"], fa_files[name],
+                subject_size, thresh_file),
+                inputs=[fa_files[name]] + sc_files, outputs=[thresh_file]))
+        json_file = os.path.join(results_dir, "cache", name + ".json")
+        pipeline.add(Task("cache:" + name, __cacheTask__,
+                (hits_dirs["genomic"], hits_dirs["benchmark"], fa_files[name],
+                subject_size, json_file),
+                inputs=[fa_files[name]] + sc_files, outputs=[json_file]))
+    pipeline.add(Task("table", __tableTask__,
+            (thresh_files, os.path.join(results_dir, "thresholds.txt")),
+            inputs=thresh_files,
+            outputs=[os.path.join(results_dir, "thresholds.txt")]))
+
+def reportProgress(task, status):
+    """
+    reportProgress(task, status) - Records the progress of the families
+    (see progress.py) as their alignment and thresholds tasks start and
+    end.
+    """
+    parts = task.name.split(":")
+    if parts[0] == "align":
+        family, kind, b = parts[1:]
+        if status == "running":
+            progress.binStarted(family, kind, b)
+        elif status == "failed":
+            progress.binFinished(family, kind, b, 0, "failed")
+        elif status in ("ran", "skipped"):
+            progress.binFinished(family, kind, b, fileSize(task.inputs[1]),
+                    skipped=status == "skipped")
+    elif parts[0] == "thresholds":
+        if status == "ran":
+            progress.unitFinished(parts[1])
+        elif status == "skipped":
+            progress.unitFinished(parts[1], skipped=True)
+        elif status in ("failed", "blocked"):
+            progress.unitFinished(parts[1], "thresholds " + status)
+
+def makeDirs(results_dir, families):
+    for sub in ["thresholds", "cache"]:
+        os.makedirs(os.path.join(results_dir, sub), exist_ok=True)
+    for kind in ["genomic", "benchmark"]:
+        for name, div in families:
+            os.makedirs(os.path.join(results_dir, kind + "_hits", name),
+                        exist_ok=True)
+
+def runPipeline(consensus_fa, genome_bins, benchmark_bins, results_dir,
+        aligner, genome_fa=None, benchmark_fa=None, cpus=None, mem=None,
+        force=False, dry_run=False):
+    """
+    runPipeline(consensus_fa, genome_bins, benchmark_bins, results_dir,
+    aligner, genome_fa, benchmark_fa, cpus, mem, force, dry_run) -
+    Runs the whole pipeline for the families in consensus_fa.
+
+    The alignment tasks depend on which GC bins a genome has, so the
+    genomes given as fa files are binned first; the rest of the graph
+    is built once the bins exist.
+
+    Returns: dict of the tasks that ran, were skipped, failed or were
+        blocked (see Pipeline.run).
+    """
+    os.makedirs(results_dir, exist_ok=True)
+    state_file = os.path.join(results_dir, STATE_FILE)
+    pipeline = Pipeline(state_file)
+    addBinTasks(pipeline, [("genomic", genome_fa, genome_bins),
+                        ("benchmark", benchmark_fa, benchmark_bins)])
+    result = pipeline.run(cpus, mem, force, dry_run)
+    if len(result["failed"]) > 0:
+        return result
+    if dry_run and len(result["ran"]) > 0:
+        print("(alignment tasks depend on the bins produced above)")
+        return result
+
+    families = readFamilies(consensus_fa)
+    makeDirs(results_dir, families)
+    report = None
+    if not dry_run:
+        bases = (progress.binBytes(genome_bins) +
+                progress.binBytes(benchmark_bins))
+        progress.planUnits([(name, bases) for name, div in families])
+        report = reportProgress
+    pipeline = Pipeline(state_file, report)
+    addFamilyTasks(pipeline, consensus_fa,
+            [("genomic", genome_bins), ("benchmark", benchmark_bins)],
+            results_dir, aligner)
+    more = pipeline.run(cpus, mem, force, dry_run)
+    for key in result:
+        result[key] += more[key]
+    return result
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("consensus_fa",
+            help="fa file containing one or more consensus sequences")
+    parser.add_argument("--genome", default=None,
+            help="genome fa file to bin into --genome_bins")
+    parser.add_argument("--benchmark", default=None,
+            help="benchmark genome fa file to bin into --benchmark_bins")
+    parser.add_argument("--genome_name", default=DEFAULT_GENOME,
+            help="registered genome whose bins and results directory " +
+                "are used by default (see genome_registry.py)")
+    parser.add_argument("--registry", default=GENOME_REGISTRY,
+            help="path of the genome registry")
+    parser.add_argument("--genome_bins", default=None,
+            help="directory of genomic GC bins (default: those of " +
+                "--genome_name)")
+    parser.add_argument("--benchmark_bins", default=None,
+            help="directory of benchmark GC bins (default: those of " +
+                "--genome_name)")
+    parser.add_argument("--results", default=None,
+            help="root directory of the alignments, thresholds and " +
+                "caches (default: that of --genome_name)")
+    parser.add_argument("--aligner", default="rmblast",
+            choices=sorted(ALIGNERS),
+            help="aligner backend, see aligners.py")
+    parser.add_argument("--rbn", default=None,
+            help="path of the rbn script run by the rmblast aligner")
+    parser.add_argument("--cpus", type=int, default=None,
+            help="number of CPUs to use (default: all)")
+    parser.add_argument("--mem", type=float, default=None,
+            help="memory budget in GB (default: unlimited)")
+    parser.add_argument("--force", action="store_true",
+            help="rerun every task")
+    parser.add_argument("--dry_run", action="store_true",
+            help="only list the tasks that would run")
+    parser.add_argument("--progress", default=None, metavar="DIR",
+            help="keep the progress state of the families in DIR (see " +
+                "progress.py)")
+    parser.add_argument("--retries", type=int, default=None,
+            help="retries of a failed alignment (default: " +
+                "$DFAM_RETRIES, or 2), see failures.py")
+    parser.add_argument("--timeout", type=float, default=None,
+            help="seconds before an aligner process is killed " +
+                "(default: $DFAM_ALIGN_TIMEOUT, or no timeout)")
+    parser.add_argument("--backoff", type=float, default=None,
+            help="seconds before the first retry, doubled at each " +
+                "retry (default: $DFAM_RETRY_BACKOFF, or 30)")
+    args = parser.parse_args()
+
+    setRetryPolicy(args.retries, args.timeout, args.backoff)
+
+    if None in (args.genome_bins, args.benchmark_bins, args.results):
+        genome = getGenome(args.genome_name, args.registry)
+        if args.genome_bins == None:
+            args.genome_bins = genome.bins
+        if args.benchmark_bins == None:
+            args.benchmark_bins = genome.benchmark_bins
+        if args.results == None:
+            args.results = genome.results
+
+    if args.progress != None:
+        progress.setProgressDir(args.progress)
+
+    aligner = fromArgs(args)
+    result = runPipeline(args.consensus_fa, args.genome_bins,
+            args.benchmark_bins, args.results, aligner, args.genome,
+            args.benchmark, args.cpus, args.mem, args.force, args.dry_run)
+    print("ran " + str(len(result["ran"])) + ", skipped " +
+        str(len(result["skipped"])) + ", failed " +
+        str(len(result["failed"])) + ", blocked " +
+        str(len(result["blocked"])))
+    if len(result["failed"]) > 0:
+        sys.exit(1)
@@ -0,0 +1,395 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+progress.py - Live progress of a campaign: which families (units) are
+done, running or failed, which bins of the running ones are aligned,
+the recent throughput and an ETA.
+
+When the DFAM_PROGRESS environment variable names a directory (see
+setProgressDir, or the --progress option of run_job.py, jobs_batch.py
+and pipeline_dag.py), every process working on the campaign keeps its
+own state file there, [host].[pid].progress.json, rewritten (under a
+temporary name, then moved into place) each time one of its units or
+bins starts or finishes. The drivers also write the units they are
+going to run, with the number of bases each has to align (the size of
+the bins searched), to [host].[pid].plan.json. Nothing is shared
+between writers, so the directory can sit on a shared file system and
+be used by every job of a campaign, across nodes; use one directory
+per campaign.
+
+A unit is a family, or a (genome, family) pair written genome:family
+in campaigns (see campaign.py). Bases aligned are counted from the
+size of the bins searched, whether or not a prefilter skipped some of
+their batches.
+
+You can run this script directly to aggregate the state of every
+worker, or to serve it over HTTP (text at /, JSON at /status.json):
+
+$ python3 progress.py status dir [--json]
+$ python3 progress.py serve dir [--host 127.0.0.1] [--port 8765]
+
+AUTHOR(S):
+    Eric Yeh
+"""
+
+#
+# Module imports
+#
+import argparse
+import json
+import os
+import socket
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from instrument import fileSize
+from sequence_util import BIN_FILE_REGEX
+
+PROGRESS_ENV = "DFAM_PROGRESS"
+STATE_SUFFIX = ".progress.json"
+PLAN_SUFFIX = ".plan.json"
+RECENT_BINS = 50
+RATE_WINDOW = 3600
+STALE_AFTER = 900
+DEFAULT_PORT = 8765
+
+def setProgressDir(path):
+    """
+    setProgressDir(path) - Keeps the progress state of this process,
+    and of every process it starts, in the given directory.
+    """
+    os.makedirs(path, exist_ok=True)
+    os.environ[PROGRESS_ENV] = os.path.abspath(path)
+
+def binBytes(bins_dir):
+    """
+    binBytes(bins_dir) - Total size of the bin files of the given
+    directory, i.e. the bases searched when aligning against it.
+    """
+    if not os.path.isdir(bins_dir):
+        return 0
+    return sum([fileSize(os.path.join(bins_dir, b))
+                for b in os.listdir(bins_dir) if BIN_FILE_REGEX.match(b)])
+
+def writeJson(path, data):
+    tmp = path + ".tmp" + str(os.getpid())
+    with open(tmp, "w") as f:
+        json.dump(data, f, sort_keys=True)
+    os.replace(tmp, path)
+
+class Progress:
+    """
+    Progress state of one process.
+
+    Fields:
+        path - state file of the process.
+        state - dict written to it: host, pid, started, updated, the
+            current unit, the units it worked on and the recent bins
+            it finished as [time, bases] pairs.
+    """
+    def __init__(self, progress_dir):
+        self.dir = progress_dir
+        self.pid = os.getpid()
+        name = socket.gethostname() + "." + str(self.pid)
+        self.path = os.path.join(progress_dir, name + STATE_SUFFIX)
+        self.plan_path = os.path.join(progress_dir, name + PLAN_SUFFIX)
+        self.state = {"host": socket.gethostname(), "pid": self.pid,
+                "started": time.time(), "current": None, "units": {},
+                "recent": []}
+
+    def save(self):
+        self.state["updated"] = time.time()
+        writeJson(self.path, self.state)
+
+    def plan(self, units):
+        """
+        plan(self, units) - Records the units about to run, a list of
+        (key, bases to align).
+        """
+        writeJson(self.plan_path, {"created": time.time(),
+                "units": dict(units)})
+
+    def unit(self, key):
+        units = self.state["units"]
+        if key not in units:
+            units[key] = {"status": "running", "started": time.time(),
+                    "bases": 0, "bins": {}, "bins_done": 0}
+        return units[key]
+
+    def unitStarted(self, key):
+        u = self.unit(key)
+        u["status"] = "running"
+        u["started"] = time.time()
+        u.pop("error", None)
+        self.state["current"] = key
+        self.save()
+
+    def unitFinished(self, key, error=None, skipped=False):
+        u = self.unit(key)
+        u["finished"] = time.time()
+        if error != None:
+            u["status"] = "failed"
+            u["error"] = error
+        else:
+            u["status"] = "skipped" if skipped else "done"
+            # finished units only keep their bin count
+            u["bins"] = {}
+        if self.state["current"] == key:
+            self.state["current"] = None
+        self.save()
+
+    def binKey(self, family):
+        # the bins of a family belong to the unit running it, if any
+        current = self.state["current"]
+        if current != None and current.split(":")[-1] == family:
+            return current
+        return family
+
+    def binStarted(self, family, kind, bin_name):
+        self.unit(self.binKey(family))["bins"][kind + "/" + bin_name] = \
+                "running"
+        self.save()
+
+    def binFinished(self, family, kind, bin_name, bases, error=None,
+            skipped=False):
+        u = self.unit(self.binKey(family))
+        if error != None:
+            u["bins"][kind + "/" + bin_name] = "failed"
+        else:
+            u["bins"].pop(kind + "/" + bin_name, None)
+            u["bins_done"] += 1
+            u["bases"] += bases
+            # bins found up to date are not part of the throughput
+            if not skipped:
+                self.state["recent"] = (self.state["recent"] +
+                                    [[time.time(), bases]])[-RECENT_BINS:]
+        self.save()
+
+PROGRESS = None
+
+def progress():
+    """
+    progress() - The Progress of this process, or None if progress is
+    not being kept (DFAM_PROGRESS is not set).
+    """
+    global PROGRESS
+    progress_dir = os.environ.get(PROGRESS_ENV)
+    if not progress_dir:
+        return None
+    # forked workers start their own state file
+    if (PROGRESS == None or PROGRESS.pid != os.getpid() or
+            PROGRESS.dir != progress_dir):
+        PROGRESS = Progress(progress_dir)
+    return PROGRESS
+
+def planUnits(units):
+    p = progress()
+    if p != None:
+        p.plan(units)
+
+def unitStarted(key):
+    p = progress()
+    if p != None:
+        p.unitStarted(key)
+
+def unitFinished(key, error=None, skipped=False):
+    p = progress()
+    if p != None:
+        p.unitFinished(key, error, skipped)
+
+def binStarted(family, kind, bin_name):
+    p = progress()
+    if p != None:
+        p.binStarted(family, kind, bin_name)
+
+def binFinished(family, kind, bin_name, bases, error=None, skipped=False):
+    p = progress()
+    if p != None:
+        p.binFinished(family, kind, bin_name, bases, error, skipped)
+
+def readFiles(progress_dir, suffix):
+    records = []
+    for f in sorted(os.listdir(progress_dir)):
+        if not f.endswith(suffix):
+            continue
+        try:
+            with open(os.path.join(progress_dir, f), "r") as g:
+                records.append(json.load(g))
+        except (OSError, ValueError):
+            pass
+    return records
+
+def readStatus(progress_dir, now=None):
+    """
+    readStatus(progress_dir, now) - Aggregates the state files and
+    plans of every worker of a campaign.
+
+    When a unit appears in several state files (e.g. rerun by another
+    job), its most recent state is kept. Throughput is that of the
+    workers updated in the last STALE_AFTER seconds, over their bins
+    finished in the last RATE_WINDOW seconds.
+
+    Returns: dict with the number of units planned and in each status,
+        bases aligned per second, families finished per hour, the ETA
+        in seconds (None if unknown), and the running and failed units
+        with the worker they are on.
+    """
+    if now == None:
+        now = time.time()
+    planned = {}
+    for plan in readFiles(progress_dir, PLAN_SUFFIX):
+        planned.update(plan["units"])
+    units = {}
+    workers = []
+    bases_per_s = 0.0
+    first_start = now
+    for state in readFiles(progress_dir, STATE_SUFFIX):
+        worker = state["host"] + ":" + str(state["pid"])
+        stale = now - state.get("updated", 0) > STALE_AFTER
+        workers.append({"worker": worker, "updated": state.get("updated"),
+                "current": state["current"], "stale": stale})
+        first_start = min(first_start, state["started"])
+        for key, u in state["units"].items():
+            changed = max(u.get("finished", 0), u["started"])
+            if key not in units or changed > units[key][0]:
+                units[key] = (changed, worker, u)
+        if stale:
+            continue
+        recent = [r for r in state["recent"] if r[0] >= now - RATE_WINDOW]
+        if len(recent) > 0:
+            since = max(now - RATE_WINDOW, state["started"])
+            bases_per_s += sum([r[1] for r in recent]) / max(now - since, 1.0)
+
+    counts = {"done": 0, "running": 0, "failed": 0, "skipped": 0}
+    finished = 0
+    remaining = 0
+    running = []
+    failed = []
+    for key, (changed, worker, u) in sorted(units.items()):
+        counts[u["status"]] += 1
+        if u["status"] == "done" and u["finished"] >= now - RATE_WINDOW:
+            finished += 1
+        if u["status"] == "running":
+            running.append({"unit": key, "worker": worker,
+                    "started": u["started"], "bins_done": u["bins_done"],
+                    "bins": u["bins"]})
+        elif u["status"] == "failed":
+            failed.append({"unit": key, "worker": worker,
+                    "error": u.get("error")})
+        if u["status"] not in ("done", "skipped"):
+            remaining += max(planned.get(key, 0) - u["bases"], 0)
+    pending = [key for key in planned if key not in units]
+    remaining += sum([planned[key] for key in pending])
+
+    families_per_hour = 0.0
+    elapsed = min(RATE_WINDOW, now - first_start)
+    if elapsed > 0:
+        families_per_hour = finished * 3600.0 / elapsed
+    eta = None
+    if bases_per_s > 0:
+        eta = remaining / bases_per_s
+    elif families_per_hour > 0:
+        eta = (len(pending) + counts["running"]) * 3600.0 / families_per_hour
+    status = {"updated": now, "planned": len(planned),
+            "pending": len(pending), "bases_per_s": bases_per_s,
+            "families_per_hour": families_per_hour,
+            "remaining_bases": remaining, "eta_s": eta, "workers": workers,
+            "running_units": running, "failed_units": failed}
+    status.update(counts)
+    return status
+
+def formatDuration(seconds):
+    if seconds == None:
+        return "unknown"
+    seconds = int(seconds)
+    return "%dd %02dh %02dm" % (seconds // 86400, seconds % 86400 // 3600,
+                                seconds % 3600 // 60)
+
+def formatStatus(status):
+    """
+    formatStatus(status) - Text report of a status from readStatus.
+    """
+    lines = ["units: " + str(status["done"]) + " done, " +
+            str(status["skipped"]) + " skipped, " + str(status["running"]) +
+            " running, " + str(status["failed"]) + " failed, " +
+            str(status["pending"]) + " pending (" + str(status["planned"]) +
+            " planned)",
+        "throughput: %.3g Mb/s aligned, %.1f families/h" %
+            (status["bases_per_s"] / 1e6, status["families_per_hour"]),
+        "eta: " + formatDuration(status["eta_s"]),
+        "workers: " + str(len([w for w in status["workers"]
+                                if not w["stale"]])) + " active, " +
+            str(len([w for w in status["workers"] if w["stale"]])) +
+            " stale"]
+    for u in status["running_units"]:
+        bins = sorted(u["bins"].items())
+        lines.append("running\t" + u["unit"] + "\t" + u["worker"] + "\t" +
+                str(u["bins_done"]) + " bins done\t" +
+                " ".join([b + ("" if s == "running" else "(" + s + ")")
+                        for b, s in bins]))
+    for u in status["failed_units"]:
+        lines.append("failed\t" + u["unit"] + "\t" + u["worker"] + "\t" +
+                str(u["error"]))
+    return "\n".join(lines) + "\n"
+
+def serveStatus(progress_dir, host="127.0.0.1", port=DEFAULT_PORT):
+    """
+    serveStatus(progress_dir, host, port) - Serves the aggregated
+    status of the given directory over HTTP until interrupted: the
+    text report at / and the JSON at /status.json.
+    """
+    class StatusHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            status = readStatus(progress_dir)
+            if self.path == "/status.json":
+                body = json.dumps(status, sort_keys=True).encode()
+                content_type = "application/json"
+            elif self.path == "/":
+                body = formatStatus(status).encode()
+                content_type = "text/plain; charset=utf-8"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), StatusHandler)
+    print("serving " + progress_dir + " at http://" + host + ":" +
+            str(server.server_address[1]) + "/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    status_parser = subparsers.add_parser("status",
+            help="print the aggregated progress of a campaign")
+    status_parser.add_argument("--json", action="store_true",
+            help="print the status as JSON")
+    serve_parser = subparsers.add_parser("serve",
+            help="serve the aggregated progress over HTTP")
+    serve_parser.add_argument("--host", default="127.0.0.1",
+            help="address to listen on (default: local only)")
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_PORT,
+            help="port to listen on")
+    for p in [status_parser, serve_parser]:
+        p.add_argument("dir", help="progress directory of the campaign")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        status = readStatus(args.dir)
+        if args.json:
+            print(json.dumps(status, indent=2, sort_keys=True))
+        else:
+            print(formatStatus(status), end="")
+    else:
+        serveStatus(args.dir, args.host, args.port)
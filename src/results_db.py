@@ -0,0 +1,314 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+results_db.py - SQLite database of the score thresholds, hit counts
+and run parameters of the pipeline.
+
+The database ([results]/results.db by default) has three tables:
+
+    runs(run_id, started, finished, host, pid, command, params)
+    thresholds(consensus, matrix, div, gc, empirical, theoretical,
+        final, run_id, updated, empirical_low, empirical_high)
+    hit_counts(consensus, matrix, kind, hits, run_id)
+
+with one thresholds row per (consensus, matrix) and one hit_counts row
+per (consensus, matrix, genome kind); empirical_low and empirical_high
+bound the bootstrap confidence interval of the empirical threshold,
+when one was computed (see score_thresholds.py --bootstrap). Recomputing a threshold replaces
+its row. The database is opened in WAL mode with a busy timeout, so
+parallel jobs can write to it at the same time, and rows are written
+in batches, one transaction per batch.
+
+For example, the families whose 37% GC threshold is above their 53%
+one:
+
+    SELECT a.consensus FROM thresholds a JOIN thresholds b
+        ON a.consensus = b.consensus AND a.div = b.div
+        WHERE a.gc = 37 AND b.gc = 53 AND a.final > b.final;
+
+You can run this script directly to run such a query, to export the
+thresholds as the usual tab-separated table, or to import existing
+tables (.thresh files, thresholds.txt):
+
+$ python3 results_db.py query "SQL" [--db DB]
+$ python3 results_db.py export [--db DB] [--output FILE]
+$ python3 results_db.py import FILE [FILE ...] [--db DB]
+
+AUTHOR(S):
+    Eric Yeh
+"""
+
+#
+# Module imports
+#
+import argparse
+import json
+import os
+import re
+import socket
+import sqlite3
+import sys
+import time
+
+RESULTS_DB = "../results/results.db"
+BATCH_SIZE = 500
+BUSY_TIMEOUT_MS = 600000
+MATRIX_REGEX = re.compile(r"^(\d+)p(\d+)g$")
+THRESHOLD_COLUMNS = ("consensus, matrix, div, gc, empirical, theoretical, " +
+        "final, run_id, updated, empirical_low, empirical_high")
+# columns added after the first version of the schema
+ADDED_COLUMNS = [("thresholds", "empirical_low", "REAL"),
+        ("thresholds", "empirical_high", "REAL")]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started REAL,
+    finished REAL,
+    host TEXT,
+    pid INTEGER,
+    command TEXT,
+    params TEXT
+);
+CREATE TABLE IF NOT EXISTS thresholds (
+    consensus TEXT NOT NULL,
+    matrix TEXT NOT NULL,
+    div INTEGER,
+    gc INTEGER,
+    empirical REAL,
+    theoretical REAL,
+    final REAL,
+    run_id INTEGER,
+    updated REAL,
+    empirical_low REAL,
+    empirical_high REAL,
+    PRIMARY KEY (consensus, matrix)
+);
+CREATE INDEX IF NOT EXISTS thresholds_gc ON thresholds (gc, div);
+CREATE INDEX IF NOT EXISTS thresholds_run ON thresholds (run_id);
+CREATE TABLE IF NOT EXISTS hit_counts (
+    consensus TEXT NOT NULL,
+    matrix TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    hits INTEGER,
+    run_id INTEGER,
+    PRIMARY KEY (consensus, matrix, kind)
+);
+"""
+
+def connect(path=RESULTS_DB):
+    """
+    connect(path) - Opens (creating it if needed) the results database
+    in WAL mode, so readers never block writers, with a busy timeout
+    so concurrent writers wait for each other instead of failing.
+    Transactions are managed explicitly (see ResultsDB.flush).
+    Columns missing from a database created by an older version are
+    added.
+    """
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000.0,
+                        isolation_level=None)
+    conn.execute("PRAGMA busy_timeout = " + str(BUSY_TIMEOUT_MS))
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.executescript(SCHEMA)
+    for table, column, kind in ADDED_COLUMNS:
+        columns = [r[1] for r in conn.execute("PRAGMA table_info(" +
+                    table + ")")]
+        if column not in columns:
+            conn.execute("ALTER TABLE " + table + " ADD COLUMN " + column +
+                    " " + kind)
+    return conn
+
+def matrixFields(matrix):
+    """
+    matrixFields(matrix) - (divergence, GC) of a matrix name such as
+    "25p41g", or (None, None).
+    """
+    mo = MATRIX_REGEX.match(matrix)
+    if not mo:
+        return None, None
+    return int(mo.group(1)), int(mo.group(2))
+
+class ResultsDB:
+    """
+    Buffered writer to the results database.
+
+    Fields:
+        path - path of the database.
+        run_id - run the rows written are attributed to, see startRun.
+        batch_size - number of rows buffered before they are written in
+            one transaction.
+    """
+    def __init__(self, path=RESULTS_DB, run_id=None, batch_size=BATCH_SIZE):
+        self.path = path
+        self.conn = connect(path)
+        self.run_id = run_id
+        self.batch_size = batch_size
+        self.thresholds = []
+        self.hit_counts = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def startRun(self, command=None, params=None):
+        """
+        startRun(self, command, params) - Records a new run with the
+        given command line and dict of parameters; the rows written
+        afterwards are attributed to it.
+
+        Returns: id of the run.
+        """
+        if command == None:
+            command = " ".join(sys.argv)
+        cur = self.conn.execute("INSERT INTO runs (started, host, pid, " +
+                "command, params) VALUES (?, ?, ?, ?, ?)", (time.time(),
+                socket.gethostname(), os.getpid(), command,
+                json.dumps(params or {}, sort_keys=True)))
+        self.run_id = cur.lastrowid
+        return self.run_id
+
+    def finishRun(self):
+        """
+        finishRun(self) - Records the end time of the current run.
+        """
+        self.flush()
+        if self.run_id != None:
+            self.conn.execute("UPDATE runs SET finished = ? WHERE run_id = ?",
+                    (time.time(), self.run_id))
+
+    def addThreshold(self, row, genomic_hits=None, benchmark_hits=None):
+        """
+        addThreshold(self, row, genomic_hits, benchmark_hits) - Buffers
+        a threshold row (consensus, matrix, empirical, theoretical,
+        final, and optionally the bounds of the confidence interval of
+        the empirical threshold), as returned by
+        generateScoreThreshold, and the number of genomic and
+        benchmark hits it was computed from.
+        """
+        consensus, matrix, empirical, theoretical, final = row[:5]
+        empirical_low, empirical_high = (tuple(row[5:7]) + (None, None))[:2]
+        div, gc = matrixFields(matrix)
+        self.thresholds.append((consensus, matrix, div, gc, empirical,
+                theoretical, final, self.run_id, time.time(), empirical_low,
+                empirical_high))
+        for kind, hits in (("genomic", genomic_hits),
+                ("benchmark", benchmark_hits)):
+            if hits != None:
+                self.hit_counts.append((consensus, matrix, kind, hits,
+                                    self.run_id))
+        if len(self.thresholds) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        flush(self) - Writes the buffered rows in one transaction.
+        """
+        if len(self.thresholds) == 0 and len(self.hit_counts) == 0:
+            return
+        # take the write lock up front, waiting for other writers
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.executemany("INSERT OR REPLACE INTO thresholds (" +
+                    THRESHOLD_COLUMNS + ") VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, " +
+                    "?, ?)", self.thresholds)
+            self.conn.executemany("INSERT OR REPLACE INTO hit_counts VALUES " +
+                    "(?, ?, ?, ?, ?)", self.hit_counts)
+            self.conn.execute("COMMIT")
+        except sqlite3.Error:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.thresholds = []
+        self.hit_counts = []
+
+    def close(self):
+        """
+        close(self) - Writes the buffered rows and closes the database.
+        """
+        self.flush()
+        self.conn.close()
+
+def exportTsv(path=RESULTS_DB, output=None):
+    """
+    exportTsv(path, output) - Writes the thresholds of the database as
+    the tab-separated table written by score_thresholds.py, sorted by
+    consensus and matrix:
+
+    sequence_name\tmatrix\tempirical\ttheoretical\tfinal
+
+    followed by the bounds of the confidence interval of the empirical
+    threshold for the rows that have one.
+
+    Args:
+        output - path of the table, or None for stdout.
+
+    Returns: number of rows written.
+    """
+    conn = connect(path)
+    rows = conn.execute("SELECT consensus, matrix, empirical, theoretical, " +
+                "final, empirical_low, empirical_high FROM thresholds " +
+                "ORDER BY consensus, matrix").fetchall()
+    conn.close()
+    f = sys.stdout if output == None else open(output + ".tmp", "w")
+    for row in rows:
+        if row[5] == None:
+            row = row[:5]
+        f.write("\t".join([str(x) for x in row]) + "\n")
+    if output != None:
+        f.close()
+        os.replace(output + ".tmp", output)
+    return len(rows)
+
+def importTables(files, path=RESULTS_DB):
+    """
+    importTables(files, path) - Loads existing thresholds tables (.thresh
+    files or thresholds.txt) into the database, as one run.
+
+    Returns: number of rows imported.
+    """
+    count = 0
+    with ResultsDB(path) as db:
+        db.startRun(params={"import": files})
+        for fname in files:
+            with open(fname, "r") as f:
+                for line in f:
+                    tokens = line.split()
+                    if len(tokens) != 5 and len(tokens) != 7:
+                        continue
+                    db.addThreshold(tuple(tokens[:2]) +
+                            tuple([float(x) for x in tokens[2:]]))
+                    count += 1
+        db.finishRun()
+    return count
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    query_parser = subparsers.add_parser("query",
+            help="run an SQL query and print the rows")
+    query_parser.add_argument("sql", help="the query")
+    export_parser = subparsers.add_parser("export",
+            help="write the thresholds as a tab-separated table")
+    export_parser.add_argument("--output", default=None,
+            help="path of the table (default: stdout)")
+    import_parser = subparsers.add_parser("import",
+            help="load thresholds tables into the database")
+    import_parser.add_argument("files", nargs="+",
+            help=".thresh files or thresholds.txt tables")
+    for p in [query_parser, export_parser, import_parser]:
+        p.add_argument("--db", default=RESULTS_DB,
+                help="path of the results database")
+    args = parser.parse_args()
+
+    if args.command == "query":
+        conn = connect(args.db)
+        for row in conn.execute(args.sql):
+            print("\t".join([str(x) for x in row]))
+        conn.close()
+    elif args.command == "export":
+        exportTsv(args.db, args.output)
+    else:
+        print("imported " + str(importTables(args.files, args.db)) + " rows")
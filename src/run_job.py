@@ -2,7 +2,8 @@
 # -*- coding: utf-8 -*-
 """
 run_job.py - For the given consensus sequence fa file, generate
-alignments against hg38 and compute a score threshold per GC tuned
+alignments against a registered genome (hg38 by default, see
+genome_registry.py) and compute a score threshold per GC tuned
 matrix. For one instance of this program, all the consensus sequences
 will be run sequentially.
 
@@ -16,35 +17,147 @@ AUTHOR(S):
 import argparse
 import os
 
-from sequence_util import consensusSize, genomeSize
-from generate_alignments import generateAlignments, splitConsensus
-from score_thresholds import scoreThresholds
+from sequence_util import consensusSize
+from generate_alignments import generateAlignments
+from score_thresholds import (scoreThresholds, setGumbelParams,
+        AdaptiveMinScore)
+from instrument import setMetricsLog
+from results_db import ResultsDB
+from genome_registry import getGenome, GENOME_REGISTRY, DEFAULT_GENOME
+from aligners import ALIGNERS, fromArgs
+from kmer_index import KmerPrefilter
+from sc_io import setCompression, SC_SUFFIXES
+import progress
+from failures import setRetryPolicy, requeueBins, ledgerPath
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("consensus",
             help="consensus sequence fa file whose score " +
                 "thresholds will be computed.")
+    parser.add_argument("--metrics", default=None,
+            help="append per-stage timing records (JSON lines) to " +
+                "this file")
+    parser.add_argument("--aligner", default="rmblast",
+            choices=sorted(ALIGNERS),
+            help="aligner backend, see aligners.py")
+    parser.add_argument("--rbn", default=None,
+            help="path of the rbn script run by the rmblast aligner " +
+                "(default: $DFAM_RBN, or rbn on the PATH)")
+    parser.add_argument("--genome", default=DEFAULT_GENOME,
+            help="registered genome to align against")
+    parser.add_argument("--registry", default=GENOME_REGISTRY,
+            help="path of the genome registry")
+    parser.add_argument("--db", default=None,
+            help="results database the thresholds, hit counts and " +
+                "run parameters are written to (default: results.db " +
+                "in the results directory of the genome)")
+    parser.add_argument("--prefilter", type=int, default=None,
+            metavar="MIN_SHARED",
+            help="only align against the genome batches sharing at " +
+                "least MIN_SHARED indexed k-mers with the consensus " +
+                "(needs the k-mer indexes of the bins, see " +
+                "kmer_index.py); benchmark bins are searched in full")
+    parser.add_argument("--compression", default=None,
+            choices=sorted(SC_SUFFIXES),
+            help="compression of the alignment files (default: " +
+                "$DFAM_SC_COMPRESSION, or zstd if installed, else gzip)")
+    parser.add_argument("--score_only", action="store_true",
+            help="only write the header line of each hit, without the " +
+                "alignment text, which is all the thresholds need")
+    parser.add_argument("--adaptive_minscore", type=int, default=None,
+            metavar="MARGIN",
+            help="only report the hits scoring at most MARGIN under " +
+                "the lowest theoretical threshold of each matrix (see " +
+                "score_thresholds.adaptiveMinScore)")
+    parser.add_argument("--progress", default=None, metavar="DIR",
+            help="keep the progress state of the job in DIR, shared " +
+                "by every job of the campaign (see progress.py)")
+    parser.add_argument("--retries", type=int, default=None,
+            help="retries of a failed alignment (default: " +
+                "$DFAM_RETRIES, or 2), see failures.py")
+    parser.add_argument("--timeout", type=float, default=None,
+            help="seconds before an aligner process is killed " +
+                "(default: $DFAM_ALIGN_TIMEOUT, or no timeout)")
+    parser.add_argument("--backoff", type=float, default=None,
+            help="seconds before the first retry, doubled at each " +
+                "retry (default: $DFAM_RETRY_BACKOFF, or 30)")
+    parser.add_argument("--requeue", action="store_true",
+            help="only redo the alignments of the family that failed " +
+                "for good (see failures.py), then its thresholds")
     args = parser.parse_args()
 
+    if args.metrics != None:
+        setMetricsLog(args.metrics)
+    if args.compression != None:
+        setCompression(args.compression)
+    if args.progress != None:
+        progress.setProgressDir(args.progress)
+    setRetryPolicy(args.retries, args.timeout, args.backoff)
+    aligner = fromArgs(args)
+    prefilter = None
+    if args.prefilter != None:
+        prefilter = KmerPrefilter(args.prefilter)
+
     fpath = args.consensus
+    name = fpath.split("/")[-1][:-3]
 
-    n = 3209286105 # size of hg38
+    genome = getGenome(args.genome, args.registry)
+    genome.makeDirs()
+    # bins to align by genome kind, all of them unless requeuing
+    bins = {"genomic": None, "benchmark": None}
+    if args.requeue:
+        bins = requeueBins(ledgerPath(genome.genomicHits())).get(name, {})
+        if len(bins) == 0:
+            print("No failed alignments to requeue for " + name)
+            return
+    setGumbelParams(genome.gumbel_params)
+    bin_sizes = genome.subjectSize()
+    db = ResultsDB(args.db if args.db != None else genome.resultsDb())
+    db.startRun(params={"genome": genome.name, "aligner": aligner.name,
+            "subject_size": bin_sizes, "prefilter": args.prefilter,
+            "score_only": args.score_only,
+            "adaptive_minscore": args.adaptive_minscore})
+    minscore = None
+    if args.adaptive_minscore != None:
+        # the genome sizes for both kinds, so genomic and benchmark
+        # hits are cut at the same score
+        minscore = AdaptiveMinScore(bin_sizes, args.adaptive_minscore)
 
-    name = fpath.split("/")[-1][:-3]
     m = consensusSize(fpath)
 
-    print("Generating genomic alignments for " + name)
-    generateAlignments(fpath,
-        "../data/hg38bins/dfamseq_bins", "../results/genomic_hits/")
-    print("Generating benchmark alignments for " + name)
-    generateAlignments(fpath,
-        "../data/hg38bins/benchmark_bins", "../results/benchmark_hits/")
-
-    print("Calculating score thresholds for " + name)
-    scoreThresholds(os.path.join("../results/genomic_hits/", name),
-                    os.path.join("../results/benchmark_hits/", name),
-                    query_size=m, subject_size=n)
+    progress.planUnits([(name, progress.binBytes(genome.bins) +
+                            progress.binBytes(genome.benchmark_bins))])
+    progress.unitStarted(name)
+    try:
+        errors = []
+        if "genomic" in bins:
+            print("Generating genomic alignments for " + name)
+            errors += generateAlignments(fpath, genome.bins,
+                genome.genomicHits(), aligner, prefilter, minscore,
+                bins["genomic"])
+        if "benchmark" in bins:
+            print("Generating benchmark alignments for " + name)
+            errors += generateAlignments(fpath, genome.benchmark_bins,
+                genome.benchmarkHits(), aligner, None, minscore,
+                bins["benchmark"])
+        if len(errors) > 0:
+            # thresholds missing a bin would be wrong
+            raise RuntimeError(str(len(errors)) + " alignments of " + name +
+                    " failed, see " + ledgerPath(genome.genomicHits()))
+
+        print("Calculating score thresholds for " + name)
+        scoreThresholds(os.path.join(genome.genomicHits(), name),
+                        os.path.join(genome.benchmarkHits(), name),
+                        query_size=m, subject_size=bin_sizes, db=db,
+                        thresholds_dir=genome.thresholdsDir(),
+                        floor_only=args.adaptive_minscore != None)
+    except Exception as e:
+        progress.unitFinished(name, repr(e))
+        raise
+    progress.unitFinished(name)
+    db.finishRun()
+    db.close()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,202 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+sc_io.py - Reads and writes the alignment (.sc) files produced by
+RMBlast, plain or compressed.
+
+The output of the aligner is compressed as it streams out of its
+stdout pipe (see instrument.runChild), so the uncompressed text never
+touches the disk. The compression is set by the DFAM_SC_COMPRESSION
+environment variable, inherited by every process a job starts:
+
+    none - [consensus_name]_[##]p[##]g.sc
+    gzip - [consensus_name]_[##]p[##]g.sc.gz
+    zstd - [consensus_name]_[##]p[##]g.sc.zst (needs the zstandard
+           module)
+
+and defaults to zstd when the zstandard module is installed, gzip
+otherwise. Readers do not care: openSc detects the format from the
+first bytes of the file, and findScFile finds whichever variant of an
+alignment file exists.
+
+AUTHOR(S):
+    Eric Yeh
+"""
+
+#
+# Module imports
+#
+import gzip
+import io
+import os
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSION_ENV = "DFAM_SC_COMPRESSION"
+SC_SUFFIXES = {"none": ".sc", "gzip": ".sc.gz", "zstd": ".sc.zst"}
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+PIPE_CHUNK = 1 << 20
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+def setCompression(compression):
+    """
+    setCompression(compression) - Compresses the alignment files
+    written by this process, and by every process it starts, with the
+    given method (none, gzip or zstd).
+    """
+    if compression not in SC_SUFFIXES:
+        raise ValueError("unknown compression " + compression)
+    os.environ[COMPRESSION_ENV] = compression
+
+def defaultCompression():
+    """
+    defaultCompression() - Compression of new alignment files: the one
+    set by setCompression (or DFAM_SC_COMPRESSION), otherwise zstd if
+    the zstandard module is installed, gzip if not.
+    """
+    compression = os.environ.get(COMPRESSION_ENV)
+    if compression:
+        return compression
+    if zstandard != None:
+        return "zstd"
+    return "gzip"
+
+def isScFile(path):
+    """
+    isScFile(path) - True if the given path names an alignment file,
+    compressed or not.
+    """
+    return any([path.endswith(s) for s in SC_SUFFIXES.values()])
+
+def plainName(path):
+    """
+    plainName(path) - Name of the given alignment file without its
+    compression suffix.
+
+    Ex: DF0000001_25p49g.sc.gz => DF0000001_25p49g.sc
+    """
+    for suffix in [SC_SUFFIXES["gzip"], SC_SUFFIXES["zstd"]]:
+        if path.endswith(suffix):
+            return path[:-len(suffix)] + SC_SUFFIXES["none"]
+    return path
+
+def scPath(sc_file, compression=None):
+    """
+    scPath(sc_file, compression) - Path the given alignment file is
+    written to with the given compression (defaultCompression() if
+    None).
+    """
+    if compression == None:
+        compression = defaultCompression()
+    base = plainName(sc_file)[:-len(SC_SUFFIXES["none"])]
+    return base + SC_SUFFIXES[compression]
+
+def scVariants(sc_file):
+    """
+    scVariants(sc_file) - Every path the given alignment file can be
+    stored under, plain first.
+    """
+    return [scPath(sc_file, c) for c in ["none", "gzip", "zstd"]]
+
+def findScFile(sc_file):
+    """
+    findScFile(sc_file) - Path of the variant of the given alignment
+    file that exists, the most recent one if there are several, or
+    sc_file itself if none does.
+    """
+    found = [p for p in scVariants(sc_file) if os.path.exists(p)]
+    if len(found) == 0:
+        return sc_file
+    return max(found, key=os.path.getmtime)
+
+def openSc(sc_file):
+    """
+    openSc(sc_file) - Opens the given alignment file for reading as
+    text, decompressing it on the fly if it starts with the magic
+    bytes of gzip or zstd.
+    """
+    raw = open(sc_file, "rb")
+    magic = raw.read(4)
+    raw.seek(0)
+    if magic[:2] == GZIP_MAGIC:
+        return io.TextIOWrapper(gzip.GzipFile(fileobj=raw, mode="rb"))
+    if magic == ZSTD_MAGIC:
+        if zstandard == None:
+            raw.close()
+            raise ImportError("zstandard is needed to read " + sc_file)
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(
+                    raw, closefd=True))
+    return io.TextIOWrapper(raw)
+
+class ScWriter:
+    """
+    Alignment file open for writing, compressed as it is written.
+
+    The write method takes text or bytes. Pass a ScWriter as the
+    stdout of instrument.runChild and the output of the child process
+    is read from a pipe and compressed here; it is never handed the
+    file descriptor itself, which would bypass the compressor.
+
+    Fields:
+        path - path of the file written.
+        compression - none, gzip or zstd.
+        pipe - marks the writer for runChild.
+    """
+    pipe = True
+
+    def __init__(self, path, compression=None):
+        if compression == None:
+            compression = defaultCompression()
+        self.path = path
+        self.compression = compression
+        self.raw = open(path, "wb")
+        if compression == "gzip":
+            # no file name or time in the header, so outputs are
+            # reproducible
+            self.out = gzip.GzipFile(filename="", mode="wb", fileobj=self.raw,
+                            compresslevel=GZIP_LEVEL, mtime=0)
+        elif compression == "zstd":
+            if zstandard == None:
+                self.raw.close()
+                raise ImportError("zstandard is needed to write " + path)
+            self.out = zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(
+                            self.raw, closefd=False)
+        else:
+            self.out = self.raw
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.out.write(data)
+
+    def copyFrom(self, stream):
+        """
+        copyFrom(self, stream) - Writes everything read from the given
+        binary stream (e.g. a pipe) until its end.
+
+        Returns: number of bytes copied.
+        """
+        total = 0
+        while True:
+            chunk = stream.read(PIPE_CHUNK)
+            if not chunk:
+                return total
+            self.out.write(chunk)
+            total += len(chunk)
+
+    def close(self):
+        if self.out is not self.raw:
+            self.out.close()
+        self.raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
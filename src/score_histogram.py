@@ -0,0 +1,323 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+score_histogram.py - Histograms of alignment scores, counting the hits
+of each integer score.
+
+RMBlast scores are integers in a bounded range, so the hits of one
+(family, matrix, genome kind) are fully described, as far as the
+thresholds are concerned, by the number of hits at each score. A
+histogram takes memory proportional to the score range whatever the
+number of hits, histograms of different shards or batches are merged
+by adding their counts, and the thresholds are computed from the
+cumulative counts in one pass over the score range instead of sorting
+every hit.
+
+The deduplicated histogram of an alignment file is stored next to it
+([file].hist.npy: the lowest score followed by the counts), so it is
+only computed once. You can run this script directly to merge the
+histograms of alignment files (e.g. the shards of one family) and
+print or save the merged histogram:
+
+$ python3 score_histogram.py file [file ...] [--output merged.hist.npy]
+
+AUTHOR(S):
+    Eric Yeh
+"""
+
+#
+# Module imports
+#
+import argparse
+import os
+
+import numpy as np
+
+HIST_SUFFIX = ".hist.npy"
+BOOTSTRAP_CHUNK = 256
+
+class ScoreHistogram:
+    """
+    Number of hits at each integer score.
+
+    Fields:
+        low - score counted by counts[0].
+        counts - int64 NumPy array, counts[i] being the number of hits
+            scoring low + i.
+
+    len() is the number of hits, so a histogram can stand in for the
+    list of scores where only the number of hits matters.
+    """
+    def __init__(self, low=0, counts=None):
+        if counts is None:
+            counts = np.zeros(0, dtype=np.int64)
+        self.low = int(low)
+        self.counts = np.asarray(counts, dtype=np.int64)
+
+    def __len__(self):
+        return int(self.counts.sum())
+
+    def high(self):
+        """
+        high(self) - Highest score counted (low - 1 if empty).
+        """
+        return self.low + len(self.counts) - 1
+
+    def scores(self):
+        """
+        scores(self) - Scores with at least one hit, decreasing.
+        """
+        return (np.nonzero(self.counts)[0] + self.low)[::-1]
+
+    def countsOf(self, scores):
+        """
+        countsOf(self, scores) - Number of hits at each of the given
+        scores.
+        """
+        scores = np.asarray(scores, dtype=np.int64)
+        i = scores - self.low
+        inside = (i >= 0) & (i < len(self.counts))
+        result = np.zeros(len(scores), dtype=np.int64)
+        result[inside] = self.counts[i[inside]]
+        return result
+
+    def expand(self):
+        """
+        expand(self) - Every hit's score, decreasing, as returned by
+        score_thresholds.readScoresFromFile.
+        """
+        return np.repeat(np.arange(self.high(), self.low - 1, -1,
+                        dtype=np.int64), self.counts[::-1])
+
+    def over(self, low, high):
+        """
+        over(self, low, high) - Counts of the scores low..high.
+        """
+        result = np.zeros(max(high - low + 1, 0), dtype=np.int64)
+        start = max(self.low, low)
+        end = min(self.high(), high)
+        if end >= start:
+            result[start - low:end - low + 1] = \
+                    self.counts[start - self.low:end - self.low + 1]
+        return result
+
+    def merge(self, other):
+        """
+        merge(self, other) - Histogram of the hits of both histograms.
+        """
+        if len(other.counts) == 0:
+            return ScoreHistogram(self.low, self.counts.copy())
+        if len(self.counts) == 0:
+            return ScoreHistogram(other.low, other.counts.copy())
+        low = min(self.low, other.low)
+        high = max(self.high(), other.high())
+        return ScoreHistogram(low, self.over(low, high) + other.over(low, high))
+
+    def toDict(self):
+        """
+        toDict(self) - JSON friendly form of the histogram: the scores
+        with at least one hit, decreasing, and their counts.
+        """
+        scores = self.scores()
+        return {"scores": scores.tolist(),
+                "counts": self.countsOf(scores).tolist()}
+
+def histogramFromScores(scores):
+    """
+    histogramFromScores(scores) - Histogram of the given integer scores.
+    """
+    scores = np.asarray(scores, dtype=np.int64)
+    if len(scores) == 0:
+        return ScoreHistogram()
+    low = int(scores.min())
+    return ScoreHistogram(low, np.bincount(scores - low))
+
+def histogramFromDict(d):
+    """
+    histogramFromDict(d) - Inverse of ScoreHistogram.toDict.
+    """
+    scores = np.asarray(d["scores"], dtype=np.int64)
+    if len(scores) == 0:
+        return ScoreHistogram()
+    low = int(scores.min())
+    counts = np.zeros(int(scores.max()) - low + 1, dtype=np.int64)
+    counts[scores - low] = d["counts"]
+    return ScoreHistogram(low, counts)
+
+def mergeHistograms(histograms):
+    """
+    mergeHistograms(histograms) - Histogram of the hits of all the
+    given histograms, e.g. the shards or batches of one family.
+    """
+    result = ScoreHistogram()
+    for h in histograms:
+        result = result.merge(h)
+    return result
+
+def empiricalThreshold(genomic, benchmark, fdr):
+    """
+    empiricalThreshold(genomic, benchmark, fdr) - The empirical
+    threshold of score_thresholds.empiricalFDRCalculation, computed
+    from histograms.
+
+    Walking the hits from the highest score down, genomic hits first
+    on ties, the walk stops at the first benchmark hit after which
+    benchmark / genomic hits reaches fdr. With G(s) and B(s) the
+    numbers of genomic and benchmark hits scoring s or more, that is
+    the highest score s with a benchmark hit and B(s) / G(s) >= fdr
+    (or G(s) = 0). The threshold is 0.05 above the highest genomic
+    score below s.
+
+    If there is no such s, or no genomic score below it, where the
+    walk would run out of hits, the lowest genomic score + 0.05 is
+    returned.
+
+    Args:
+        genomic, benchmark - ScoreHistograms of the genomic and
+            benchmark hits.
+        fdr - target false discovery rate.
+
+    Returns: the score threshold.
+    """
+    low = min(genomic.low, benchmark.low)
+    high = max(genomic.high(), benchmark.high())
+    g = genomic.over(low, high)
+    b = benchmark.over(low, high)
+    return float(empiricalThresholds(low, g[np.newaxis], b[np.newaxis],
+                    fdr)[0])
+
+def empiricalThresholds(low, g, b, fdr):
+    """
+    empiricalThresholds(low, g, b, fdr) - empiricalThreshold of many
+    pairs of histograms at once.
+
+    Args:
+        low - score counted by the first column.
+        g, b - 2D arrays of genomic and benchmark counts, one row per
+            pair of histograms, columns for the scores low, low + 1...
+        fdr - target false discovery rate.
+
+    Returns: NumPy array of the threshold of each row.
+    """
+    width = g.shape[1]
+    columns = np.arange(width)
+    # hits scoring at least low + i
+    g_at_least = np.cumsum(g[:, ::-1], axis=1)[:, ::-1]
+    b_at_least = np.cumsum(b[:, ::-1], axis=1)[:, ::-1]
+    ratio = np.divide(b_at_least, g_at_least, out=np.full(g.shape, np.inf),
+                    where=g_at_least > 0)
+    stops = (b > 0) & (ratio >= fdr)
+    stop = width - 1 - np.argmax(stops[:, ::-1], axis=1)
+    # highest column at or below each column with a genomic hit
+    last_hit = np.maximum.accumulate(np.where(g > 0, columns, -1), axis=1)
+    below = np.where(stop > 0,
+                last_hit[np.arange(len(g)), np.maximum(stop - 1, 0)], -1)
+    lowest = np.argmax(g > 0, axis=1)
+    result = np.where(stops.any(axis=1) & (below >= 0), below, lowest)
+    return low + result + 0.05
+
+def bootstrapThresholds(genomic, benchmark, fdr, replicates, rng,
+        chunk=BOOTSTRAP_CHUNK):
+    """
+    bootstrapThresholds(genomic, benchmark, fdr, replicates, rng) -
+    Empirical thresholds of bootstrap replicates of the given
+    histograms. Each replicate draws as many genomic (and benchmark)
+    hits as observed, with replacement, which is a multinomial draw
+    of the counts over the observed scores; replicates are drawn and
+    evaluated chunk at a time as 2D arrays.
+
+    Args:
+        genomic, benchmark - ScoreHistograms of the genomic and
+            benchmark hits.
+        fdr - target false discovery rate.
+        replicates - number of bootstrap replicates.
+        rng - NumPy random Generator.
+
+    Returns: NumPy array of the threshold of each replicate, all NaN
+        if there are no genomic hits to resample.
+    """
+    if len(genomic) == 0:
+        return np.full(replicates, np.nan)
+    low = min(genomic.low, benchmark.low)
+    high = max(genomic.high(), benchmark.high())
+    g = genomic.over(low, high)
+    b = benchmark.over(low, high)
+    n_g = int(g.sum())
+    n_b = int(b.sum())
+    results = []
+    for start in range(0, replicates, chunk):
+        size = min(chunk, replicates - start)
+        g_draws = rng.multinomial(n_g, g / n_g, size=size)
+        if n_b > 0:
+            b_draws = rng.multinomial(n_b, b / n_b, size=size)
+        else:
+            b_draws = np.zeros((size, len(b)), dtype=np.int64)
+        results.append(empiricalThresholds(low, g_draws, b_draws, fdr))
+    return np.concatenate(results)
+
+def confidenceInterval(values, confidence):
+    """
+    confidenceInterval(values, confidence) - Percentile interval
+    holding the given fraction of values, as (low, high). The bounds
+    are rounded outwards to values in the sample, so they are
+    thresholds some replicate actually produced.
+    """
+    tail = (1 - confidence) / 2 * 100
+    low = np.percentile(values, tail, method="lower")
+    high = np.percentile(values, 100 - tail, method="higher")
+    return float(low), float(high)
+
+def histogramPath(sc_file):
+    return sc_file + HIST_SUFFIX
+
+def writeHistogram(histogram, path):
+    """
+    writeHistogram(histogram, path) - Saves the given histogram (under
+    a temporary name first, then moved into place).
+    """
+    tmp = path + ".tmp" + str(os.getpid())
+    with open(tmp, "wb") as f:
+        np.save(f, np.concatenate(([histogram.low],
+                    histogram.counts)).astype(np.int64))
+    os.replace(tmp, path)
+
+def readHistogram(path):
+    """
+    readHistogram(path) - Histogram saved by writeHistogram.
+    """
+    a = np.load(path)
+    return ScoreHistogram(a[0], a[1:])
+
+def loadHistogram(sc_file, compute):
+    """
+    loadHistogram(sc_file, compute) - Histogram of the given alignment
+    file, read from its .hist.npy file if it is newer than the
+    alignment file, otherwise computed by compute(sc_file) and saved.
+    """
+    path = histogramPath(sc_file)
+    if (os.path.exists(path) and
+            os.path.getmtime(path) >= os.path.getmtime(sc_file)):
+        return readHistogram(path)
+    histogram = compute(sc_file)
+    writeHistogram(histogram, path)
+    return histogram
+
+if __name__ == '__main__':
+    from score_thresholds import readHistogramFromFile
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("files", nargs="+",
+            help="alignment files or saved histograms to merge")
+    parser.add_argument("--output", default=None,
+            help="save the merged histogram to this file")
+    args = parser.parse_args()
+
+    merged = mergeHistograms([readHistogram(f) if f.endswith(HIST_SUFFIX)
+                            else readHistogramFromFile(f)
+                            for f in args.files])
+    if args.output != None:
+        writeHistogram(merged, args.output)
+    else:
+        d = merged.toDict()
+        for score, count in zip(d["scores"], d["counts"]):
+            print(str(score) + "\t" + str(count))
@@ -6,6 +6,15 @@ sequence such that the false discovery rate is below 0.2%. Uses
 empirical and theoretical FDR calculations and chooses the more
 conservative score threshold value for each GC background.
 
+With --bootstrap N, the genomic and benchmark hits are resampled N
+times to put a confidence interval around each empirical threshold,
+reported in two more columns after the final threshold; a wide
+interval flags a threshold resting on too few benchmark hits.
+
+With --floor_only, for alignments made with an adaptive minscore, the
+theoretical threshold only counts the hits scoring at least its floor
+(see theoreticalFDRCalculation).
+
 AUTHOR(S):
     Eric Yeh
 """
@@ -14,61 +23,181 @@ AUTHOR(S):
 # Module imports
 #
 import argparse
+import hashlib
 import re
 import math
 import os
+import sys
+from functools import lru_cache
+from multiprocessing import Pool
+
+import numpy as np
+
+from sequence_util import binSizes
+from consensus_store import querySize
+from results_db import ResultsDB
+from hit_store import loadHits
+from dedup_hits import dedupScores, dedupHistogram
+from score_histogram import (ScoreHistogram, empiricalThreshold,
+        loadHistogram, bootstrapThresholds, confidenceInterval)
+from instrument import stage, fileSize
+from sc_io import plainName, findScFile
 
-from sequence_util import consensusSize
-
-GUMBEL = {'25p53g': {'lambda': 0.109152, 'k': 0.111427},
-        '14p51g': {'lambda': 0.126273, 'k': 0.271705},
-        '25p41g': {'lambda': 0.113153, 'k': 0.142018},
-        '14p39g': {'lambda': 0.120541, 'k': 0.267775},
-        '14p35g': {'lambda': 0.126797, 'k': 0.284773},
-        '18p43g': {'lambda': 0.121582, 'k': 0.234784},
-        '25p51g': {'lambda': 0.114421, 'k': 0.13735},
-        '18p35g': {'lambda': 0.124283, 'k': 0.246276},
-        '25p35g': {'lambda': 0.108087, 'k': 0.126783},
-        '25p45g': {'lambda': 0.108282, 'k': 0.126305},
-        '14p37g': {'lambda': 0.126554, 'k': 0.284202},
-        '14p43g': {'lambda': 0.123083, 'k': 0.279322},
-        '18p41g': {'lambda': 0.114068, 'k': 0.215272},
-        '25p39g': {'lambda': 0.110804, 'k': 0.133886},
-        '14p41g': {'lambda': 0.123274, 'k': 0.278371},
-        '20p43g': {'lambda': 0.116161, 'k': 0.207456},
-        '18p45g': {'lambda': 0.121927, 'k': 0.241789},
-        '20p51g': {'lambda': 0.11795, 'k': 0.183554},
-        '14p47g': {'lambda': 0.119249, 'k': 0.258223},
-        '14p53g': {'lambda': 0.123762, 'k': 0.258946},
-        '20p49g': {'lambda': 0.121086, 'k': 0.190207},
-        '18p49g': {'lambda': 0.127971, 'k': 0.257942},
-        '18p51g': {'lambda': 0.115054, 'k': 0.191605},
-        '18p39g': {'lambda': 0.126286, 'k': 0.261353},
-        '25p43g': {'lambda': 0.123854, 'k': 0.176985},
-        '18p53g': {'lambda': 0.113257, 'k': 0.190965},
-        '14p49g': {'lambda': 0.119393, 'k': 0.255202},
-        '25p37g': {'lambda': 0.109651, 'k': 0.129716},
-        '20p35g': {'lambda': 0.117394, 'k': 0.195042},
-        '20p37g': {'lambda': 0.118879, 'k': 0.203742},
-        '25p47g': {'lambda': 0.108085, 'k': 0.127639},
-        '25p49g': {'lambda': 0.117029, 'k': 0.151864},
-        '20p41g': {'lambda': 0.114931, 'k': 0.197257},
-        '20p47g': {'lambda': 0.124492, 'k': 0.226433},
-        '20p53g': {'lambda': 0.12917, 'k': 0.213967},
-        '20p39g': {'lambda': 0.127701, 'k': 0.234063},
-        '18p37g': {'lambda': 0.124933, 'k': 0.246589},
-        '18p47g': {'lambda': 0.11989, 'k': 0.233897},
-        '14p45g': {'lambda': 0.130133, 'k': 0.302126},
-        '20p45g': {'lambda': 0.116422, 'k': 0.189823}}
-m = n = 0
+GUMBEL_PARAMS = "../data/gumbel_params.txt"
+MATRIX_DIR = "../data/matrices"
+GUMBEL = None
 FDR_THRESHOLD = 0.002
 FDR_THEORY_TARGET = 0.01
 MAX_E_TARGET = 1000
-THRESHOLDS_TABLE = open("../results/thresholds.txt", "a")
+BOOTSTRAP_CONFIDENCE = 0.95
+MINSCORE_FLOOR = 50
+MINSCORE_MARGIN = 20
+THRESHOLDS_TABLE = "../results/thresholds.txt"
+THRESHOLDS_DIR = "../results/thresholds"
 TEMP_GENOME_SIZE = 3209286105
 TEMP_CONSENSUS_SIZE = 262
+SC_FILE_REGEX = re.compile(r"^(.+)_(\d+p\d+g)\.sc(\.gz|\.zst)?$")
+
+def matrixName(sc_file):
+    """
+    matrixName(sc_file) - Returns the name of the matrix used to
+    produce the given alignment file, taken from the file name.
+
+    Ex: DF0000001_25p49g.sc => 25p49g
+        DF0000001_25p49g.sc.gz => 25p49g
+
+    Args:
+        sc_file - path to alignment file produced from RMBlast.
+
+    Returns: name of the matrix, or None if sc_file does not follow
+        the [consensus_name]_[##]p[##]g.sc[.gz|.zst] naming scheme.
+    """
+    mo = SC_FILE_REGEX.match(os.path.basename(sc_file))
+    if mo:
+        return mo.group(2)
+    return None
+
+def formatRow(row):
+    """
+    formatRow(row) - Formats a threshold row returned by
+    generateScoreThreshold as a tab-separated line.
+    """
+    return "\t".join([str(x) for x in row])
+
+def readThresholds(table, consensus):
+    """
+    readThresholds(table, consensus) - Final threshold of each matrix
+    of the given consensus in a thresholds table (.thresh file or
+    thresholds.txt).
+    """
+    thresholds = {}
+    with open(table, "r") as f:
+        for line in f:
+            tokens = line.split()
+            if len(tokens) >= 5 and tokens[0] == consensus:
+                thresholds[tokens[1]] = float(tokens[4])
+    return thresholds
+
+def matrixChecksum(matrix_file):
+    """
+    matrixChecksum(matrix_file) - Returns the md5 checksum of the
+    given matrix file, used to key its Gumbel parameters so they are
+    refitted whenever the matrix changes.
+    """
+    with open(matrix_file, "rb") as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+def readGumbelParams(params_file=GUMBEL_PARAMS):
+    """
+    readGumbelParams(params_file) - Reads a Gumbel parameter file
+    produced by gumbel_fit.py. Each line is tab-separated:
+
+    checksum\tmatrix\tlambda\tk\thits
+
+    where checksum is the md5 of the matrix file the parameters were
+    fitted for and hits is the number of scores used in the fit (0
+    for parameters carried over from the original offline fit).
+
+    Returns: dict mapping checksum to a dict with the matrix name,
+        "lambda", "k" and "hits".
+    """
+    params = {}
+    if not os.path.exists(params_file):
+        return params
+    with open(params_file, "r") as f:
+        for line in f:
+            if line[0] == "#" or line.strip() == "":
+                continue
+            checksum, matrix, lam, k, hits = line.split()
+            params[checksum] = {"matrix": matrix, "lambda": float(lam),
+                            "k": float(k), "hits": int(hits)}
+    return params
+
+def setGumbelParams(params_file):
+    """
+    setGumbelParams(params_file) - Uses the Gumbel parameters of the
+    given file (e.g. those fitted for another genome, see
+    genome_registry.py) from now on in this process.
+    """
+    global GUMBEL, GUMBEL_PARAMS
+    if params_file != GUMBEL_PARAMS:
+        GUMBEL_PARAMS = params_file
+        GUMBEL = None
+        gumbelTerms.cache_clear()
 
-def computeEValue(hit, matrix):
+def gumbelParams(matrix):
+    """
+    gumbelParams(matrix) - Returns the fitted Gumbel parameters, a
+    dict with "lambda" and "k", for the given matrix name.
+
+    The parameter file is only read the first time this is called.
+    Parameters are looked up by the checksum of the matrix file in
+    MATRIX_DIR, or by matrix name if the matrix file is not available.
+
+    Raises: KeyError if the matrix has not been fitted yet, in which
+        case gumbel_fit.py should be run for it.
+    """
+    global GUMBEL
+    if GUMBEL == None:
+        GUMBEL = readGumbelParams(GUMBEL_PARAMS)
+    matrix_file = os.path.join(MATRIX_DIR, matrix + ".matrix")
+    if os.path.exists(matrix_file):
+        key = matrixChecksum(matrix_file)
+        if key in GUMBEL:
+            return GUMBEL[key]
+    else:
+        for params in GUMBEL.values():
+            if params["matrix"] == matrix:
+                return params
+    raise KeyError("no Gumbel parameters for " + matrix + " in " +
+            GUMBEL_PARAMS + ", run gumbel_fit.py to fit them")
+
+def subjectSize(subject_size, matrix):
+    """
+    subjectSize(subject_size, matrix) - Returns the number of bps
+    searched with the given matrix. subject_size is either a single
+    size used for every matrix, or a dict mapping each GC bin number
+    to the size of that bin (see sequence_util.binSizes).
+    """
+    if isinstance(subject_size, dict):
+        return subject_size[int(matrix[-3:-1])]
+    return subject_size
+
+@lru_cache(maxsize=None)
+def gumbelTerms(matrix, query_size, subject_size):
+    """
+    gumbelTerms(matrix, query_size, subject_size) - Returns the pair
+    (lambda, log(K * m * n)) for the given matrix and search space,
+    computed once per matrix and sizes.
+    """
+    params = gumbelParams(matrix)
+    lam = params["lambda"]
+    log_kmn = (math.log(params["k"]) + math.log(query_size) +
+                math.log(subject_size))
+    return lam, log_kmn
+
+def computeEValue(hit, matrix, query_size=TEMP_CONSENSUS_SIZE,
+        subject_size=TEMP_GENOME_SIZE):
     """
     computeEValues(hit) - Returns the E-value of the given hit. The
     E-value is the number of expected hits of similar score that
@@ -81,34 +210,161 @@ def computeEValue(hit, matrix):
     the raw score of the alignment and "m" and "n" are the lengths of
     the aligned query and subject sequences.
     """
-    return (GUMBEL[matrix]["k"] * TEMP_CONSENSUS_SIZE * TEMP_GENOME_SIZE *
-                math.exp(-GUMBEL[matrix]["lambda"] * hit))
+    return float(computeEValues(np.array([hit]), matrix, query_size,
+                subject_size)[0])
 
-def readScoresFromFile(sc_file):
+def computeEValues(hits, matrix, query_size=TEMP_CONSENSUS_SIZE,
+        subject_size=TEMP_GENOME_SIZE):
     """
-    readScoresFromFile(sc_file) - Reads the given alignment file and
-    produces a list containing for each alignment the score and the
-    lengths of the overlapping sequences, sorted in decreasing order
-    by score.
+    computeEValues(hits, matrix) - Vectorized computeEValue, returns
+    a NumPy array with the E-value of every score in hits.
+
+    Computed as e^(log(K * m * n) - lambda * S), which is the same
+    as K * m * n * e^(-lambda * S) but never overflows K * m * n.
+
+    Args:
+        hits - array of raw scores.
+        matrix - name of the matrix the scores were produced with.
+        query_size - number of bps in consensus sequence (m).
+        subject_size - number of bps searched (n), or dict of sizes
+            per GC bin.
+    """
+    lam, log_kmn = gumbelTerms(matrix, query_size,
+                        subjectSize(subject_size, matrix))
+    return np.exp(log_kmn - lam * np.asarray(hits, dtype=np.float64))
+
+def theoreticalFloor(matrix, query_size=TEMP_CONSENSUS_SIZE,
+        subject_size=TEMP_GENOME_SIZE):
+    """
+    theoreticalFloor(matrix, query_size, subject_size) - Lowest
+    theoretical threshold theoreticalFDRCalculation can return for the
+    given matrix and search space: the score with an E-value of
+    MAX_E_TARGET. It does not depend on the hits, so it is known
+    before aligning.
+    """
+    lam, log_kmn = gumbelTerms(matrix, query_size,
+                        subjectSize(subject_size, matrix))
+    return (log_kmn - math.log(MAX_E_TARGET)) / lam
+
+def adaptiveMinScore(matrix, query_size=TEMP_CONSENSUS_SIZE,
+        subject_size=TEMP_GENOME_SIZE, margin=MINSCORE_MARGIN):
+    """
+    adaptiveMinScore(matrix, query_size, subject_size, margin) -
+    Smallest score worth reporting when aligning a consensus of
+    query_size bps with the given matrix: margin points under the
+    theoretical floor, and never under MINSCORE_FLOOR.
+
+    Final thresholds are at least the theoretical threshold, so the
+    hits under the floor never pass them, nor are they counted by
+    theoreticalFDRCalculation with floor_only; the margin keeps the tail of hits under
+    it for the empirical threshold and the histograms.
+    """
+    return max(MINSCORE_FLOOR, int(math.floor(theoreticalFloor(matrix,
+                query_size, subject_size))) - margin)
+
+class AdaptiveMinScore:
+    """
+    Passed to generate_alignments.runRMBlast, sets the -minscore of
+    each (family, matrix) alignment with adaptiveMinScore.
+
+    Fields:
+        subject_size - number of bps the thresholds are computed for
+            (the genome, also used for the benchmark so both kinds of
+            hits are cut at the same score), or dict of sizes per GC
+            bin.
+        margin - points kept under the theoretical floor.
+    """
+    def __init__(self, subject_size=TEMP_GENOME_SIZE, margin=MINSCORE_MARGIN):
+        self.subject_size = subject_size
+        self.margin = margin
+
+    def minScore(self, consensus, matrix):
+        """
+        minScore(self, consensus, matrix) - Minscore of the given
+        ConsensusSequence with the given matrix, or None if the matrix
+        has no Gumbel parameters yet (the aligner default is kept).
+        """
+        try:
+            return adaptiveMinScore(matrix, len(consensus.seq),
+                        self.subject_size, self.margin)
+        except KeyError:
+            return None
+
+class ScoredHits:
+    """
+    Scores of all the alignments in one alignment file, sorted in
+    decreasing order, stored together with their E-values. Indexing
+    and len() go through to the scores, so a ScoredHits can be passed
+    anywhere a list of scores is expected.
+
+    Fields:
+        matrix - name of the matrix the alignments were scored with.
+        scores - NumPy array of raw scores, decreasing.
+        evalues - NumPy array of the E-value of each score.
+    """
+    def __init__(self, scores, matrix, query_size=TEMP_CONSENSUS_SIZE,
+            subject_size=TEMP_GENOME_SIZE):
+        self.matrix = matrix
+        self.scores = np.asarray(scores, dtype=np.int64)
+        self.evalues = computeEValues(self.scores, matrix, query_size,
+                            subject_size)
+
+    def __len__(self):
+        return len(self.scores)
+
+    def __getitem__(self, i):
+        return int(self.scores[i])
+
+def readScoresFromFile(sc_file, dedup=True):
+    """
+    readScoresFromFile(sc_file) - Reads the scores of the given
+    alignment file, sorted in decreasing order.
+
+    The alignment file is only parsed the first time; afterwards the
+    scores come from its memory-mapped hit store (see hit_store.py).
+
+    Args:
+        sc_file - path to alignment file produced from RMBlast, plain
+            or compressed (see sc_io.py).
+        dedup - drop the second copy of hits found in the overlap of
+            two adjacent batches (see dedup_hits.py).
+
+    Returns: NumPy array of the scores of the alignments in sc_file
+        sorted in decreasing order.
+    """
+    with stage("readScoresFromFile", file=sc_file,
+            input_bytes=fileSize(sc_file)) as st:
+        if dedup:
+            scores = dedupScores(sc_file)
+        else:
+            scores = np.sort(loadHits(sc_file).scores())[::-1]
+        st.set(hits=len(scores))
+    return scores
+
+def readHistogramFromFile(sc_file, dedup=True):
+    """
+    readHistogramFromFile(sc_file) - Reads the scores of the given
+    alignment file as a ScoreHistogram (see score_histogram.py),
+    without sorting them.
+
+    The deduplicated histogram is saved next to the alignment file,
+    so afterwards only the counts are read.
 
     Args:
         sc_file - path to alignment file produced from RMBlast.
+        dedup - drop the second copy of hits found in the overlap of
+            two adjacent batches (see dedup_hits.py).
 
-    Returns: list of Hit objects produced from sc_file sorted
-        in decreasing order by score.
-    """
-    f = open(sc_file, "r")
-    scoreRegex = re.compile(r"^\s*(\d+)\s+\d+\.\d+\s+\d+\.\d+")
-    hits = []
-    line = f.readline()
-    while line != "":
-        mo = scoreRegex.search(line)
-        if mo:
-            score = int(mo.group(1))
-            hits.append(score)
-        line = f.readline()
-    hits.sort(reverse=True)
-    return hits
+    Returns: ScoreHistogram of the scores of the alignments in sc_file.
+    """
+    with stage("readHistogramFromFile", file=sc_file,
+            input_bytes=fileSize(sc_file)) as st:
+        if dedup:
+            histogram = loadHistogram(sc_file, dedupHistogram)
+        else:
+            histogram = loadHits(sc_file).histogram()
+        st.set(hits=len(histogram))
+    return histogram
 
 def empiricalFDRCalculation(genomic_hits, benchmark_hits):
     """
@@ -148,7 +404,66 @@ def empiricalFDRCalculation(genomic_hits, benchmark_hits):
             i += 1
     return genomic_hits[i]+ 0.05
 
-def theoreticalFDRCalculation(genomic_hits, benchmark_hits, matrix):
+def empiricalHistogramCalculation(genomic_hist, benchmark_hist):
+    """
+    empiricalHistogramCalculation(genomic_hist, benchmark_hist) -
+    empiricalFDRCalculation computed from the ScoreHistograms of the
+    genomic and benchmark hits, in time proportional to the score
+    range instead of the number of hits. Gives the same threshold,
+    except that running out of hits returns the lowest genomic score +
+    0.05 instead of raising IndexError.
+    """
+    return empiricalThreshold(genomic_hist, benchmark_hist, FDR_THRESHOLD)
+
+def bootstrapSeed(consensus, matrix):
+    """
+    bootstrapSeed(consensus, matrix) - Seed of the bootstrap replicates
+    of a threshold, derived from the consensus and matrix names so the
+    interval does not depend on how the work was scheduled.
+    """
+    return int(hashlib.md5((consensus + "_" + matrix).encode())
+                .hexdigest()[:8], 16)
+
+def empiricalConfidenceInterval(genomic_hist, benchmark_hist, replicates,
+        confidence=BOOTSTRAP_CONFIDENCE, seed=None):
+    """
+    empiricalConfidenceInterval(genomic_hist, benchmark_hist,
+    replicates) - Bootstrap confidence interval of the empirical
+    threshold. The genomic and benchmark hits are resampled with
+    replacement (a multinomial draw over their score histograms) and
+    the empirical threshold of every replicate computed; the interval
+    holds the given fraction of them.
+
+    Args:
+        genomic_hist, benchmark_hist: ScoreHistograms of the genomic
+            and benchmark hits.
+        replicates: number of bootstrap replicates.
+        confidence: fraction of the replicates inside the interval.
+        seed: seed of the replicates.
+
+    Returns: (low, high) bounds of the interval, NaN if there are no
+        genomic hits.
+    """
+    thresholds = bootstrapThresholds(genomic_hist, benchmark_hist,
+                        FDR_THRESHOLD, replicates,
+                        np.random.default_rng(seed))
+    return confidenceInterval(thresholds, confidence)
+
+def countAtLeast(hits, score):
+    """
+    countAtLeast(hits, score) - Number of hits scoring at least score,
+    hits being a list or array of scores, ScoredHits or a
+    ScoreHistogram.
+    """
+    if isinstance(hits, ScoreHistogram):
+        return int(hits.over(int(math.ceil(score)), hits.high()).sum())
+    if isinstance(hits, ScoredHits):
+        hits = hits.scores
+    return int(np.count_nonzero(np.asarray(hits) >= score))
+
+def theoreticalFDRCalculation(genomic_hits, benchmark_hits, matrix,
+        query_size=TEMP_CONSENSUS_SIZE, subject_size=TEMP_GENOME_SIZE,
+        floor_only=False):
     """
     theoreticalFDRCalculation(genomic_hits, benchmark_hits) - Uses
     theoretical FDR calculation to compute a score threshold for this
@@ -160,16 +475,37 @@ def theoreticalFDRCalculation(genomic_hits, benchmark_hits, matrix):
     unreasonably liberal scores for families with a large number of
     genomic hits and few, if any, benchmark hits.
 
+    With floor_only, for alignments made with an adaptive minscore
+    (see adaptiveMinScore), genomic_hits and benchmark_hits only count
+    the hits scoring at least the theoretical floor (E-value of 1000,
+    see theoreticalFloor): those are reported whatever the minscore,
+    so the threshold does not depend on how many hits under the floor
+    the minscore cut.
+
+    Only the numbers of hits are used, so genomic_hits and
+    benchmark_hits can also be ScoreHistograms.
+
     Args:
         genomic_hits: List of Hit objects obtained from alignment
             of consensus against genomic sequence.
         benchmark_hits: List of Hit objects obtained from alignment
             of consensus against bnechmark sequence.
+        matrix: name of the matrix used for the alignments.
+        query_size: number of bps in consensus sequence.
+        subject_size: number of bps searched, or dict of sizes per GC
+            bin.
+        floor_only: only count the hits scoring at least the
+            theoretical floor.
 
     Returns: theoretical score threshold that should keep the false
         discovery rate below 0.2%.
     """
-    tp_estimate = len(genomic_hits) - len(benchmark_hits)
+    if floor_only:
+        floor = theoreticalFloor(matrix, query_size, subject_size)
+        tp_estimate = (countAtLeast(genomic_hits, floor) -
+                        countAtLeast(benchmark_hits, floor))
+    else:
+        tp_estimate = len(genomic_hits) - len(benchmark_hits)
     if tp_estimate < 0:
         tp_estimate = 0
     target = tp_estimate * FDR_THEORY_TARGET
@@ -177,11 +513,15 @@ def theoreticalFDRCalculation(genomic_hits, benchmark_hits, matrix):
         target = MAX_E_TARGET
 
     # Convert e-value target into score threshold
-    in_log = GUMBEL[matrix]['k'] * TEMP_CONSENSUS_SIZE * TEMP_GENOME_SIZE
-    raw = (math.log(in_log) - math.log(target)) / GUMBEL[matrix]['lambda']
+    lam, log_kmn = gumbelTerms(matrix, query_size,
+                        subjectSize(subject_size, matrix))
+    raw = (log_kmn - math.log(target)) / lam
     return raw
 
-def generateScoreThreshold(genome_file, benchmark_file, thresholds_table):
+def generateScoreThreshold(genome_file, benchmark_file,
+        thresholds_table=None, query_size=TEMP_CONSENSUS_SIZE,
+        subject_size=TEMP_GENOME_SIZE, db=None, bootstrap=0,
+        confidence=BOOTSTRAP_CONFIDENCE, floor_only=False):
     """
     generateScoreThreshold(genome_file, benchmark_file) -
     Take in the file names of two alignment files produced from
@@ -192,30 +532,99 @@ def generateScoreThreshold(genome_file, benchmark_file, thresholds_table):
     Args:
         genome_file - alignment file against genome bins.
         benchmark_file - alignment file against benchmark bins.
+        thresholds_table - optional open file the threshold row is
+            written to.
+        query_size - number of bps in consensus sequence.
+        subject_size - number of bps searched, or dict of sizes per GC
+            bin.
+        db - optional ResultsDB (see results_db.py) the threshold and
+            hit counts are written to.
+        bootstrap - number of bootstrap replicates used for a
+            confidence interval of the empirical threshold, 0 for none.
+        confidence - fraction of the replicates inside the interval.
+        floor_only - the alignments were made with an adaptive
+            minscore: the theoretical threshold only counts the hits
+            over its floor (see theoreticalFDRCalculation).
 
-    Returns: score threshold for this consensus sequence computed
-        from the given alignments.
+    Returns: tuple (consensus, matrix, empirical, theoretical, final)
+        for this consensus sequence computed from the given
+        alignments, followed by the bounds of the confidence interval
+        of the empirical threshold with bootstrap.
     """
-    consensus = genome_file.split("/")[-1].split("_")[0]
-    matrix = genome_file[-9:-3]
+    consensus = os.path.basename(genome_file).split("_")[0]
+    matrix = matrixName(genome_file)
     #print("computing score threshold for " + consensus + " with matrix " + matrix)
-    genomic_hits = readScoresFromFile(genome_file)
-    genomic_e = [computeEValue(h, matrix) for h in genomic_hits]
-    benchmark_hits = readScoresFromFile(benchmark_file)
-    benchmark_e = [computeEValue(h, matrix) for h in benchmark_hits]
+    with stage("generateScoreThreshold", family=consensus,
+            matrix=matrix) as st:
+        genomic_hits = readHistogramFromFile(genome_file)
+        benchmark_hits = readHistogramFromFile(benchmark_file)
 
-    empirical = empiricalFDRCalculation(genomic_hits, benchmark_hits)
-    theoretical = theoreticalFDRCalculation(genomic_hits, benchmark_hits, matrix)
+        empirical = empiricalHistogramCalculation(genomic_hits,
+                            benchmark_hits)
+        theoretical = theoreticalFDRCalculation(genomic_hits, benchmark_hits,
+                            matrix, query_size, subject_size, floor_only)
+        interval = ()
+        if bootstrap > 0:
+            interval = empiricalConfidenceInterval(genomic_hits,
+                            benchmark_hits, bootstrap, confidence,
+                            bootstrapSeed(consensus, matrix))
+        st.set(genomic_hits=len(genomic_hits),
+                benchmark_hits=len(benchmark_hits))
     #print("empirical score: " + str(empirical))
     #print("theoretical score: " + str(theoretical))
     #print("final score threshold: " + str(max(empirical, theoretical)))
-    line = (consensus + "\t" + matrix + "\t" + str(empirical) + "\t" +
-            str(theoretical) + "\t" + str((max(empirical, theoretical))))
-    print(line)
-    thresholds_table.write(line + "\n")
+    row = (consensus, matrix, empirical, theoretical,
+            max(empirical, theoretical)) + interval
+    if thresholds_table != None:
+        line = formatRow(row)
+        print(line)
+        thresholds_table.write(line + "\n")
+    if db != None:
+        db.addThreshold(row, len(genomic_hits), len(benchmark_hits))
+    return row
+
+def familyThresholds(genome_dir, benchmark_dir, thresholds_table=None,
+        query_size=TEMP_CONSENSUS_SIZE, subject_size=TEMP_GENOME_SIZE,
+        db=None, bootstrap=0, confidence=BOOTSTRAP_CONFIDENCE,
+        floor_only=False):
+    """
+    familyThresholds(genome_dir, benchmark_dir) - Computes the
+    threshold rows for every matrix of a single consensus sequence.
+
+    Args:
+        genome_dir: Path to the directory containing genomic
+            alignments for a consensus sequence.
+        benchmark_dir: Path to the directory containing benchmark
+            alignments for the same consensus sequence.
+        thresholds_table: optional open file rows are written to.
+        query_size: number of bps in consensus sequence.
+        subject_size: number of bps searched, or dict of sizes per GC
+            bin.
+        db: optional ResultsDB rows are written to.
+        bootstrap: number of bootstrap replicates of each empirical
+            threshold, 0 for no confidence intervals.
+        confidence: fraction of the replicates inside the intervals.
+
+    Returns: list of rows produced by generateScoreThreshold, sorted
+        by matrix.
+    """
+    rows = []
+    # one row per matrix, whichever compression its files were
+    # written with
+    for f in sorted(set([plainName(f) for f in os.listdir(genome_dir)])):
+        if matrixName(f) == None:
+            continue
+        rows.append(generateScoreThreshold(
+            findScFile(os.path.join(genome_dir, f)),
+            findScFile(os.path.join(benchmark_dir, f)), thresholds_table,
+            query_size, subject_size, db, bootstrap, confidence,
+            floor_only))
+    return rows
 
 def scoreThresholds(genome_dir, benchmark_dir,
-        query_size=TEMP_CONSENSUS_SIZE, subject_size=TEMP_GENOME_SIZE):
+        query_size=TEMP_CONSENSUS_SIZE, subject_size=TEMP_GENOME_SIZE,
+        db=None, bootstrap=0, confidence=BOOTSTRAP_CONFIDENCE,
+        thresholds_dir=THRESHOLDS_DIR, floor_only=False):
     """
     scoreThresholds(genome_dir, benchmark_dir) -
     Creates a table for all the alignment files found in the given
@@ -229,7 +638,8 @@ def scoreThresholds(genome_dir, benchmark_dir,
     threshold generated using the empirical method, theoretical is
     the threshold generated using the theoretical method, and final
     is the more conservative of the empirical and theoretical score
-    thresholds found.
+    thresholds found. With bootstrap, two more columns hold the bounds
+    of the confidence interval of the empirical threshold.
 
     Args:
         genome_dir: Path to the directory containing genomic
@@ -238,33 +648,212 @@ def scoreThresholds(genome_dir, benchmark_dir,
             alignments for the same consensus sequence used in
             genome_dir, and with the same file names.
         query_size: number of bps in consensus sequence.
-        subject_size: number of bps in subject sequence/genome.
-    """
-    consensus = genome_dir[:-1].split("/")[-1].split("_")[0]
-    thresholds_table = open("../results/thresholds/" + consensus +
-                    ".thresh", "w")
-    print("../results/thresholds/" + consensus + ".thresh")
-    genome_list = os.listdir(genome_dir)
-    benchmark_list = os.listdir(benchmark_dir)
-    m = query_size
-    n = subject_size
-    for f in genome_list:
-        generateScoreThreshold(os.path.join(genome_dir, f),
-            os.path.join(benchmark_dir, f), thresholds_table)
+        subject_size: number of bps in subject sequence/genome, or
+            dict of the number of bps in each GC bin.
+        db: optional ResultsDB the rows are also written to.
+        bootstrap: number of bootstrap replicates of each empirical
+            threshold, 0 for no confidence intervals.
+        confidence: fraction of the replicates inside the intervals.
+        thresholds_dir: directory the [consensus].thresh table is
+            written to.
+        floor_only: the alignments were made with an adaptive
+            minscore (see generateScoreThreshold).
+
+    Returns: list of rows produced by generateScoreThreshold.
+    """
+    consensus = os.path.basename(os.path.normpath(genome_dir)).split("_")[0]
+    thresh_file = os.path.join(thresholds_dir, consensus + ".thresh")
+    thresholds_table = open(thresh_file, "w")
+    print(thresh_file)
+    rows = familyThresholds(genome_dir, benchmark_dir, thresholds_table,
+        query_size, subject_size, db, bootstrap, confidence, floor_only)
     thresholds_table.close()
+    if db != None:
+        db.flush()
+    return rows
+
+def __scoreFamily__(dirs):
+    """
+    Worker run by batchScoreThresholds in a separate process. Returns
+    (consensus, rows, error) so a failing family does not bring down
+    the whole pool.
+    """
+    (genome_dir, benchmark_dir, consensus_dir, subject_size, db_path,
+        run_id, bootstrap, confidence, floor_only) = dirs
+    consensus = os.path.basename(os.path.normpath(genome_dir))
+    try:
+        query_size = TEMP_CONSENSUS_SIZE
+        if consensus_dir != None:
+            query_size = querySize(consensus_dir, consensus)
+        if db_path == None:
+            return (consensus, familyThresholds(genome_dir, benchmark_dir,
+                        None, query_size, subject_size, None, bootstrap,
+                        confidence, floor_only), None)
+        # one transaction per family
+        with ResultsDB(db_path, run_id) as db:
+            return (consensus, familyThresholds(genome_dir, benchmark_dir,
+                        None, query_size, subject_size, db, bootstrap,
+                        confidence, floor_only), None)
+    except Exception as e:
+        return (consensus, [], repr(e))
+
+def batchScoreThresholds(genomic_root, benchmark_root,
+        output_file=THRESHOLDS_TABLE, processes=None, consensus_dir=None,
+        subject_size=TEMP_GENOME_SIZE, db_path=None, bootstrap=0,
+        confidence=BOOTSTRAP_CONFIDENCE, floor_only=False):
+    """
+    batchScoreThresholds(genomic_root, benchmark_root, output_file) -
+    Computes the score thresholds of every consensus sequence found in
+    genomic_root (e.g. ../results/genomic_hits) that also has
+    alignments in benchmark_root, using a pool of processes.
+
+    Workers only return rows; the parent process is the only writer,
+    so rows from different families never interleave. The table is
+    sorted by consensus and matrix, written to a temporary file and
+    then moved over output_file, so the output is identical no matter
+    how the work was scheduled. The rows of the families that fail are
+    carried forward from the previous output_file, if any, so a failure
+    never drops thresholds from the table.
+
+    Args:
+        genomic_root: directory with one directory of genomic
+            alignments per consensus sequence.
+        benchmark_root: directory with one directory of benchmark
+            alignments per consensus sequence.
+        output_file: path of the consolidated thresholds table.
+        processes: number of worker processes (default: cpu count).
+        consensus_dir: directory of [consensus_name].fa files, or an
+            indexed consensus library (see consensus_store.py), used
+            to find the size of each consensus sequence.
+        subject_size: number of bps searched, or dict of sizes per GC
+            bin.
+        db_path: optional results database (see results_db.py) each
+            worker also writes the thresholds and hit counts of its
+            families to, under one run.
+        bootstrap: number of bootstrap replicates of each empirical
+            threshold, 0 for no confidence intervals. Families are
+            spread over the worker processes, and the replicates of a
+            threshold are computed together as arrays.
+        confidence: fraction of the replicates inside the intervals.
+        floor_only: the alignments were made with an adaptive
+            minscore (see generateScoreThreshold).
+
+    Returns: number of families that failed.
+    """
+    families = [ f for f in sorted(os.listdir(genomic_root))
+                if os.path.isdir(os.path.join(genomic_root, f)) and
+                    os.path.isdir(os.path.join(benchmark_root, f)) ]
+    run_id = None
+    if db_path != None:
+        with ResultsDB(db_path) as db:
+            run_id = db.startRun(params={"genomic_root": genomic_root,
+                    "benchmark_root": benchmark_root,
+                    "consensus_dir": consensus_dir,
+                    "subject_size": subject_size, "bootstrap": bootstrap,
+                    "confidence": confidence, "floor_only": floor_only})
+    jobs = [ (os.path.join(genomic_root, f), os.path.join(benchmark_root, f),
+                consensus_dir, subject_size, db_path, run_id, bootstrap,
+                confidence, floor_only) for f in families ]
+    rows = []
+    failed = set()
+    with Pool(processes) as pool:
+        for consensus, family_rows, err in pool.imap_unordered(
+                __scoreFamily__, jobs, chunksize=4):
+            if err != None:
+                failed.add(consensus)
+                sys.stderr.write("failed " + consensus + ": " + err + "\n")
+                continue
+            rows.extend(family_rows)
+    kept = 0
+    if len(failed) > 0 and os.path.isfile(output_file):
+        with open(output_file, "r") as table:
+            for line in table:
+                tokens = line.split()
+                if len(tokens) >= 5 and tokens[0] in failed:
+                    rows.append(tuple(tokens))
+                    kept += 1
+    rows.sort(key=lambda r: (r[0], r[1]))
+
+    tmp_file = output_file + ".tmp"
+    with open(tmp_file, "w") as table:
+        for row in rows:
+            table.write(formatRow(row) + "\n")
+    os.replace(tmp_file, output_file)
+    print("wrote " + str(len(rows)) + " thresholds for " +
+            str(len(families) - len(failed)) + " families to " + output_file)
+    if kept > 0:
+        print("kept " + str(kept) + " previous thresholds of the " +
+                str(len(failed)) + " failed families")
+    if db_path != None:
+        with ResultsDB(db_path, run_id) as db:
+            db.finishRun()
+    return len(failed)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("genomic_hits",
             help="path to the genomic alignments for consensus " +
-                "sequence of interest.")
+                "sequence of interest (with --batch, the directory " +
+                "containing every consensus' genomic alignments).")
     parser.add_argument("benchmark_hits",
             help="path to the benchmark alignments for consensus " +
-                "sequence of interest.")
+                "sequence of interest (with --batch, the directory " +
+                "containing every consensus' benchmark alignments).")
     parser.add_argument("--m",type=int, default=TEMP_CONSENSUS_SIZE,
             help="size of given consensus sequence (query)")
     parser.add_argument("--n",type=int, default=TEMP_GENOME_SIZE,
             help="size of genome searched against (subject)")
+    parser.add_argument("--bins", default=None,
+            help="directory of genome bins; the size of each bin is " +
+                "used as the subject size of its matrix instead of --n")
+    parser.add_argument("--consensus_dir", default=None,
+            help="with --batch, directory of consensus fa files (or " +
+                "consensus library) used to find each family's size " +
+                "instead of --m")
+    parser.add_argument("--batch", action="store_true",
+            help="compute thresholds for every consensus sequence " +
+                "in one parallel pass")
+    parser.add_argument("--output", default=THRESHOLDS_TABLE,
+            help="consolidated thresholds table written by --batch")
+    parser.add_argument("-p", "--processes", type=int, default=None,
+            help="number of worker processes used by --batch")
+    parser.add_argument("--db", default=None,
+            help="also write the thresholds and hit counts to this " +
+                "results database (see results_db.py)")
+    parser.add_argument("--bootstrap", type=int, default=0,
+            help="number of bootstrap replicates used to add a " +
+                "confidence interval of each empirical threshold " +
+                "(default: 0, no intervals)")
+    parser.add_argument("--confidence", type=float,
+            default=BOOTSTRAP_CONFIDENCE,
+            help="fraction of the bootstrap replicates inside the " +
+                "confidence intervals")
+    parser.add_argument("--floor_only", action="store_true",
+            help="the alignments were made with --adaptive_minscore: " +
+                "only count the hits over the theoretical floor in the " +
+                "theoretical threshold")
     args = parser.parse_args()
 
-    scoreThresholds(args.genomic_hits, args.benchmark_hits, args.m, args.n)
+    subject_size = args.n
+    if args.bins != None:
+        subject_size = binSizes(args.bins)
+    if args.batch:
+        failed = batchScoreThresholds(args.genomic_hits, args.benchmark_hits,
+                    args.output, args.processes, args.consensus_dir,
+                    subject_size, args.db, args.bootstrap, args.confidence,
+                    args.floor_only)
+        sys.exit(1 if failed else 0)
+    if args.db == None:
+        scoreThresholds(args.genomic_hits, args.benchmark_hits, args.m,
+            subject_size, None, args.bootstrap, args.confidence,
+            floor_only=args.floor_only)
+    else:
+        with ResultsDB(args.db) as db:
+            db.startRun(params={"m": args.m, "subject_size": subject_size,
+                    "bootstrap": args.bootstrap,
+                    "confidence": args.confidence,
+                    "floor_only": args.floor_only})
+            scoreThresholds(args.genomic_hits, args.benchmark_hits, args.m,
+                subject_size, db, args.bootstrap, args.confidence,
+                floor_only=args.floor_only)
+            db.finishRun()
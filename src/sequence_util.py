@@ -12,8 +12,12 @@ AUTHOR(S):
 # Module imports
 #
 import argparse
+import os
+import re
 
 DIV_VALUES = [14, 18, 20, 25]
+BIN_FILE_REGEX = re.compile(r"^bin(\d+)\.fa$")
+BIN_SIZES_FILE = "bin_sizes.txt"
 
 def nearestDivergence(div):
     """
@@ -88,6 +92,67 @@ def genomeSize(fa_file):
         line = genome.readline()
     return size
 
+def binSizes(bins_dir):
+    """
+    binSizes(bins_dir) - Given a directory of GC bins produced by
+    bin_genome.py, return the number of nucleotides in each bin.
+
+    Counting a bin means reading the whole bin, so the sizes are
+    cached in bins_dir/bin_sizes.txt and only recounted when a bin
+    file is newer than the cache.
+
+    Args:
+        bins_dir - path to directory containing bin[GC].fa files.
+
+    Returns: dict mapping each GC bin number to the size of its bin.
+    """
+    bins = {}
+    for f in os.listdir(bins_dir):
+        mo = BIN_FILE_REGEX.match(f)
+        if mo:
+            bins[int(mo.group(1))] = os.path.join(bins_dir, f)
+    cache = os.path.join(bins_dir, BIN_SIZES_FILE)
+    if (os.path.exists(cache) and all([os.path.getmtime(b) <=
+            os.path.getmtime(cache) for b in bins.values()])):
+        sizes = {}
+        with open(cache, "r") as f:
+            for line in f:
+                gc, size = line.split()
+                sizes[int(gc)] = int(size)
+        if sorted(sizes.keys()) == sorted(bins.keys()):
+            return sizes
+    sizes = {}
+    for gc in sorted(bins.keys()):
+        sizes[gc] = genomeSize(bins[gc])
+    with open(cache, "w") as f:
+        for gc in sorted(sizes.keys()):
+            f.write(str(gc) + "\t" + str(sizes[gc]) + "\n")
+    return sizes
+
+def countBins(bins_dirs):
+    """
+    countBins(bins_dirs) - Number of GC bin files in the given
+    directories that exist, at least 1.
+    """
+    count = 0
+    for d in bins_dirs:
+        if os.path.isdir(d):
+            count += len([b for b in os.listdir(d) if BIN_FILE_REGEX.match(b)])
+    return max(count, 1)
+
+def readShard(consensus_fa, shard):
+    """
+    readShard(consensus_fa, shard) - Names of the families assigned to
+    the given shard (numbered from 1) in [consensus_fa].shards.tsv.
+    """
+    names = []
+    with open(consensus_fa + ".shards.tsv", "r") as f:
+        for line in f:
+            tokens = line.split("\t")
+            if int(tokens[0]) == shard:
+                names.append(tokens[1])
+    return names
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("fa_file",
@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+test_aligners.py
+
+A quick test suite for the numpy aligner in aligners.py. Can simply
+be run as:
+
+$ python test_aligners.py
+
+AUTHOR(S):
+    Eric Yeh
+"""
+
+import os
+import random
+import shutil
+import tempfile
+
+from aligners import NumpyAligner, reverseComplement
+from generate_alignments import ConsensusSequence, explainHits, splitRecords
+from hit_store import parseScFile, HEADER_REGEX
+from testing_util import randomSeq, writeConsensus, writeBin
+
+MATRIX_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "../data/matrices/14p41g.matrix")
+
+def test_numpyAligner():
+    random.seed(5)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        cons = randomSeq(200)
+        fa_file = writeConsensus(tmp_dir, cons)
+        # an exact copy on the forward strand and a copy of bases
+        # 21-180 with a 3 base deletion on the reverse strand
+        copy = cons[20:100] + cons[103:180]
+        batch = (randomSeq(500) + cons + randomSeq(400) +
+                reverseComplement(copy) + randomSeq(300))
+        bin_file = writeBin(tmp_dir, [("chr1:1001-" +
+                        str(1000 + len(batch)), batch)])
+        sc_file = os.path.join(tmp_dir, "DF0000001_14p41g.sc")
+        with open(sc_file, "w") as f:
+            assert NumpyAligner().align(ConsensusSequence(fa_file),
+                    bin_file, MATRIX_FILE, f, None) == 0
+
+        hits = parseScFile(sc_file).hits
+        best = hits[:2]
+        assert list(best["strand"]) == [1, -1]
+        assert (best["start"][0], best["end"][0]) == (1501, 1700)
+        assert (best["cons_start"][0], best["cons_end"][0]) == (1, 200)
+        assert best["div"][0] == 0.0
+        assert (best["start"][1], best["end"][1]) == (2101, 2257)
+        assert (best["cons_start"][1], best["cons_end"][1]) == (21, 180)
+        assert best["cons_left"][1] == 20
+        assert best["dels"][1] > 0
+        assert all(hits["score"][2:] < best["score"][1])
+    finally:
+        shutil.rmtree(tmp_dir)
+
+def test_explainHits():
+    random.seed(6)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        cons = randomSeq(150)
+        cs = ConsensusSequence(writeConsensus(tmp_dir, cons))
+        batches = []
+        for i, start in enumerate([1001, 3001]):
+            batch = randomSeq(300 + 200 * i) + cons + randomSeq(300)
+            if i == 1:
+                batch = reverseComplement(batch)
+            batches.append(("chr2:" + str(start) + "-" +
+                            str(start + len(batch) - 1), batch))
+        bin_file = writeBin(tmp_dir, batches)
+        full = os.path.join(tmp_dir, "full.sc")
+        with open(full, "w") as f:
+            NumpyAligner().align(cs, bin_file, MATRIX_FILE, f, None)
+        score_only = os.path.join(tmp_dir, "DF0000001_14p41g.sc")
+        with open(score_only, "w") as f:
+            NumpyAligner(alignments=False).align(cs, bin_file, MATRIX_FILE,
+                    f, None)
+        with open(score_only, "r") as f:
+            assert all([HEADER_REGEX.match(line) for line in f])
+
+        # the two best hits, aligned again on their region only, are
+        # the hits of the full run, with their alignment text
+        store = parseScFile(score_only)
+        best = store.hits[:2]
+        out = os.path.join(tmp_dir, "explain.sc")
+        with open(out, "w") as f:
+            assert explainHits(cs, best, store.seqs, bin_file, MATRIX_FILE,
+                    NumpyAligner(alignments=False), f) == 2
+        with open(out, "r") as f:
+            records = splitRecords(f.read())
+        assert len(records) == 2
+        assert all([r.count("DF0000001") > 1 for mo, r in records])
+        fields = ["score", "div", "start", "end", "strand", "cons_start",
+                "cons_end"]
+        assert (parseScFile(out).hits[fields] ==
+                parseScFile(full).hits[:2][fields]).all()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    test_numpyAligner()
+    test_explainHits()
+    print("Tests finished for aligners.py")
@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+test_annotate.py
+
+A quick test suite for annotate.py. Can simply be run as:
+
+$ python test_annotate.py
+
+AUTHOR(S):
+    Eric Yeh
+"""
+
+import io
+import os
+import shutil
+import tempfile
+
+from annotate import annotate, OverlapResolver, PURGE_MIN
+
+# (family, matrix, score, batch, start, end)
+HITS = [
+    ("DF1", "14p41g", 300, "chr1:1-2000", 101, 200),
+    ("DF1", "14p41g", 210, "chr1:1-2000", 501, 600),
+    ("DF1", "14p41g", 150, "chr1:1-2000", 801, 900),
+    ("DF1", "14p41g", 400, "chr1:1-2000", 1101, 1200),
+    ("DF1", "14p43g", 240, "chr2:1-2000", 1, 100),
+    ("DF2", "14p41g", 280, "chr1:1-2000", 151, 300),
+    ("DF2", "14p41g", 230, "chr1:1-2000", 1001, 1400),
+    ("DF3", "14p41g", 500, "chr1:1-2000", 1, 2000),
+]
+THRESHOLDS = {"DF1": {"14p41g": 200, "14p43g": 250}, "DF2": {"14p41g": 220}}
+
+def readBed(path):
+    with open(path, "r") as f:
+        return [tuple(line.split("\t")[:4]) for line in f]
+
+def test_annotate():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        hits_root = os.path.join(tmp_dir, "genomic_hits")
+        thresholds_dir = os.path.join(tmp_dir, "thresholds")
+        os.makedirs(thresholds_dir)
+        for family, matrix, score, batch, start, end in HITS:
+            os.makedirs(os.path.join(hits_root, family), exist_ok=True)
+            sc_file = os.path.join(hits_root, family,
+                                family + "_" + matrix + ".sc")
+            with open(sc_file, "a") as f:
+                f.write("%5d 10.00 0.00 0.00 %s %d %d (100) %s 1 %d (0)\n" %
+                        (score, batch, start, end, family, end - start + 1))
+        # DF3 has no thresholds, and is left out
+        for family in THRESHOLDS:
+            with open(os.path.join(thresholds_dir, family + ".thresh"),
+                    "w") as f:
+                for matrix, final in sorted(THRESHOLDS[family].items()):
+                    f.write("\t".join([family, matrix, "0", "0",
+                                    str(final)]) + "\n")
+
+        output_dir = os.path.join(tmp_dir, "annotation")
+        # a few hits per run, so they go through the external merge
+        result = annotate(hits_root, thresholds_dir, output_dir, 225, 2)
+        # each base goes to the best hit covering it, across families
+        assert readBed(os.path.join(output_dir, "annotation.family.bed")) == [
+                ("chr1", "100", "200", "DF1"), ("chr1", "200", "300", "DF2"),
+                ("chr1", "500", "600", "DF1"), ("chr1", "1000", "1100", "DF2"),
+                ("chr1", "1100", "1200", "DF1"),
+                ("chr1", "1200", "1400", "DF2")]
+        assert readBed(os.path.join(output_dir, "annotation.fixed.bed")) == [
+                ("chr1", "100", "200", "DF1"), ("chr1", "200", "300", "DF2"),
+                ("chr1", "1000", "1100", "DF2"),
+                ("chr1", "1100", "1200", "DF1"),
+                ("chr1", "1200", "1400", "DF2"), ("chr2", "0", "100", "DF1")]
+        assert result["families"] == 2
+        assert result["family"] == {"hits": 5, "bases": 700}
+        assert result["fixed"] == {"hits": 5, "bases": 700}
+        assert result["shared_bases"] == 600
+        with open(os.path.join(output_dir, "annotation_summary.txt")) as f:
+            assert f.read() == "DF1\t3\t3\t300\t300\nDF2\t2\t2\t400\t400\n"
+        assert sorted(os.listdir(output_dir)) == ["annotation.family.bed",
+                "annotation.fixed.bed", "annotation_summary.txt"]
+    finally:
+        shutil.rmtree(tmp_dir)
+
+def test_overlapResolver():
+    out = io.StringIO()
+    resolver = OverlapResolver(out)
+    # a long hit hides the short, lower scoring hits under it
+    resolver.add(("chr1", 0, 100000, 500, "DF1", 1))
+    largest = 0
+    for start in range(10, 90000, 10):
+        resolver.add(("chr1", start, start + 5, 100, "DF2", 1))
+        largest = max(largest, len(resolver.active))
+    resolver.add(("chr1", 99000, 100050, 300, "DF2", -1))
+    # the ended hits are purged, not kept until the long hit ends
+    assert largest <= 2 * PURGE_MIN
+    resolver.close()
+    assert out.getvalue().splitlines() == ["chr1\t0\t100000\tDF1\t500\t+",
+                                        "chr1\t100000\t100050\tDF2\t300\t-"]
+    assert resolver.covered == {"DF1": 100000, "DF2": 50}
+
+if __name__ == '__main__':
+    test_annotate()
+    test_overlapResolver()
+    print("Tests finished for annotate.py")
@@ -0,0 +1,59 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+test_dedup_hits.py
+
+A quick test suite for dedup_hits.py. Can simply be run as:
+
+$ python test_dedup_hits.py
+
+AUTHOR(S):
+    Eric Yeh
+"""
+
+import os
+import shutil
+import tempfile
+
+from dedup_hits import duplicateMask, dedupHits
+from hit_store import loadHits
+from score_thresholds import readScoresFromFile
+
+SC_LINES = [
+    # found in both batches of the overlap: the lower score is dropped
+    "  300 10.00 0.00 0.00 chr1:1-60000 58101 58200 (1800) DF0000001 1 100 (0)\n",
+    "  280 10.00 0.00 0.00 chr1:58001-118000 101 200 (59800) DF0000001 1 100 (0)\n",
+    # identical hits: the one of the later batch is dropped
+    "  250 10.00 0.00 0.00 chr1:58001-118000 1001 1100 (58900) DF0000001 101 200 (0)\n",
+    "  250 10.00 0.00 0.00 chr1:1-60000 59001 59100 (900) DF0000001 101 200 (0)\n",
+    # the same bases on the other strand, or another part of the
+    # consensus, are distinct hits
+    "  200 10.00 0.00 0.00 chr1:58001-118000 101 200 (59800) C DF0000001 (0) 100 1\n",
+    "  150 10.00 0.00 0.00 chr1:58001-118000 101 200 (59800) DF0000001 301 400 (0)\n",
+    # overlapping hits of one batch are distinct hits
+    "  120 10.00 0.00 0.00 chr2:1-60000 150 250 (59750) DF0000001 50 150 (0)\n",
+    "  100 10.00 0.00 0.00 chr2:1-60000 101 200 (59800) DF0000001 1 100 (0)\n",
+]
+
+def test_dedupHits():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        sc_file = os.path.join(tmp_dir, "DF0000001_14p41g.sc")
+        with open(sc_file, "w") as f:
+            f.writelines(SC_LINES)
+        hits = loadHits(sc_file).hits
+        assert list(duplicateMask(hits)) == [True, False, False, True, True,
+                                            True, True, True]
+        kept = dedupHits(sc_file)
+        assert list(kept["batch_start"][kept["score"] == 250]) == [1]
+        assert list(readScoresFromFile(sc_file)) == [300, 250, 200, 150,
+                                                    120, 100]
+        assert list(readScoresFromFile(sc_file, dedup=False)) == [300, 280,
+                                            250, 250, 200, 150, 120, 100]
+        assert list(duplicateMask(hits[:1])) == [True]
+    finally:
+        shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    test_dedupHits()
+    print("Tests finished for dedup_hits.py")
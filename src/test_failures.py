@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+test_failures.py
+
+A quick test suite for failures.py. Can simply be run as:
+
+$ python test_failures.py
+
+AUTHOR(S):
+    Eric Yeh
+"""
+
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+
+from aligners import Aligner, NumpyAligner
+from generate_alignments import (ConsensusSequence, runRMBlast,
+        generateAlignments)
+from instrument import runChild
+from sc_io import findScFile, openSc
+from failures import (setRetryPolicy, classifyFailure, readLedger,
+        pendingFailures, requeueBins, RETRIES_ENV, TIMEOUT_ENV, BACKOFF_ENV)
+from testing_util import chdirSrc, randomSeq, writeConsensus, writeBin
+
+class FlakyAligner(Aligner):
+    # exits with the given statuses, then aligns with the numpy aligner
+    name = "flaky"
+
+    def __init__(self, statuses):
+        self.statuses = statuses
+
+    def align(self, consensus, bin_file, matrix_file, stdout, stderr,
+            st=None):
+        stdout.write("  999 0.00 0.00 0.00 partial 1 2 (3) DF0000001 1 2 (3)\n")
+        if len(self.statuses) > 0:
+            return self.statuses.pop(0)
+        return NumpyAligner().align(consensus, bin_file, matrix_file, stdout,
+                                    stderr, st)
+
+def test_retries():
+    random.seed(9)
+    cwd = chdirSrc()
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        setRetryPolicy(retries=2, backoff=0)
+        cons = randomSeq(150)
+        cs = ConsensusSequence(writeConsensus(tmp_dir, cons))
+        bins_dir = os.path.join(tmp_dir, "bins")
+        os.mkdir(bins_dir)
+        bin_file = writeBin(bins_dir, [("chr1:1-750", randomSeq(300) + cons +
+                                        randomSeq(300))])
+        output_dir = os.path.join(tmp_dir, "genomic_hits")
+        os.mkdir(output_dir)
+        ledger = os.path.join(tmp_dir, "failures.jsonl")
+        sc_file = os.path.join(output_dir, "DF0000001", "DF0000001_14p41g.sc")
+
+        # killed once, then recovered by a retry
+        assert runRMBlast(cs, bin_file, output_dir, FlakyAligner([-9]),
+                minscore=None) == None
+        records = readLedger(ledger)
+        assert [(r["failure"], r["attempt"], r["final"])
+                for r in records] == [("oom", 1, False)]
+        assert len(pendingFailures(ledger)) == 0
+
+        # failing every attempt keeps the alignments of the last good run
+        with openSc(findScFile(sc_file)) as f:
+            good = f.read()
+        error = runRMBlast(cs, bin_file, output_dir, FlakyAligner([1, 1, 1]))
+        assert error.startswith("exit:")
+        assert [r["attempt"] for r in readLedger(ledger)[1:]] == [1, 2, 3]
+        assert readLedger(ledger)[-1]["final"]
+        assert os.listdir(os.path.dirname(sc_file)) == [
+                os.path.basename(findScFile(sc_file))]
+        with openSc(findScFile(sc_file)) as f:
+            assert f.read() == good
+        bins = requeueBins(ledger)
+        assert bins == {"DF0000001": {"genomic": set(["bin41.fa"])}}
+
+        # requeuing only the failed bin clears the failure
+        time.sleep(0.01)
+        assert generateAlignments(cs, bins_dir, output_dir, FlakyAligner([]),
+                bins=bins["DF0000001"]["genomic"]) == []
+        assert len(pendingFailures(ledger)) == 0
+        with openSc(findScFile(sc_file)) as f:
+            assert "partial" in f.readline()
+
+        # timeouts kill the aligner process
+        try:
+            runChild(["sleep", "10"], timeout=0.2)
+            assert False
+        except subprocess.TimeoutExpired as e:
+            assert classifyFailure(e) == ("timeout", None)
+        # commands done in time keep their exit status
+        assert runChild(["sh", "-c", "exit 3"], timeout=5) == 3
+        assert classifyFailure(subprocess.CalledProcessError(-15, "rbn")) == \
+                ("signal", -15)
+        assert classifyFailure(IOError())[0] == "error"
+    finally:
+        for env in [RETRIES_ENV, TIMEOUT_ENV, BACKOFF_ENV]:
+            os.environ.pop(env, None)
+        os.chdir(cwd)
+        shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    test_retries()
+    print("Tests finished for failures.py")
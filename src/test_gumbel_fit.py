@@ -0,0 +1,53 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+test_gumbel_fit.py
+
+A quick test suite for gumbel_fit.py. Can simply be run as:
+
+$ python test_gumbel_fit.py
+
+AUTHOR(S):
+    Eric Yeh
+"""
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from gumbel_fit import fitMatrices, readGumbelParams
+from testing_util import chdirSrc
+
+def test_fitMatrices():
+    cwd = chdirSrc()
+    rng = np.random.default_rng(3)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        # chance hits of one family against bin 41, none elsewhere
+        hits_dir = os.path.join(tmp_dir, "benchmark_hits")
+        os.makedirs(os.path.join(hits_dir, "DF0000001"))
+        scores = (50 + rng.exponential(1 / 0.2, 1000)).astype(np.int64)
+        with open(os.path.join(hits_dir, "DF0000001",
+                    "DF0000001_14p41g.sc"), "w") as f:
+            for i, score in enumerate(scores):
+                f.write("%5d 10.00 0.00 0.00 chr1:1-1000000 %d %d "
+                        "(100) DF0000001 1 100 (0)\n" %
+                        (score, 1000 * i + 1, 1000 * i + 100))
+        params_file = os.path.join(tmp_dir, "gumbel_params.txt")
+
+        # every GC matrix of the bins, leaving out identity, at...
+        fitted = fitMatrices(hits_dir, subject_size={41: 1000000, 43: 1000},
+                        params_file=params_file, processes=2)
+        assert list(fitted) == ["14p41g"]
+        assert abs(fitted["14p41g"]["lambda"] - 0.2) < 0.05
+        params = readGumbelParams(params_file)
+        assert [p["matrix"] for p in params.values()] == ["14p41g"]
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    test_fitMatrices()
+    print("Tests finished for gumbel_fit.py")
@@ -0,0 +1,102 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+test_hit_store.py
+
+A quick test suite for hit_store.py. Can simply be run as:
+
+$ python test_hit_store.py
+
+AUTHOR(S):
+    Eric Yeh
+"""
+
+import os
+import shutil
+import tempfile
+
+from hit_store import loadHits, isCurrent
+from instrument import runChild
+from sc_io import ScWriter, scPath, findScFile, zstandard
+
+SC_LINES = [
+    "  239 13.93 0.00 1.61 chr1:10001-70000 10469 10592 (59408) DF0000002 1 124 (187)\n",
+    "\n",
+    "  chr1:10001-70000  10469 GGCCGGGCGCGG-TGGCTCA 10487\n",
+    "\n",
+    "  301 8.20 1.10 0.50 chr2:58001-118000 5 300 (59700) C DF0000002 (11) 300 1\n",
+]
+FAILED_RUN = "rmblast exception: <class 'subprocess.CalledProcessError'>"
+
+
+def test_loadHits():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        sc_file = os.path.join(tmp_dir, "DF0000002_14p41g.sc")
+        with open(sc_file, "w") as f:
+            f.writelines(SC_LINES)
+        for i in range(2):
+            # parsed the first time, memory-mapped the second
+            store = loadHits(sc_file)
+            assert isCurrent(sc_file)
+            assert len(store) == 2
+            assert list(store.scores()) == [239, 301]
+            assert store.seqs == ["chr1", "chr2"]
+            h = store.hits
+            assert (h["start"][0], h["end"][0]) == (20469, 20592)
+            assert (h["start"][1], h["end"][1]) == (58005, 58300)
+            assert list(h["strand"]) == [1, -1]
+            assert (h["cons_start"][0], h["cons_end"][0]) == (1, 124)
+            assert (h["cons_start"][1], h["cons_end"][1]) == (1, 300)
+            assert list(h["cons_left"]) == [187, 11]
+
+        # the partial output of a failed run is refused, even when it
+        # replaced a file whose store is already built
+        failed = os.path.join(tmp_dir, "DF0000002_21p41g.sc")
+        with open(failed, "w") as f:
+            f.writelines(SC_LINES + [FAILED_RUN])
+        try:
+            loadHits(failed)
+            assert False
+        except ValueError:
+            pass
+        mtime = os.path.getmtime(sc_file)
+        shutil.copy(failed, sc_file)
+        os.utime(sc_file, (mtime, mtime))
+        assert not isCurrent(sc_file)
+        try:
+            loadHits(sc_file)
+            assert False
+        except ValueError:
+            pass
+    finally:
+        shutil.rmtree(tmp_dir)
+
+def test_compressedHits():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        plain = os.path.join(tmp_dir, "plain.sc")
+        with open(plain, "w") as f:
+            f.writelines(SC_LINES)
+        compressions = ["gzip"]
+        if zstandard != None:
+            compressions.append("zstd")
+        for compression in compressions:
+            sc_file = scPath(os.path.join(tmp_dir, "DF0000002_14p41g.sc"),
+                            compression)
+            # streamed from the stdout pipe of a child process
+            with ScWriter(sc_file, compression) as out:
+                assert runChild(["cat", plain], out) == 0
+            assert findScFile(os.path.join(tmp_dir,
+                        "DF0000002_14p41g.sc")) == sc_file
+            store = loadHits(sc_file)
+            assert list(store.scores()) == [239, 301]
+            assert store.seqs == ["chr1", "chr2"]
+            os.remove(sc_file)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    test_loadHits()
+    test_compressedHits()
+    print("Tests finished for hit_store.py")
@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+test_instrument.py
+
+A quick test suite for instrument.py. Can simply be run as:
+
+$ python test_instrument.py
+
+AUTHOR(S):
+    Eric Yeh
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+from instrument import (stage, runChild, readRecords, summarize,
+        METRICS_ENV)
+
+class FailingWriter:
+    """
+    Output writer whose copy fails after reading the pid the command
+    prints first.
+    """
+    pipe = True
+
+    def copyFrom(self, f):
+        self.pid = int(f.readline())
+        raise IOError("disk full")
+
+def test_stage():
+    d = tempfile.mkdtemp()
+    old = os.environ.get(METRICS_ENV)
+    try:
+        log = os.path.join(d, "metrics.jsonl")
+        os.environ[METRICS_ENV] = log
+        with stage("runRMBlast", family="DF0000001", bin="bin41.fa",
+                kind="genomic") as st:
+            assert runChild(["sh", "-c", "exit 0"], st=st) == 0
+            assert runChild(["sh", "-c", "exit 3"], st=st) == 3
+            st.set(hits=7)
+        try:
+            with stage("generateScoreThreshold", family="DF0000001"):
+                raise ValueError("no hits")
+        except ValueError:
+            pass
+        records = readRecords([log])
+        assert len(records) == 2
+        assert records[0]["stage"] == "runRMBlast"
+        assert records[0]["hits"] == 7 and records[0]["pid"] == os.getpid()
+        # one rusage per child process
+        for key in ["wall", "cpu", "child_user", "child_sys",
+                "child_maxrss_mb"]:
+            assert records[0][key] >= 0
+        assert records[0]["child_maxrss_mb"] > 0
+        assert records[1]["error"] == "ValueError"
+        assert "child_user" not in records[1]
+        summary = summarize(records)
+        assert summary["stages"]["generateScoreThreshold"]["errors"] == 1
+        assert summary["families"][0][0] == "DF0000001"
+
+        # nothing is written without a metrics log
+        del os.environ[METRICS_ENV]
+        with stage("runRMBlast"):
+            pass
+        assert len(readRecords([log])) == 2
+    finally:
+        if old == None:
+            os.environ.pop(METRICS_ENV, None)
+        else:
+            os.environ[METRICS_ENV] = old
+        shutil.rmtree(d)
+
+def test_runChild():
+    assert runChild(["sh", "-c", "exit 3"], timeout=5) == 3
+    assert runChild(["sh", "-c", "kill -9 $$"]) == -9
+
+    # the command and the processes it started are killed at the
+    # timeout
+    started = time.time()
+    try:
+        runChild(["sh", "-c", "sleep 10; sleep 10"], timeout=0.2)
+        assert False, "the command should have timed out"
+    except subprocess.TimeoutExpired:
+        pass
+    assert time.time() - started < 5
+
+    # a failed copy of the output kills and reaps the command, and
+    # stops the timer
+    threads = threading.active_count()
+    for timeout in [None, 30]:
+        writer = FailingWriter()
+        try:
+            runChild(["sh", "-c", "echo $$; sleep 10"], writer,
+                    timeout=timeout)
+            assert False, "the copy should have failed"
+        except IOError:
+            pass
+        try:
+            os.kill(writer.pid, 0)
+            assert False, "the command should have been reaped"
+        except ProcessLookupError:
+            pass
+    # a cancelled timer ends at once, a live one would last 30s
+    for i in range(100):
+        if threading.active_count() == threads:
+            break
+        time.sleep(0.01)
+    assert threading.active_count() == threads
+
+if __name__ == '__main__':
+    test_stage()
+    test_runChild()
+    print("Tests finished for instrument.py")
@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+test_kmer_index.py
+
+A quick test suite for kmer_index.py. Can simply be run as:
+
+$ python test_kmer_index.py
+
+AUTHOR(S):
+    Eric Yeh
+"""
+
+import os
+import random
+import shutil
+import tempfile
+
+from aligners import NumpyAligner, reverseComplement
+from generate_alignments import ConsensusSequence
+from kmer_index import (buildIndex, KmerPrefilter, validatePrefilter,
+        readRecords)
+from testing_util import chdirSrc, randomSeq, writeConsensus, writeBin
+
+def mutate(seq, rate):
+    return "".join([random.choice("ACGT") if random.random() < rate else c
+                    for c in seq])
+
+def test_prefilter():
+    random.seed(7)
+    cwd = chdirSrc()
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        cons = randomSeq(300)
+        fa_file = writeConsensus(tmp_dir, cons)
+        bins_dir = os.path.join(tmp_dir, "bins")
+        os.mkdir(bins_dir)
+        # copies of the consensus in batches 3 (forward, 10% mutated)
+        # and 6 (reverse strand)
+        batches = []
+        for i in range(8):
+            batch = randomSeq(1500)
+            if i == 3:
+                batch = batch[:500] + mutate(cons, 0.1) + batch[800:]
+            elif i == 6:
+                batch = batch[:900] + reverseComplement(cons) + batch[1200:]
+            start = 1500 * i + 1
+            batches.append(("chr1:" + str(start) + "-" + str(start + 1499),
+                            batch))
+        bin_file = writeBin(bins_dir, batches, row_length=60)
+        buildIndex(bin_file)
+
+        prefilter = KmerPrefilter()
+        assert list(prefilter.select(bin_file, cons)) == [3, 6]
+        with prefilter.subject(bin_file, cons) as (subject, selected, total):
+            assert (selected, total) == (2, 8)
+            names = [r[0] for r in readRecords(subject)]
+            assert names == ["chr1:4501-6000", "chr1:9001-10500"]
+        with prefilter.subject(bin_file, randomSeq(300)) as (subject,
+                selected, total):
+            assert subject == None and selected == 0
+
+        report = validatePrefilter(ConsensusSequence(fa_file), bins_dir,
+                        NumpyAligner(), prefilter, min_score=200)
+        assert [(matrix, hits, len(missing))
+                for matrix, hits, missing in report] == [("14p41g", 2, 0)]
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    test_prefilter()
+    print("Tests finished for kmer_index.py")
@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+test_pipeline_dag.py
+
+A quick test suite for pipeline_dag.py. Can simply be run as:
+
+$ python test_pipeline_dag.py
+
+AUTHOR(S):
+    Eric Yeh
+"""
+
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from pipeline_dag import Pipeline, Task, addBinTasks
+
+def upper(src, dst):
+    with open(src, "r") as f:
+        text = f.read()
+    with open(dst, "w") as f:
+        f.write(text.upper())
+
+def fail(src, dst):
+    with open(dst, "w") as f:
+        f.write("partial")
+    raise RuntimeError("failed on purpose")
+
+def buildPipeline(d, action=upper):
+    p = Pipeline(os.path.join(d, "state.json"))
+    a, b, c, e = [os.path.join(d, x) for x in ["a", "b", "c", "e"]]
+    p.add(Task("b", upper, (a, b), inputs=[a], outputs=[b]))
+    p.add(Task("c", action, (b, c), inputs=[b], outputs=[c]))
+    p.add(Task("e", upper, (c, e), inputs=[c], outputs=[e]))
+    return p
+
+def test_pipeline():
+    d = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(d, "a"), "w") as f:
+            f.write("acgt")
+        result = buildPipeline(d).run(cpus=2)
+        assert result["ran"] == ["b", "c", "e"]
+        with open(os.path.join(d, "c"), "r") as f:
+            assert f.read() == "ACGT"
+
+        # nothing to do, then a touched input with the same content
+        assert buildPipeline(d).run()["skipped"] == ["b", "c", "e"]
+        time.sleep(0.01)
+        os.utime(os.path.join(d, "a"))
+        assert buildPipeline(d).run()["skipped"] == ["b", "c", "e"]
+
+        # a changed input reruns its task; a failed task removes its
+        # output and blocks the tasks depending on it
+        time.sleep(0.01)
+        with open(os.path.join(d, "a"), "w") as f:
+            f.write("ttt")
+        result = buildPipeline(d, fail).run()
+        assert result["ran"] == ["b"] and result["failed"] == ["c"]
+        assert result["blocked"] == ["e"]
+        assert not os.path.exists(os.path.join(d, "c"))
+        assert buildPipeline(d).run()["ran"] == ["c", "e"]
+    finally:
+        shutil.rmtree(d)
+
+def test_binTask():
+    d = tempfile.mkdtemp()
+    try:
+        fa_file = os.path.join(d, "genome.fa")
+        rng = random.Random(1)
+        with open(fa_file, "w") as f:
+            f.write(">chr1\n")
+            for i in range(2500):
+                f.write("".join([rng.choice("ACGT") for j in range(60)]) + "\n")
+        bins_dir = os.path.join(d, "bins")
+        os.makedirs(bins_dir)
+        # a stale bin and its index, from an older genome
+        for stale in ["bin35.fa", "bin35.fa.kmers.npy", "bin_sizes.txt"]:
+            open(os.path.join(bins_dir, stale), "w").close()
+        sizes = []
+        for i in range(2):
+            p = Pipeline(os.path.join(d, "state.json"))
+            addBinTasks(p, [("genomic", fa_file, bins_dir)])
+            assert p.run(force=True)["ran"] == ["bin:genomic"]
+            sizes.append(dict([(b, os.path.getsize(os.path.join(bins_dir, b)))
+                            for b in os.listdir(bins_dir)]))
+        # rerunning does not append a second copy of the batches
+        assert sizes[0] == sizes[1]
+        with open(os.path.join(bins_dir, "bins.txt"), "r") as f:
+            bins = f.read().split()
+        assert sorted(sizes[1]) == sorted(bins + ["bins.txt"])
+        assert "bin35.fa" not in bins
+        assert p.tasks["bin:genomic"].outputs[1:] == [os.path.join(bins_dir,
+                                                        b) for b in bins]
+        assert not os.path.exists(bins_dir + ".tmp")
+    finally:
+        shutil.rmtree(d)
+
+if __name__ == '__main__':
+    test_pipeline()
+    test_binTask()
+    print("Tests finished for pipeline_dag.py")
@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+test_progress.py
+
+A quick test suite for progress.py. Can simply be run as:
+
+$ python test_progress.py
+
+AUTHOR(S):
+    Eric Yeh
+"""
+
+import os
+import shutil
+import tempfile
+import time
+
+from progress import Progress, readStatus, formatStatus, STATE_SUFFIX
+
+def worker(progress_dir, name):
+    # two workers of the same process, as if on two nodes
+    p = Progress(progress_dir)
+    p.path = os.path.join(progress_dir, name + STATE_SUFFIX)
+    p.plan_path = os.path.join(progress_dir, name + ".plan.json")
+    p.state["host"] = name
+    return p
+
+def test_readStatus():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        a = worker(tmp_dir, "a")
+        b = worker(tmp_dir, "b")
+        a.plan([("hg38:DF1", 1000), ("hg38:DF2", 1000), ("hg38:DF3", 1000),
+                ("hg38:DF4", 1000)])
+
+        a.unitStarted("hg38:DF1")
+        for i in range(4):
+            a.binStarted("DF1", "genomic", "bin4" + str(i) + ".fa")
+            a.binFinished("DF1", "genomic", "bin4" + str(i) + ".fa", 250)
+        a.unitFinished("hg38:DF1")
+        a.unitStarted("hg38:DF2")
+        a.binFinished("DF2", "genomic", "bin41.fa", 250)
+        a.binStarted("DF2", "genomic", "bin43.fa")
+
+        b.unitStarted("hg38:DF3")
+        b.binFinished("DF3", "genomic", "bin41.fa", 0, "failed")
+        b.unitFinished("hg38:DF3", "CalledProcessError()")
+
+        status = readStatus(tmp_dir)
+        assert (status["planned"], status["done"], status["running"],
+                status["failed"], status["pending"]) == (4, 1, 1, 1, 1)
+        # what is left of DF2, DF3 and DF4
+        assert status["remaining_bases"] == 750 + 1000 + 1000
+        assert status["bases_per_s"] > 0 and status["eta_s"] > 0
+        assert status["families_per_hour"] > 0
+        assert [u["unit"] for u in status["running_units"]] == ["hg38:DF2"]
+        assert status["running_units"][0]["bins"] == {
+                "genomic/bin43.fa": "running"}
+        assert status["failed_units"][0]["worker"].startswith("b:")
+        report = formatStatus(status)
+        assert "1 done" in report and "hg38:DF3" in report
+
+        # DF3 rerun by another worker: its latest state wins, and the
+        # first worker no longer counts toward the throughput once
+        # stale
+        b.unitStarted("hg38:DF3")
+        b.binFinished("DF3", "genomic", "bin41.fa", 1000)
+        b.unitFinished("hg38:DF3")
+        status = readStatus(tmp_dir, now=time.time() + 1000)
+        assert (status["done"], status["failed"]) == (2, 0)
+        assert [w["stale"] for w in status["workers"]] == [True, True]
+        assert status["bases_per_s"] == 0
+    finally:
+        shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    test_readStatus()
+    print("Tests finished for progress.py")
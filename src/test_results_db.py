@@ -0,0 +1,137 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+test_results_db.py
+
+A quick test suite for results_db.py. Can simply be run as:
+
+$ python test_results_db.py
+
+AUTHOR(S):
+    Eric Yeh
+"""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+
+from results_db import ResultsDB, connect, exportTsv, importTables
+
+THRESH_LINES = [
+    "DF0000001\t14p41g\t250.0\t240.0\t250.0\n",
+    "DF0000001\t25p53g\t230.0\t260.0\t260.0\t221.0\t239.0\n",
+    "DF0000002\t14p41g\t300.0\t280.0\t300.0\n",
+]
+
+def test_connect():
+    d = tempfile.mkdtemp()
+    try:
+        conn = connect(os.path.join(d, "results.db"))
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        tables = [r[0] for r in conn.execute("SELECT name FROM sqlite_master " +
+                                            "WHERE type = 'table'")]
+        for table in ["runs", "thresholds", "hit_counts"]:
+            assert table in tables
+        conn.close()
+    finally:
+        shutil.rmtree(d)
+
+def test_flush():
+    d = tempfile.mkdtemp()
+    try:
+        path = os.path.join(d, "results.db")
+        db = ResultsDB(path, batch_size=2)
+        run_id = db.startRun(command="test", params={"a": 1})
+        db.addThreshold(("DF0000001", "14p41g", 250.0, 240.0, 250.0), 10, 2)
+        conn = connect(path)
+        assert conn.execute("SELECT COUNT(*) FROM thresholds").fetchone()[0] == 0
+        # a full batch is written in one transaction
+        db.addThreshold(("DF0000001", "25p53g", 230.0, 260.0, 260.0))
+        assert db.thresholds == [] and db.hit_counts == []
+        rows = conn.execute("SELECT consensus, div, gc, final, run_id FROM " +
+                    "thresholds ORDER BY matrix").fetchall()
+        assert rows == [("DF0000001", 14, 41, 250.0, run_id),
+                        ("DF0000001", 25, 53, 260.0, run_id)]
+        assert conn.execute("SELECT kind, hits FROM hit_counts ORDER BY " +
+                    "kind").fetchall() == [("benchmark", 2), ("genomic", 10)]
+
+        # a failed batch is rolled back and kept in the buffer
+        db.addThreshold(("DF0000002", "14p41g", 300.0, 280.0, 300.0))
+        db.thresholds.append((None,) * 11)
+        try:
+            db.flush()
+            assert False, "flush of a NULL consensus should fail"
+        except sqlite3.IntegrityError:
+            pass
+        assert not db.conn.in_transaction
+        assert len(db.thresholds) == 2
+        assert conn.execute("SELECT COUNT(*) FROM thresholds").fetchone()[0] == 2
+        db.thresholds.pop()
+        db.finishRun()
+        db.close()
+        assert conn.execute("SELECT COUNT(*) FROM thresholds").fetchone()[0] == 3
+        assert conn.execute("SELECT finished FROM runs WHERE run_id = ?",
+                    (run_id,)).fetchone()[0] != None
+        conn.close()
+    finally:
+        shutil.rmtree(d)
+
+def test_exportImport():
+    d = tempfile.mkdtemp()
+    try:
+        path = os.path.join(d, "results.db")
+        table = os.path.join(d, "thresholds.txt")
+        with open(table, "w") as f:
+            f.writelines(THRESH_LINES)
+        assert importTables([table], path) == 3
+        exported = os.path.join(d, "exported.txt")
+        assert exportTsv(path, exported) == 3
+        with open(exported, "r") as f:
+            assert f.readlines() == THRESH_LINES
+        # importing again replaces the rows
+        assert importTables([exported], path) == 3
+        assert exportTsv(path, exported) == 3
+        conn = connect(path)
+        assert conn.execute("SELECT COUNT(*) FROM runs").fetchone()[0] == 2
+        conn.close()
+    finally:
+        shutil.rmtree(d)
+
+def test_upgrade():
+    d = tempfile.mkdtemp()
+    try:
+        path = os.path.join(d, "results.db")
+        # a database of the first version of the schema
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE thresholds (consensus TEXT NOT NULL, " +
+                "matrix TEXT NOT NULL, div INTEGER, gc INTEGER, empirical " +
+                "REAL, theoretical REAL, final REAL, run_id INTEGER, updated " +
+                "REAL, PRIMARY KEY (consensus, matrix))")
+        conn.execute("INSERT INTO thresholds VALUES ('DF0000001', '14p41g', " +
+                "14, 41, 250.0, 240.0, 250.0, NULL, 0)")
+        conn.commit()
+        conn.close()
+
+        with ResultsDB(path) as db:
+            db.addThreshold(("DF0000002", "14p41g", 230.0, 260.0, 260.0,
+                            221.0, 239.0))
+        conn = connect(path)
+        columns = [r[1] for r in conn.execute("PRAGMA table_info(thresholds)")]
+        assert columns[-2:] == ["empirical_low", "empirical_high"]
+        conn.close()
+        exported = os.path.join(d, "exported.txt")
+        assert exportTsv(path, exported) == 2
+        with open(exported, "r") as f:
+            assert f.readlines() == [
+                "DF0000001\t14p41g\t250.0\t240.0\t250.0\n",
+                "DF0000002\t14p41g\t230.0\t260.0\t260.0\t221.0\t239.0\n"]
+    finally:
+        shutil.rmtree(d)
+
+if __name__ == '__main__':
+    test_connect()
+    test_flush()
+    test_exportImport()
+    test_upgrade()
+    print("Tests finished for results_db.py")
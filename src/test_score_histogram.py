@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+test_score_histogram.py
+
+A quick test suite for score_histogram.py. Can simply be run as:
+
+$ python test_score_histogram.py
+
+AUTHOR(S):
+    Eric Yeh
+"""
+
+import numpy as np
+
+from score_histogram import (histogramFromScores, histogramFromDict,
+        mergeHistograms, empiricalThreshold, bootstrapThresholds,
+        confidenceInterval)
+from score_thresholds import empiricalFDRCalculation, FDR_THRESHOLD
+
+def test_mergeHistograms():
+    rng = np.random.default_rng(1)
+    scores = rng.integers(20, 400, 5000)
+    shards = [histogramFromScores(s) for s in np.array_split(scores, 4)]
+    merged = mergeHistograms(shards)
+    assert len(merged) == len(scores)
+    assert list(merged.expand()) == sorted(scores.tolist(), reverse=True)
+    assert list(histogramFromDict(merged.toDict()).expand()) == \
+            list(merged.expand())
+
+def test_empiricalThreshold():
+    rng = np.random.default_rng(2)
+    checked = 0
+    for i in range(500):
+        genomic = np.sort(rng.integers(20, 60 + i, rng.integers(1, 3000)))[::-1]
+        benchmark = np.sort(rng.integers(20, 40 + i // 2,
+                        rng.integers(1, 30)))[::-1]
+        try:
+            expected = empiricalFDRCalculation(genomic, benchmark)
+        except IndexError:
+            continue
+        assert empiricalThreshold(histogramFromScores(genomic),
+                histogramFromScores(benchmark), FDR_THRESHOLD) == expected
+        checked += 1
+    assert checked > 100
+
+def test_bootstrapThresholds():
+    rng = np.random.default_rng(3)
+    genomic = histogramFromScores(rng.integers(20, 400, 5000))
+    benchmark = histogramFromScores(rng.integers(20, 60, 200))
+    thresholds = bootstrapThresholds(genomic, benchmark, FDR_THRESHOLD, 100,
+                    np.random.default_rng(4), chunk=32)
+    assert len(thresholds) == 100
+    assert thresholds.min() > 20 and thresholds.max() < 400
+
+    # the same replicates, drawn as hits and walked one by one
+    draws = np.random.default_rng(4)
+    scores = np.arange(20, 400)
+    g = genomic.over(20, 399)
+    b = benchmark.over(20, 399)
+    for start in range(0, 100, 32):
+        size = min(32, 100 - start)
+        g_draws = draws.multinomial(len(genomic), g / len(genomic), size=size)
+        b_draws = draws.multinomial(len(benchmark), b / len(benchmark),
+                        size=size)
+        for i in range(size):
+            genomic_hits = np.repeat(scores, g_draws[i])[::-1]
+            benchmark_hits = np.repeat(scores, b_draws[i])[::-1]
+            try:
+                expected = empiricalFDRCalculation(genomic_hits,
+                                benchmark_hits)
+            except IndexError:
+                expected = genomic_hits[-1] + 0.05
+            assert thresholds[start + i] == expected
+
+    # no genomic hits to resample
+    empty = histogramFromScores([])
+    assert np.isnan(bootstrapThresholds(empty, benchmark, FDR_THRESHOLD, 10,
+                        np.random.default_rng(4))).all()
+    assert np.isnan(confidenceInterval(bootstrapThresholds(empty, empty,
+                        FDR_THRESHOLD, 10, np.random.default_rng(4)),
+                        0.95)).all()
+
+if __name__ == '__main__':
+    test_mergeHistograms()
+    test_empiricalThreshold()
+    test_bootstrapThresholds()
+    print("Tests finished for score_histogram.py")
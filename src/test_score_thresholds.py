@@ -0,0 +1,109 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+test_score_thresholds.py
+
+A quick test suite for score_thresholds.py. Can simply be run as:
+
+$ python test_score_thresholds.py
+
+AUTHOR(S):
+    Eric Yeh
+"""
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from score_histogram import histogramFromScores
+from score_thresholds import (adaptiveMinScore, batchScoreThresholds,
+        theoreticalFloor, gumbelParams, empiricalHistogramCalculation,
+        theoreticalFDRCalculation, FDR_THEORY_TARGET, MAX_E_TARGET)
+from testing_util import chdirSrc
+
+MATRIX = "14p41g"
+QUERY_SIZE = 300
+SUBJECT_SIZE = 3000000
+
+def noiseScores(rng, lam, log_kmn, low=50):
+    # chance hits: Kmn * e^(-lambda * S) of them score at least S
+    n = rng.poisson(np.exp(log_kmn - lam * low))
+    return (low + rng.exponential(1 / lam, n)).astype(np.int64)
+
+def finalThreshold(genomic, benchmark, floor_only=True):
+    g = histogramFromScores(genomic)
+    b = histogramFromScores(benchmark)
+    return max(empiricalHistogramCalculation(g, b),
+            theoreticalFDRCalculation(g, b, MATRIX, QUERY_SIZE,
+                SUBJECT_SIZE, floor_only))
+
+def test_adaptiveMinScore():
+    cwd = chdirSrc()
+    try:
+        rng = np.random.default_rng(8)
+        params = gumbelParams(MATRIX)
+        lam = params["lambda"]
+        log_kmn = (np.log(params["k"]) + np.log(QUERY_SIZE) +
+                np.log(SUBJECT_SIZE))
+        floor = theoreticalFloor(MATRIX, QUERY_SIZE, SUBJECT_SIZE)
+        minscore = adaptiveMinScore(MATRIX, QUERY_SIZE, SUBJECT_SIZE, 20)
+        assert minscore == int(np.floor(floor)) - 20 and minscore > 50
+        assert adaptiveMinScore(MATRIX, QUERY_SIZE, 1000, 20) == 50
+
+        for true_hits in [100, 3000, 150000]:
+            genomic = np.concatenate((noiseScores(rng, lam, log_kmn),
+                            rng.integers(100, 400, true_hits)))
+            benchmark = noiseScores(rng, lam, log_kmn)
+            full = finalThreshold(genomic, benchmark)
+            cut = finalThreshold(genomic[genomic >= minscore],
+                            benchmark[benchmark >= minscore])
+            assert full >= floor and cut >= floor
+            # the hits under the minscore never count towards the threshold
+            assert cut == full
+            # without floor_only, every hit counts
+            target = max(len(genomic) - len(benchmark), 0) * FDR_THEORY_TARGET
+            if target == 0 or target > MAX_E_TARGET:
+                target = MAX_E_TARGET
+            assert np.isclose(theoreticalFDRCalculation(genomic, benchmark,
+                                MATRIX, QUERY_SIZE, SUBJECT_SIZE),
+                            (log_kmn - np.log(target)) / lam)
+    finally:
+        os.chdir(cwd)
+
+def test_batchScoreThresholds():
+    cwd = chdirSrc()
+    d = tempfile.mkdtemp()
+    try:
+        roots = [os.path.join(d, kind) for kind in ["genomic", "benchmark"]]
+        for family in ["DF0000001", "DF0000002"]:
+            for root in roots:
+                os.makedirs(os.path.join(root, family))
+                if family == "DF0000002" and root == roots[1]:
+                    # no benchmark alignments: the family fails
+                    continue
+                with open(os.path.join(root, family, family + "_" +
+                        MATRIX + ".sc"), "w") as f:
+                    f.write("  300 10.00 0.00 0.00 chr1:1-60000 101 200 " +
+                            "(59800) " + family + " 1 100 (0)\n")
+        table = os.path.join(d, "thresholds.txt")
+        previous = "DF0000002\t" + MATRIX + "\t250.0\t240.0\t250.0\n"
+        with open(table, "w") as f:
+            f.write("DF0000001\t" + MATRIX + "\t1.0\t1.0\t1.0\n" + previous)
+        assert batchScoreThresholds(roots[0], roots[1], table, 2,
+                                    subject_size=SUBJECT_SIZE) == 1
+        with open(table, "r") as f:
+            lines = f.readlines()
+        # the failed family keeps its previous row
+        assert len(lines) == 2 and lines[1] == previous
+        assert lines[0].startswith("DF0000001\t" + MATRIX + "\t")
+        assert lines[0] != "DF0000001\t" + MATRIX + "\t1.0\t1.0\t1.0\n"
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(d)
+
+if __name__ == '__main__':
+    test_adaptiveMinScore()
+    test_batchScoreThresholds()
+    print("Tests finished for score_thresholds.py")
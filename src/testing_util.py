@@ -0,0 +1,77 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+testing_util.py - Helpers shared by the test suites (test_*.py):
+random sequences, a consensus fa file and GC bins written to a
+temporary directory.
+
+The scripts find ../data relative to the working directory, so tests
+reading matrices or Gumbel parameters run from this directory with
+chdirSrc, restoring the old working directory when they are done:
+
+    cwd = chdirSrc()
+    try:
+        ...
+    finally:
+        os.chdir(cwd)
+
+AUTHOR(S):
+    Eric Yeh
+"""
+
+#
+# Module imports
+#
+import os
+import random
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+CONSENSUS_NAME = "DF0000001"
+
+def chdirSrc():
+    """
+    chdirSrc() - Changes the working directory to this directory.
+
+    Returns: the previous working directory.
+    """
+    cwd = os.getcwd()
+    os.chdir(SRC_DIR)
+    return cwd
+
+def randomSeq(n):
+    """
+    randomSeq(n) - Random sequence of n bases, drawn with the random
+    module (seed it for reproducible tests).
+    """
+    return "".join([random.choice("ACGT") for i in range(n)])
+
+def writeConsensus(directory, seq, name=CONSENSUS_NAME):
+    """
+    writeConsensus(directory, seq, name) - Writes a [name].fa consensus
+    file of the given sequence, at 14% divergence.
+
+    Returns: path of the fa file.
+    """
+    fa_file = os.path.join(directory, name + ".fa")
+    with open(fa_file, "w") as f:
+        f.write(">" + name + " avg_kimura=14.2 Test\n" + seq + "\n")
+    return fa_file
+
+def writeBin(directory, batches, gc=41, row_length=0):
+    """
+    writeBin(directory, batches, gc, row_length) - Writes the bin[gc].fa
+    file of the given list of (batch name, sequence), row_length bases
+    per line (0 for one line per batch).
+
+    Returns: path of the bin file.
+    """
+    bin_file = os.path.join(directory, "bin" + str(gc) + ".fa")
+    with open(bin_file, "w") as f:
+        for name, seq in batches:
+            f.write(">" + name + "\n")
+            if row_length <= 0:
+                f.write(seq + "\n")
+                continue
+            for i in range(0, len(seq), row_length):
+                f.write(seq[i:i + row_length] + "\n")
+    return bin_file